@@ -0,0 +1,318 @@
+"""
+Adaptive sweeps: asynchronous successive halving (ASHA) on top of
+app.exp_sweep.
+
+Only `jobs` experiments of the sweep are in the queue at a time. While they
+run, the step metrics dvclive writes in their workspace are read. At each
+rung (min_steps, min_steps * eta, min_steps * eta^2, ... steps) a run that
+is not among the best 1/eta of the runs that reached the rung so far is
+stopped with `dvc queue kill`, and the next candidate is queued in its
+place. Runs are compared as they reach a rung, so none waits for a rung to
+fill up.
+
+The sweep is driven by a task of the API process that started it. Sweeps
+whose driver did not finish (the server stopped) are resumed on startup;
+an flock on the sweep file makes sure only one process drives a sweep.
+"""
+import os
+import csv
+import glob
+import json
+import math
+import fcntl
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from app import exp_sweep
+from app import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Where DVC keeps the state of running queue tasks, and their running state
+# (dvc.repo.experiments.executor.base.TaskStatus.RUNNING)
+EXEC_RUN_DIR = os.path.join(".dvc", "tmp", "exps", "run")
+_TASK_RUNNING = 2
+
+# Driver tasks of this process, by sweep file
+_drivers: Dict[str, asyncio.Task] = {}
+
+class SuccessiveHalving:
+    """
+    The stopping rule of ASHA for one metric. Keeps the value every run had
+    at each rung it reached.
+    """
+
+    def __init__(self, min_steps: int, max_steps: int, reduction_factor: int = 3, mode: str = "max"):
+        if min_steps < 1 or reduction_factor < 2:
+            raise ValueError("'min_steps' must be at least 1 and 'reduction_factor' at least 2")
+        if not max_steps or max_steps <= min_steps:
+            raise ValueError("'max_steps' must be greater than 'min_steps'")
+        if mode not in ("max", "min"):
+            raise ValueError("'mode' must be 'max' or 'min'")
+        self.reduction_factor = reduction_factor
+        self.mode = mode
+        self.rungs: List[int] = []
+        rung = min_steps
+        while rung < max_steps:
+            self.rungs.append(rung)
+            rung *= reduction_factor
+        self.recorded: Dict[int, Dict[str, float]] = {rung: {} for rung in self.rungs}
+
+    def _keeps(self, rung: int, run: str) -> bool:
+        values = self.recorded[rung]
+        ranked = sorted(values, key=values.get, reverse=self.mode == "max")
+        return ranked.index(run) < math.ceil(len(ranked) / self.reduction_factor)
+
+    def update(self, run: str, history: List[Tuple[int, float]]) -> Optional[int]:
+        """
+        Judge a run on the rungs it reached since the last update.
+
+        Args:
+            run (str): Name of the run.
+            history (list): (step, value) of the metric, as logged by dvclive
+                (steps count from 0).
+
+        Returns:
+            int: The rung at which the run has to stop, or None.
+        """
+        for rung in self.rungs:
+            if run in self.recorded[rung]:
+                continue
+            value = next((v for step, v in history if step + 1 >= rung and not math.isnan(v)), None)
+            if value is None:
+                return None
+            self.recorded[rung][run] = value
+            if not self._keeps(rung, run):
+                return rung
+        return None
+
+    def results(self, run: str) -> Dict[str, float]:
+        """Value of a run at each rung it reached, by rung."""
+        return {str(rung): self.recorded[rung][run] for rung in self.rungs if run in self.recorded[rung]}
+
+    def restore(self, run: str, results: Dict[str, float]):
+        for rung, value in results.items():
+            if int(rung) in self.recorded:
+                self.recorded[int(rung)][run] = value
+
+def early_stopping_spec(
+    metric: str,
+    mode: str = "max",
+    min_steps: int = 1,
+    max_steps: int = None,
+    reduction_factor: int = 3,
+    metrics_dir: str = "dvclive",
+) -> Dict[str, Any]:
+    """
+    Settings of an adaptive sweep, as stored with it.
+
+    Raises:
+        ValueError: If they do not make a valid successive halving.
+    """
+    rule = SuccessiveHalving(min_steps, max_steps, reduction_factor, mode)
+    return {
+        "metric": metric,
+        "mode": mode,
+        "min_steps": min_steps,
+        "max_steps": max_steps,
+        "reduction_factor": reduction_factor,
+        "metrics_dir": metrics_dir,
+        "rungs": rule.rungs,
+    }
+
+def read_metric(workspace: str, metrics_dir: str, metric: str) -> List[Tuple[int, float]]:
+    """
+    (step, value) pairs dvclive logged for a metric in a workspace so far.
+    """
+    path = os.path.join(workspace, metrics_dir, "plots", "metrics", *metric.split("/")) + ".tsv"
+    history = []
+    try:
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                try:
+                    history.append((int(row["step"]), float(row[os.path.basename(metric)])))
+                except (KeyError, TypeError, ValueError):
+                    # The row being written right now
+                    continue
+    except FileNotFoundError:
+        pass
+    return history
+
+def running_workspaces(project_path: str) -> Dict[str, str]:
+    """
+    Directory each running queue experiment of the project runs in, by
+    experiment name, read from DVC's executor info files.
+    """
+    workspaces = {}
+    for infofile in glob.glob(os.path.join(project_path, EXEC_RUN_DIR, "*", "*.run")):
+        try:
+            with open(infofile, "r") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if info.get("status") == _TASK_RUNNING and info.get("name") and info.get("root_dir"):
+            workspaces[info["name"]] = os.path.join(info["root_dir"], info.get("wdir") or "")
+    return workspaces
+
+def new_adaptive_sweep(
+    project_path: str,
+    sweep_id: str,
+    combinations: List[Dict[str, Any]],
+    early_stopping: Dict[str, Any],
+    jobs: int = 1,
+    targets: List[str] = None,
+) -> Dict[str, Any]:
+    """
+    Save an adaptive sweep with all its runs pending; `run_adaptive_sweep`
+    queues them.
+    """
+    sweep = exp_sweep.new_sweep(project_path, sweep_id, combinations, jobs=jobs, targets=targets)
+    sweep["early_stopping"] = early_stopping
+    for run in sweep["runs"]:
+        run["pending"] = True
+    exp_sweep.save_sweep(project_path, sweep)
+    return sweep
+
+async def _queue_status(project_path: str) -> Dict[str, Dict[str, Any]]:
+    """exp_sweep.queue_status, waiting out commands that hold the project."""
+    while True:
+        try:
+            return await exp_sweep.queue_status(project_path)
+        except scheduler.ProjectBusy:
+            await asyncio.sleep(exp_sweep.POLL_INTERVAL)
+
+async def run_adaptive_sweep(project_path: str, sweep: Dict[str, Any]):
+    """
+    Drive an adaptive sweep until every run has finished or was stopped:
+    keep `jobs` runs in the queue, read their metrics and stop the runs
+    that trail at a rung.
+    """
+    spec = sweep["early_stopping"]
+    rule = SuccessiveHalving(spec["min_steps"], spec["max_steps"], spec["reduction_factor"], spec["mode"])
+    runs = {run["name"]: run for run in sweep["runs"]}
+    for run in sweep["runs"]:
+        rule.restore(run["name"], run.get("rungs", {}))
+    missing: Dict[str, int] = {}
+
+    try:
+        # Runs queued by an earlier driver of the sweep that are not done
+        statuses = await _queue_status(project_path)
+        active = {
+            run["name"] for run in sweep["runs"]
+            if not run.get("pending") and run.get("stopped_at") is None and not run.get("cancelled")
+            and statuses.get(run["name"], {}).get("status") in ("queued", "running")
+        }
+        while True:
+            pending = [run for run in sweep["runs"] if run.get("pending")]
+            if pending and len(active) < sweep["jobs"]:
+                for run in pending[:sweep["jobs"] - len(active)]:
+                    run.pop("pending")
+                    try:
+                        await exp_sweep.queue_run(project_path, run, sweep["targets"])
+                    except Exception as e:
+                        logger.error(f"Sweep {sweep['sweep_id']}: {e}")
+                        run["error"] = str(e)
+                        continue
+                    active.add(run["name"])
+                exp_sweep.save_sweep(project_path, sweep)
+                await exp_sweep.start_workers(project_path, sweep["jobs"])
+
+            statuses = await _queue_status(project_path)
+            workspaces = running_workspaces(project_path)
+            for name in sorted(active):
+                status = statuses.get(name, {}).get("status", "unknown")
+                # A task can briefly be in no list while a worker picks it up
+                missing[name] = missing.get(name, 0) + 1 if status == "unknown" else 0
+                if status in ("success", "failed") or missing[name] > 2:
+                    active.discard(name)
+                    continue
+                if status != "running" or name not in workspaces:
+                    continue
+                history = read_metric(workspaces[name], spec["metrics_dir"], spec["metric"])
+                stop_at = rule.update(name, history)
+                runs[name]["rungs"] = rule.results(name)
+                if stop_at is not None:
+                    logger.info(f"Sweep {sweep['sweep_id']}: stopping {name} at rung {stop_at}")
+                    runs[name]["stopped_at"] = stop_at
+                    await exp_sweep.kill_run(project_path, name)
+                    active.discard(name)
+            exp_sweep.save_sweep(project_path, sweep)
+
+            if not active and not any(run.get("pending") for run in sweep["runs"]):
+                sweep["finished"] = True
+                exp_sweep.save_sweep(project_path, sweep)
+                return
+            await asyncio.sleep(exp_sweep.POLL_INTERVAL)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Adaptive sweep {sweep['sweep_id']} failed: {e}")
+        sweep["error"] = str(e)
+        # Nothing will queue them anymore
+        for run in sweep["runs"]:
+            if run.pop("pending", None):
+                run["interrupted"] = True
+        sweep["finished"] = True
+        exp_sweep.save_sweep(project_path, sweep)
+        raise
+
+def start_driver(project_path: str, sweep: Dict[str, Any]) -> Optional[asyncio.Task]:
+    """
+    Drive an adaptive sweep in a task of this process.
+
+    Returns:
+        Task: The driver, or None when another process drives the sweep.
+    """
+    path = exp_sweep.sweep_file(project_path, sweep["sweep_id"])
+    driver = _drivers.get(path)
+    if driver is not None and not driver.done():
+        return driver
+    lock = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+
+    async def _drive():
+        try:
+            await run_adaptive_sweep(project_path, sweep)
+        finally:
+            # Released with the file
+            lock.close()
+
+    task = asyncio.create_task(_drive())
+    _drivers[path] = task
+    task.add_done_callback(lambda _: _drivers.pop(path, None) if _drivers.get(path) is task else None)
+    return task
+
+async def stop_driver(project_path: str, sweep_id: str):
+    """Stop the driver of a sweep, if this process runs it."""
+    task = _drivers.get(exp_sweep.sweep_file(project_path, sweep_id))
+    if task is not None and not task.done():
+        task.cancel()
+        await asyncio.wait({task})
+
+def resume_sweeps(repo_root: str) -> int:
+    """
+    Start the drivers of the adaptive sweeps of every project whose driver
+    did not finish, e.g. because the server was restarted. Called on server
+    startup.
+
+    Returns:
+        int: Number of sweeps resumed.
+    """
+    resumed = 0
+    pattern = os.path.join(repo_root, "*", "*", exp_sweep.SWEEPS_DIR, "*.json")
+    for path in glob.glob(pattern):
+        project_path = os.path.dirname(path)[:-len(exp_sweep.SWEEPS_DIR)].rstrip(os.sep)
+        sweep = exp_sweep.load_sweep(project_path, os.path.basename(path)[:-len(".json")])
+        if not sweep or not sweep.get("early_stopping") or sweep.get("finished"):
+            continue
+        driver = _drivers.get(path)
+        if driver is not None and not driver.done():
+            continue
+        if start_driver(project_path, sweep) is not None:
+            logger.info(f"Resuming adaptive sweep {sweep['sweep_id']} of {project_path}")
+            resumed += 1
+    return resumed
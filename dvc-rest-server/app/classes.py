@@ -205,6 +205,9 @@ class ShowExperimentsRequest(BaseModel):
     only_changed: bool = False
     force: bool = False
     
+# Scheduling classes, served in this order (see app.scheduler)
+PriorityClass = Literal["interactive", "normal", "batch"]
+
 class RunExperimentRequest(BaseModel):
     quiet: bool = False
     verbose: bool = False
@@ -230,6 +233,26 @@ class RunExperimentRequest(BaseModel):
     keep_running: bool = False
     ignore_errors: bool = False
     targets: Optional[List[str]] = None
+    stream_id: Optional[str] = None  # Output is streamed on /exp/stream/{stream_id}
+    priority: Optional[PriorityClass] = None  # "interactive" for dry runs, "normal" otherwise
+
+class ExperimentSweepRequest(BaseModel):
+    name: Optional[str] = None  # Sweep id, also the prefix of its experiment names
+    grid: Optional[Dict[str, List[Any]]] = None  # Every combination of the values
+    random: Optional[Dict[str, Any]] = None  # Per key: list of values or {"min", "max", "log", "int"}
+    samples: Optional[int] = None  # Combinations drawn for a random sweep
+    seed: Optional[int] = None
+    runs: Optional[List[Dict[str, Any]]] = None  # Explicit combinations
+    set_param: Optional[Dict[str, Any]] = None  # Added to every combination
+    jobs: int = Field(default=1, ge=1)  # `dvc queue start -j`
+    targets: Optional[List[str]] = None
+    # Early stopping by successive halving (ASHA), enabled by `metric`
+    metric: Optional[str] = None  # dvclive metric, e.g. "acc" or "eval/loss"
+    mode: Literal["max", "min"] = "max"
+    min_steps: int = Field(default=1, ge=1)  # First rung, in dvclive steps
+    max_steps: Optional[int] = None  # Steps of a complete run
+    reduction_factor: int = Field(default=3, ge=2)  # Keep the best 1/reduction_factor at each rung
+    metrics_dir: str = "dvclive"
 
 class PipelineStage(BaseModel):
     name: str
@@ -267,6 +290,8 @@ class PipelineExecutionRequest(BaseModel):
     dry_run: bool = False
     targets: Optional[List[str]] = None
     parameters: Dict[str, Any] = {}
+    parallel_jobs: Optional[int] = None  # run up to N independent stages at the same time
+    priority: Optional[PriorityClass] = None  # "interactive" for dry runs, "normal" otherwise
 
 class PipelineExecutionResult(BaseModel):
     execution_id: str
@@ -587,17 +612,28 @@ class PipelineExecution(BaseModel):
     id: Optional[str] = None
     execution_id: str
     pipeline_config_id: Optional[str] = None
-    status: str  # "running", "completed", "failed", "cancelled"
-    start_time: str
+    status: str  # "queued", "running", "completed", "failed", "cancelled"
+    priority: Optional[str] = None
+    queued_at: Optional[str] = None
+    start_time: Optional[str] = None  # None while queued
     end_time: Optional[str] = None
     duration: Optional[float] = None  # in seconds
+    expected_duration: Optional[float] = None  # predicted from earlier executions, in seconds
+    eta: Optional[Dict[str, Any]] = None  # expected_start, expected_end, remaining while queued or running
     stages: List[Dict[str, Any]] = []
-    output_files: List[str] = []
-    models_produced: List[str] = []
+    # {"path", "stage", "md5", "size", "nfiles"} records from dvc.lock
+    # (plain paths in executions recorded by older versions)
+    output_files: List[Union[str, Dict[str, Any]]] = []
+    models_produced: List[Union[str, Dict[str, Any]]] = []
     logs: List[str] = []
     error_message: Optional[str] = None
     parameters_used: Dict[str, Any] = {}
     metrics: Dict[str, Any] = {}
+    progress: Dict[str, Any] = {}  # stages_total, stages_started, current_stage
+    # {"stage", "limit"} for each resource limit a failed run went over
+    limit_breaches: List[Dict[str, Any]] = []
+    # Project state left by a completed execution, used to memoize requests
+    fingerprint: Optional[str] = None
 
 class PipelineExecutionCreate(BaseModel):
     pipeline_config_id: str
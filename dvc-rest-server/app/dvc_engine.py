@@ -0,0 +1,367 @@
+import os
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any
+from app import scheduler
+
+logger = logging.getLogger(__name__)
+
+# The DVC Python API is optional: when it cannot be imported every query
+# raises EngineUnavailable and the handlers fall back to the `dvc` CLI.
+try:
+    from dvc.repo import Repo
+except ImportError:  # pragma: no cover - depends on the environment
+    Repo = None
+
+# Maximum number of projects kept open at the same time
+MAX_OPEN_REPOS = int(os.getenv("DVC_ENGINE_MAX_REPOS", "64"))
+
+_repos: "OrderedDict[str, Any]" = OrderedDict()
+_repo_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+class EngineUnavailable(Exception):
+    """Raised when the in-process engine cannot answer a query."""
+
+def is_available() -> bool:
+    """
+    Check whether the DVC Python API can be used in this process.
+    """
+    return Repo is not None
+
+def _close(project_path: str, repo, lock: threading.Lock):
+    """
+    Close a repo that was dropped from the cache. A query that fetched it
+    before it was dropped may still be running, so its lock is taken first.
+    """
+    with lock:
+        try:
+            repo.close()
+        except Exception as e:
+            logger.warning(f"Failed to close DVC repo {project_path}: {e}")
+
+def _get_repo(project_path: str):
+    """
+    Return the open Repo for a project, opening it on first use.
+
+    Repos are kept in an LRU cache so frequently polled projects never pay
+    the DVC import and repo discovery cost twice.
+    """
+    if Repo is None:
+        raise EngineUnavailable("dvc is not installed in the server environment")
+
+    project_path = os.path.realpath(project_path)
+    if not os.path.isdir(os.path.join(project_path, ".dvc")):
+        raise EngineUnavailable(f"DVC is not initialized in {project_path}")
+
+    evicted = []
+    with _registry_lock:
+        repo = _repos.get(project_path)
+        if repo is not None:
+            _repos.move_to_end(project_path)
+            return repo, _repo_locks[project_path]
+
+        repo = Repo(project_path)
+        lock = threading.Lock()
+        _repos[project_path] = repo
+        _repo_locks[project_path] = lock
+
+        # Evict the least recently used repos
+        while len(_repos) > MAX_OPEN_REPOS:
+            old_path, old_repo = _repos.popitem(last=False)
+            evicted.append((old_path, old_repo, _repo_locks.pop(old_path)))
+
+    # Closed outside of the registry lock: waiting for a running query there
+    # would hold up every other project
+    for old_path, old_repo, old_lock in evicted:
+        _close(old_path, old_repo, old_lock)
+    return repo, lock
+
+async def _query(project_path: str, func, exclusive: bool = False):
+    """
+    Run `func(repo)` against the cached repo in a worker thread.
+
+    Repo objects are not thread-safe, so queries on the same project are
+    serialized. The repo state is reset first so that changes made to
+    dvc.yaml, dvc.lock or params files by other commands are picked up.
+    Queries that take the DVC repo lock must pass `exclusive=True` so the
+    scheduler keeps them away from running commands.
+    """
+    def _run():
+        repo, lock = _get_repo(project_path)
+        with lock:
+            repo._reset()
+            return func(repo)
+
+    try:
+        async with scheduler.project_lock(project_path, exclusive=exclusive):
+            return await asyncio.to_thread(_run)
+    except (EngineUnavailable, scheduler.ProjectBusy):
+        raise
+    except Exception as e:
+        # Drop the cached repo so the next query starts from a clean state
+        close_repo(project_path)
+        raise EngineUnavailable(f"DVC engine query failed: {str(e)}") from e
+
+def _encode(value: Any) -> Any:
+    """Make DVC results JSON serializable (DVC stores errors as exceptions)."""
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, BaseException):
+        return {"type": type(value).__name__, "msg": str(value)}
+    return value
+
+async def get_status(project_path: str, targets: List[str] = None) -> Dict[str, Any]:
+    """
+    Equivalent of `dvc status --json [targets]` for the workspace.
+    """
+    # Repo.status takes the DVC repo lock
+    return await _query(project_path, lambda repo: _encode(repo.status(targets=targets)), exclusive=True)
+
+async def list_outs(project_path: str) -> List[str]:
+    """
+    List every output tracked by the project (stage outs and .dvc files).
+    """
+    def _outs(repo):
+        return [
+            os.path.relpath(out.fs_path, repo.root_dir)
+            for out in repo.index.outs
+        ]
+    return await _query(project_path, _outs)
+
+async def get_metrics(project_path: str, all_commits: bool = False) -> Dict[str, Any]:
+    """
+    Equivalent of `dvc metrics show --json`.
+    """
+    def _metrics(repo):
+        from dvc.repo.metrics.show import to_relpath
+        metrics = repo.metrics.show(all_commits=all_commits)
+        return _encode({
+            rev: to_relpath(repo.fs, repo.root_dir, value)
+            for rev, value in metrics.items()
+        })
+    return await _query(project_path, _metrics)
+
+def format_metrics_table(metrics: Dict[str, Any], all_commits: bool = False) -> str:
+    """
+    Render metrics the same way the plain `dvc metrics show` table does.
+    """
+    from dvc.compare import metrics_table
+    from tabulate import tabulate
+
+    table = metrics_table(metrics, all_commits=all_commits, precision=5, round_digits=True)
+    return tabulate(list(table), headers=table.keys(), tablefmt="plain")
+
+async def get_params(project_path: str) -> Dict[str, Any]:
+    """
+    Equivalent of `dvc params show --json`.
+    """
+    return await _query(project_path, lambda repo: _encode(repo.params.show()))
+
+async def get_remotes(project_path: str) -> Dict[str, Any]:
+    """
+    Read the configured remotes without running `dvc remote list`.
+
+    Returns:
+        dict: {"default": <name or None>, "remotes": {name: {"url": ...}}}
+    """
+    def _remotes(repo):
+        config = repo.config
+        remotes = {
+            name: {"url": settings.get("url")}
+            for name, settings in config.get("remote", {}).items()
+        }
+        return {"default": config.get("core", {}).get("remote"), "remotes": remotes}
+    return await _query(project_path, _remotes)
+
+def _stage_label(repo, stage) -> str:
+    """Stage name as used on the command line, relative to the repo root."""
+    relpath = os.path.relpath(stage.path, repo.root_dir)
+    name = getattr(stage, "name", None)
+    if not name:
+        # Stages from .dvc files are addressed by their file
+        return relpath
+    if relpath == "dvc.yaml":
+        return name
+    return f"{relpath}:{name}"
+
+async def get_dag(project_path: str) -> Dict[str, Any]:
+    """
+    Return the stage DAG of the project.
+
+    Returns:
+        dict: {"stages": [names in topological order],
+               "edges": [[upstream, downstream], ...]}
+    """
+    def _dag(repo):
+        import networkx as nx
+
+        graph = repo.index.graph
+        # DVC edges point from a stage to the stages it depends on
+        order = [_stage_label(repo, stage) for stage in reversed(list(nx.topological_sort(graph)))]
+        edges = [
+            [_stage_label(repo, upstream), _stage_label(repo, downstream)]
+            for downstream, upstream in graph.edges()
+        ]
+        return {"stages": order, "edges": edges}
+    return await _query(project_path, _dag)
+
+async def get_stage_plan(project_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Return what is needed to reproduce the stages of the project one by
+    one (see app.parallel_repro).
+
+    Returns:
+        dict: {stage: {"cmd": [...], "frozen": bool, "is_import": bool,
+                       "upstream": [stages it depends on]}}
+               in topological order.
+    """
+    def _plan(repo):
+        import networkx as nx
+
+        graph = repo.index.graph
+        plan = {}
+        for stage in reversed(list(nx.topological_sort(graph))):
+            cmd = stage.cmd or []
+            plan[_stage_label(repo, stage)] = {
+                "cmd": cmd if isinstance(cmd, list) else [cmd],
+                "frozen": stage.frozen,
+                "is_import": stage.is_import,
+                "upstream": [_stage_label(repo, upstream) for upstream in graph.successors(stage)],
+            }
+        return plan
+    return await _query(project_path, _plan)
+
+async def get_queue_status(project_path: str) -> List[Dict[str, Any]]:
+    """
+    Equivalent of `dvc queue status`: every task in the experiment queue
+    with its "rev", "name", "timestamp" and "status".
+    """
+    def _status(repo):
+        queue = repo.experiments.celery_queue
+        # DVC looks tasks up with celery's current app, which is set per
+        # thread and queries run in worker threads
+        queue.celery.set_current()
+        return [
+            {**entry, "timestamp": entry["timestamp"].isoformat() if entry.get("timestamp") else None}
+            for entry in queue.status()
+        ]
+    return await _query(project_path, _status)
+
+async def get_experiment_table(
+    project_path: str,
+    all_commits: bool = False,
+    rev: str = None,
+    num: int = 1,
+    param_deps: bool = False,
+) -> Dict[str, Any]:
+    """
+    The table `dvc exp show` prints, as data.
+
+    Returns:
+        dict: {"columns": [...], "rows": [[...], ...],
+               "groups": {"metrics": [...], "params": [...], "deps": [...]}}.
+               Missing and failed cells are None; numbers are floats.
+    """
+    def _table(repo):
+        from dvc.repo.experiments.show import tabulate
+
+        states = repo.experiments.show(revs=rev, all_commits=all_commits, num=num, param_deps=param_deps)
+        table, groups = tabulate(states, fill_value=None, error_value="!", iso=True)
+
+        columns = list(table.keys())
+        numeric = set(groups["metrics"]) | set(groups["params"])
+
+        def _cell(column, value):
+            if value is None or isinstance(value, (int, float, bool)):
+                return value
+            # Cells come as rich Text, formatted for the terminal
+            text = str(value)
+            if text in ("", "!"):
+                return None
+            if column in numeric:
+                try:
+                    return float(text)
+                except ValueError:
+                    pass
+            return text
+
+        return {
+            "columns": columns,
+            "rows": [[_cell(column, value) for column, value in zip(columns, row)] for row in table],
+            "groups": {name: list(columns) for name, columns in groups.items()},
+        }
+    return await _query(project_path, _table)
+
+async def get_revision_data(project_path: str, revs: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Params and metrics of some commits, read from git without touching the
+    workspace. The files of each kind are merged into one tree.
+
+    Returns:
+        dict: {rev: {"params": {...}, "metrics": {...}}}
+    """
+    def _merge(result) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {}
+        for file_result in (result or {}).get("data", {}).values():
+            # Files that could not be read have an "error" instead of "data"
+            merged.update(file_result.get("data") or {})
+        return merged
+
+    def _data(repo):
+        params = repo.params.show(revs=revs)
+        metrics = repo.metrics.show(revs=revs)
+        return {
+            rev: _encode({"params": _merge(params.get(rev)), "metrics": _merge(metrics.get(rev))})
+            for rev in revs
+        }
+    return await _query(project_path, _data)
+
+async def check_pipeline(project_path: str) -> Dict[str, Any]:
+    """
+    Load every dvc.yaml/.dvc file and build the stage graph.
+
+    This catches syntax errors, overlapping outputs and cycles, which is
+    what the pipeline validation endpoint needs.
+    """
+    def _check(repo):
+        repo.index.check_graph()
+        return {"stages": len(repo.index.stages)}
+
+    if Repo is None:
+        raise EngineUnavailable("dvc is not installed in the server environment")
+
+    def _run():
+        repo, lock = _get_repo(project_path)
+        with lock:
+            repo._reset()
+            return _check(repo)
+
+    # Validation errors are the expected result here, so they are not
+    # wrapped into EngineUnavailable like in _query.
+    async with scheduler.project_lock(project_path, exclusive=False):
+        return await asyncio.to_thread(_run)
+
+def close_repo(project_path: str):
+    """
+    Close and forget the cached repo of a project.
+    """
+    project_path = os.path.realpath(project_path)
+    with _registry_lock:
+        repo = _repos.pop(project_path, None)
+        lock = _repo_locks.pop(project_path, None)
+    if repo is not None:
+        _close(project_path, repo, lock)
+
+def close_all():
+    """
+    Close every cached repo. Called on server shutdown.
+    """
+    with _registry_lock:
+        paths = list(_repos.keys())
+    for path in paths:
+        close_repo(path)
@@ -1,9 +1,12 @@
 import os
 from subprocess import run, CalledProcessError
-import asyncio
-from asyncio.subprocess import PIPE
+import copy
 import logging
-import yaml
+from app import worker_pool
+from app import scheduler
+from app import process_runner
+from app import pipeline_index
+from app import worktree_pool
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -34,12 +37,18 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
     keep_running: bool = False,
     ignore_errors: bool = False,
     targets: list = None,
+    log_callback=None,
+    cwd: str = None,
 ):
     """
     Run a new experiment using `dvc exp run` with all supported flags.
 
+    A temporary experiment (`temp`) runs in a pooled checkout of the
+    project (see app.worktree_pool) instead of a DVC temp directory, so
+    experiments of one project run side by side; it is then copied to the
+    project like DVC does for `--temp`.
+
     Args:
-        cwd (str): The directory to run the command in.
         quiet (bool, optional): Suppress command output.
         verbose (bool, optional): Provide verbose command output.
         force (bool, optional): Re-run pipeline stages even if their outputs are up-to-date.
@@ -64,6 +73,10 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
         keep_running (bool, optional): Keep running if there are errors.
         ignore_errors (bool, optional): Ignore errors during stage execution.
         targets (list, optional): List of targets to reproduce.
+        log_callback (callable, optional): Coroutine called with (stream, line)
+            for every line of output while the experiment runs.
+        cwd (str, optional): The directory to run the command in, instead of
+            the project.
 
     Returns:
         str: The output of the `dvc exp run` command.
@@ -71,8 +84,8 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
     Raises:
         Exception: If the `dvc exp run` command fails.
     """
-    
-    project_path = os.path.join(REPO_ROOT, user_id, project_id)
+    arguments = dict(locals())
+    project_path = cwd or os.path.join(REPO_ROOT, user_id, project_id)
     
     # Validate project path exists
     if not os.path.exists(project_path):
@@ -86,41 +99,30 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
     if not os.path.exists(dvc_dir):
         raise Exception(f"DVC not initialized: {dvc_dir} not found")
     
+    # Temporary experiments run in a pooled checkout instead of a DVC temp dir
+    if temp and not queue and not run_all and cwd is None and worktree_pool.is_enabled():
+        try:
+            async with worktree_pool.lease(project_path) as checkout:
+                stdout = await dvc_exp_run(**{**arguments, "temp": False, "cwd": checkout})
+                await worktree_pool.publish_experiments(checkout, project_path)
+            return stdout
+        except worktree_pool.WorkspaceNotCopied as e:
+            logger.warning(f"{e}; running the temporary experiment in the project")
+    
     # If we have parameters to set, first update the params.yaml file
     if set_param and isinstance(set_param, dict):
-        params_file = os.path.join(project_path, "params.yaml")
-        
-        # Read existing params.yaml if it exists
+        # Read existing params.yaml and the stage parameters of dvc.yaml
         existing_params = {}
-        if os.path.exists(params_file):
-            try:
-                with open(params_file, 'r') as f:
-                    existing_params = yaml.safe_load(f) or {}
-            except Exception as e:
-                logger.warning(f"Could not read existing params.yaml: {e}")
-                existing_params = {}
-        
-        # Check if this is a DVC project with stages
-        dvc_yaml_path = os.path.join(project_path, "dvc.yaml")
         stage_params = {}
-        if os.path.exists(dvc_yaml_path):
-            try:
-                with open(dvc_yaml_path, 'r') as f:
-                    dvc_config = yaml.safe_load(f)
-                    if dvc_config and 'stages' in dvc_config:
-                        # Extract stage parameters
-                        for stage_name, stage_config in dvc_config['stages'].items():
-                            if 'params' in stage_config:
-                                for param in stage_config['params']:
-                                    if '.' in param:
-                                        stage, param_name = param.split('.', 1)
-                                        if stage == stage_name:
-                                            stage_params[param_name] = stage_name
-            except Exception as e:
-                logger.warning(f"Could not read dvc.yaml: {e}")
+        try:
+            index = pipeline_index.get_index(project_path)
+            existing_params = copy.deepcopy(index.params)
+            stage_params = index.param_owners()
+        except Exception as e:
+            logger.warning(f"Could not read params.yaml/dvc.yaml: {e}")
         
         # Update parameters with proper structure
-        updated_params = existing_params.copy()
+        updated_params = existing_params
         for param_name, param_value in set_param.items():
             # Check if this parameter belongs to a specific stage
             if param_name in stage_params:
@@ -134,8 +136,7 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
         
         # Write updated params.yaml
         try:
-            with open(params_file, 'w') as f:
-                yaml.dump(updated_params, f, default_flow_style=False)
+            pipeline_index.write_params(project_path, updated_params)
             logger.info(f"Updated params.yaml with new parameters: {list(set_param.keys())}")
         except Exception as e:
             logger.warning(f"Could not update params.yaml: {e}")
@@ -169,24 +170,12 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
     if set_param:
         # Handle both list and dict formats
         if isinstance(set_param, dict):
-            # Check if this is a DVC project with stages
-            dvc_yaml_path = os.path.join(project_path, "dvc.yaml")
+            # Map parameters to the stages that namespace them
             stage_params = {}
-            if os.path.exists(dvc_yaml_path):
-                try:
-                    with open(dvc_yaml_path, 'r') as f:
-                        dvc_config = yaml.safe_load(f)
-                        if dvc_config and 'stages' in dvc_config:
-                            # Extract stage parameters
-                            for stage_name, stage_config in dvc_config['stages'].items():
-                                if 'params' in stage_config:
-                                    for param in stage_config['params']:
-                                        if '.' in param:
-                                            stage, param_name = param.split('.', 1)
-                                            if stage == stage_name:
-                                                stage_params[param_name] = stage_name
-                except Exception as e:
-                    logger.warning(f"Could not read dvc.yaml for parameter conversion: {e}")
+            try:
+                stage_params = pipeline_index.get_index(project_path).param_owners()
+            except Exception as e:
+                logger.warning(f"Could not read dvc.yaml for parameter conversion: {e}")
             
             # Convert dict to list of "key=value" strings with proper stage prefixes
             param_list = []
@@ -239,27 +228,26 @@ async def dvc_exp_run(user_id: str, project_id: str,quiet: bool = False,
         env = os.environ.copy()
         env['PATH'] = f"{os.path.expanduser('~/.local/bin')}:{env.get('PATH', '')}"
         
-        process = await asyncio.create_subprocess_shell(
-            command, 
-            cwd=project_path, 
-            stdout=asyncio.subprocess.PIPE, 
-            stderr=asyncio.subprocess.PIPE,
-            env=env
-        )
-        stdout, stderr = await process.communicate()
+        async with scheduler.command_slot(command, project_path):
+            if log_callback is not None:
+                returncode, stdout, stderr = await process_runner.run_command(
+                    command, cwd=project_path, on_line=log_callback, env=env
+                )
+            else:
+                returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path, env=env)
 
         # Log the output for debugging
         if stdout:
-            logger.info(f"DVC stdout: {stdout.decode().strip()}")
+            logger.info(f"DVC stdout: {stdout}")
         if stderr:
-            logger.warning(f"DVC stderr: {stderr.decode().strip()}")
+            logger.warning(f"DVC stderr: {stderr}")
 
-        if process.returncode != 0:
-            error_msg = stderr.decode().strip() if stderr else "Unknown error"
-            logger.error(f"DVC command failed with return code {process.returncode}: {error_msg}")
+        if returncode != 0:
+            error_msg = stderr if stderr else "Unknown error"
+            logger.error(f"DVC command failed with return code {returncode}: {error_msg}")
             raise Exception(f"`dvc exp run` failed: {error_msg}")
 
-        return stdout.decode().strip()
+        return stdout
     except Exception as e:
         logger.error(f"Exception during DVC command execution: {str(e)}")
         raise
@@ -354,15 +342,13 @@ async def dvc_exp_show(user_id: str, project_id: str,     quiet: bool = False,
     env = os.environ.copy()
     env['PATH'] = f"{os.path.expanduser('~/.local/bin')}:{env.get('PATH', '')}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path, env=env)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp show` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp show` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_exp_list(user_id: str, project_id: str, git_remote: str = None):
     """
@@ -384,15 +370,13 @@ async def dvc_exp_list(user_id: str, project_id: str, git_remote: str = None):
     env = os.environ.copy()
     env['PATH'] = f"{os.path.expanduser('~/.local/bin')}:{env.get('PATH', '')}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path, env=env)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp list` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp list` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_exp_apply(user_id: str, project_id: str, experiment_id: str):
     """
@@ -408,15 +392,13 @@ async def dvc_exp_apply(user_id: str, project_id: str, experiment_id: str):
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
     command = f"dvc exp apply {experiment_id}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp apply` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp apply` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_exp_remove(user_id: str, project_id: str, experiment_ids: list, queue: bool = False):
     """
@@ -437,15 +419,13 @@ async def dvc_exp_remove(user_id: str, project_id: str, experiment_ids: list, qu
     if experiment_ids:
         command += f" {' '.join(experiment_ids)}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp remove` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp remove` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_exp_pull(user_id: str, project_id: str, git_remote: str, experiment_id: str):
     """
@@ -462,15 +442,13 @@ async def dvc_exp_pull(user_id: str, project_id: str, git_remote: str, experimen
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
     command = f"dvc exp pull {git_remote} {experiment_id}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp pull` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp pull` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_exp_push(user_id: str, project_id: str, git_remote: str, experiment_id: str):
     """
@@ -487,15 +465,13 @@ async def dvc_exp_push(user_id: str, project_id: str, git_remote: str, experimen
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
     command = f"dvc exp push {git_remote} {experiment_id}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp push` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp push` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_exp_save(user_id: str, project_id: str, name: str = None, force: bool = False):
     """
@@ -516,15 +492,13 @@ async def dvc_exp_save(user_id: str, project_id: str, name: str = None, force: b
     if force:
         command += " --force"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc exp save` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc exp save` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_plots_diff(
     user_id: str, project_id:str,
@@ -576,12 +550,10 @@ async def dvc_plots_diff(
     if out:
         command += f" --out {out}"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc plots diff` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc plots diff` failed: {stderr}")
 
-    return stdout.decode().strip()
\ No newline at end of file
+    return stdout
\ No newline at end of file
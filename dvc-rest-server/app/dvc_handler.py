@@ -1,14 +1,21 @@
 import os
 from subprocess import run, CalledProcessError
-import asyncio
-from asyncio.subprocess import PIPE
 import logging
+import copy
 import hashlib
 from datetime import datetime
 import yaml
 import json
 from pathlib import Path
 from typing import Dict, List, Any, Optional
+from app import dvc_engine
+from app import worker_pool
+from app import scheduler
+from app import process_runner
+from app import parallel_repro
+from app import pipeline_index
+from app import staleness
+from app import stage_shell
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -26,25 +33,21 @@ async def create_user_directory(user_id: str):
 async def run_command_async(command: str, cwd: str = None):
     """
     Execute a shell command asynchronously in the specified directory.
+
+    Plain `dvc` commands run on a pre-warmed worker from app.worker_pool.
+    The output returned is bounded (see `process_runner.OutputBuffer`).
     """
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=cwd,
-        stdout=PIPE,
-        stderr=PIPE
-    )
-    stdout, stderr = await process.communicate()
-
-    if process.returncode != 0:
-        error_msg = stderr.decode().strip()
-        output_msg = stdout.decode().strip()
-        full_error = f"Command '{command}' failed with return code {process.returncode}"
+    async with scheduler.command_slot(command, cwd):
+        returncode, output_msg, error_msg = await worker_pool.run_command(command, cwd=cwd)
+
+    if returncode != 0:
+        full_error = f"Command '{command}' failed with return code {returncode}"
         if error_msg:
             full_error += f"\nError: {error_msg}"
         if output_msg:
             full_error += f"\nOutput: {output_msg}"
         raise Exception(full_error)
-    return stdout.decode().strip()
+    return output_msg
 
 async def is_dvc_initialized(project_path: str) -> bool:
     """
@@ -52,6 +55,73 @@ async def is_dvc_initialized(project_path: str) -> bool:
     """
     return os.path.exists(os.path.join(project_path, ".dvc"))
 
+def _pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def clear_stale_dvc_locks(project_path: str) -> int:
+    """
+    Drop the entries of processes that no longer exist from DVC's path lock
+    (.dvc/tmp/rwlock), e.g. after a cancelled run was killed.
+
+    The repo lock (.dvc/tmp/lock) is an flock and is released by the kernel
+    when its owner dies, so only the rwlock needs cleaning.
+
+    Returns:
+        int: The number of entries removed.
+    """
+    lock_dir = os.path.join(project_path, ".dvc", "tmp")
+    if not os.path.exists(os.path.join(lock_dir, "rwlock")):
+        return 0
+    try:
+        from dvc.config import Config
+        from dvc.lock import LockError, make_lock
+    except ImportError:
+        logger.warning(f"dvc is not installed in the server environment, not cleaning the DVC locks of {project_path}")
+        return 0
+
+    # Commands still running on the project edit the file too, under the
+    # same lock as DVC takes for it
+    hardlink = Config(dvc_dir=os.path.join(project_path, ".dvc"))["core"].get("hardlink_lock", False)
+    guard = make_lock(os.path.join(lock_dir, "rwlock.lock"), tmp_dir=lock_dir, hardlink_lock=hardlink)
+    try:
+        with guard:
+            return _clear_stale_rwlock_entries(project_path, os.path.join(lock_dir, "rwlock"))
+    except LockError:
+        logger.warning(f"DVC's rwlock of {project_path} is busy, not cleaning it")
+        return 0
+
+def _clear_stale_rwlock_entries(project_path: str, rwlock_path: str) -> int:
+    try:
+        with open(rwlock_path, "r") as f:
+            rwlock = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+    removed = 0
+    for path, info in list((rwlock.get("write") or {}).items()):
+        if not _pid_exists(int(info.get("pid", 0))):
+            del rwlock["write"][path]
+            removed += 1
+    for path, infos in list((rwlock.get("read") or {}).items()):
+        alive = [info for info in infos if _pid_exists(int(info.get("pid", 0)))]
+        removed += len(infos) - len(alive)
+        if alive:
+            rwlock["read"][path] = alive
+        else:
+            del rwlock["read"][path]
+
+    if removed:
+        with open(rwlock_path, "w") as f:
+            json.dump(rwlock, f)
+        logger.info(f"Removed {removed} stale DVC lock entries in {project_path}")
+    return removed
+
 async def is_git_initialized(project_path: str) -> bool:
     """
     Check if GIT is initialized in the given project path.
@@ -134,19 +204,13 @@ async def get_url(user_id: str, project_id: str, url: str, dest: str = "."):
     print(f"Running command: {command} in {project_path}")
     print(f"Running command: {command} in {project_path}")
 
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=project_path,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=project_path)
 
-    stdout, stderr = await process.communicate()
+    if returncode != 0:
+        raise Exception(f"`dvc get-url` failed: {stderr}")
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc get-url` failed: {stderr.decode().strip()}")
-
-    print(f"DVC output: {stdout.decode().strip()}")
+    print(f"DVC output: {stdout}")
     
     # Add the downloaded file to dvc
     await run_command_async(f"dvc add {dest}", cwd=project_path)
@@ -157,7 +221,7 @@ async def get_url(user_id: str, project_id: str, url: str, dest: str = "."):
     await run_command_async(f"git push", cwd=project_path)
     
     
-    return stdout.decode().strip()
+    return stdout
 
 async def track_data(user_id: str, project_id: str, files: list):
     """
@@ -165,9 +229,10 @@ async def track_data(user_id: str, project_id: str, files: list):
     """
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
     try:
-        for file in files:
-            await run_command_async(f"dvc add {file}", cwd=project_path)
-        await run_command_async("git commit -m 'tracking data'", cwd=project_path)
+        async with scheduler.project_lock(project_path):
+            for file in files:
+                await run_command_async(f"dvc add {file}", cwd=project_path)
+            await run_command_async("git commit -m 'tracking data'", cwd=project_path)
         
         return "Data tracked successfully."
     except Exception as e:
@@ -179,9 +244,10 @@ async def track_files(user_id: str, project_id: str, files: list):
     """
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
     try:
-        for file in files:
-            await run_command_async(f"dvc add {file}", cwd=project_path)
-        await run_command_async("git commit -m 'tracking: {files}'", cwd=project_path)
+        async with scheduler.project_lock(project_path):
+            for file in files:
+                await run_command_async(f"dvc add {file}", cwd=project_path)
+            await run_command_async("git commit -m 'tracking: {files}'", cwd=project_path)
         
         return "Data tracked successfully."
     except Exception as e:
@@ -254,18 +320,13 @@ async def list_dvc_branches(cwd: str = None):
         list: A list of branch names.
     """
     command = "dvc exp branch --list"
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=cwd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, cwd):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=cwd)
 
-    if process.returncode != 0:
-        raise Exception(f"Error listing DVC branches: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"Error listing DVC branches: {stderr}")
 
-    return stdout.decode().strip().split("\n")
+    return stdout.split("\n")
 
 async def checkout_dvc_branch(branch_name: str, cwd: str = None):
     """
@@ -279,16 +340,11 @@ async def checkout_dvc_branch(branch_name: str, cwd: str = None):
         str: Confirmation message of the checkout.
     """
     command = f"git checkout {branch_name}"
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=cwd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, cwd):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=cwd)
 
-    if process.returncode != 0:
-        raise Exception(f"Error checking out branch {branch_name}: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"Error checking out branch {branch_name}: {stderr}")
 
     return f"Checked out to branch: {branch_name}"
 
@@ -304,16 +360,11 @@ async def create_dvc_branch(branch_name: str, cwd: str = None):
         str: Confirmation message of branch creation.
     """
     command = f"dvc exp branch {branch_name}"
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=cwd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, cwd):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=cwd)
 
-    if process.returncode != 0:
-        raise Exception(f"Error creating DVC branch {branch_name}: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"Error creating DVC branch {branch_name}: {stderr}")
 
     return f"Branch '{branch_name}' created successfully."
     
@@ -329,16 +380,11 @@ async def delete_dvc_branch(branch_name: str, cwd: str = None):
         str: Confirmation message of branch deletion.
     """
     command = f"git branch -D {branch_name}"
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=cwd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, cwd):
+        returncode, stdout, stderr = await process_runner.run_command(command, cwd=cwd)
 
-    if process.returncode != 0:
-        raise Exception(f"Error deleting branch {branch_name}: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"Error deleting branch {branch_name}: {stderr}")
 
     return f"Branch '{branch_name}' deleted successfully."    
     
@@ -370,28 +416,29 @@ async def add_stages(user_id: str, project_id:str, stages: list):
         successful_stages = []
         failed_stages = []
         
-        for i, stage_command in enumerate(stages):
-            if not stage_command or not stage_command.strip():
-                continue
+        async with scheduler.project_lock(project_path):
+            for i, stage_command in enumerate(stages):
+                if not stage_command or not stage_command.strip():
+                    continue
                 
-            try:
-                print(f"Executing stage {i+1}/{len(stages)}: {stage_command}")
-                await run_command_async(stage_command.strip(), cwd=project_path)
-                successful_stages.append(stage_command)
-            except Exception as e:
-                error_msg = str(e)
-                failed_stages.append(f"Stage {i+1}: {error_msg}")
+                try:
+                    print(f"Executing stage {i+1}/{len(stages)}: {stage_command}")
+                    await run_command_async(stage_command.strip(), cwd=project_path)
+                    successful_stages.append(stage_command)
+                except Exception as e:
+                    error_msg = str(e)
+                    failed_stages.append(f"Stage {i+1}: {error_msg}")
         
-        # If any stages failed, report them
-        if failed_stages:
-            error_details = "; ".join(failed_stages)
-            raise Exception(f"Some stages failed: {error_details}")
+            # If any stages failed, report them
+            if failed_stages:
+                error_details = "; ".join(failed_stages)
+                raise Exception(f"Some stages failed: {error_details}")
         
-        # Add the dvc.yaml file to git
-        await run_command_async("git add dvc.yaml", cwd=project_path)
+            # Add the dvc.yaml file to git
+            await run_command_async("git add dvc.yaml", cwd=project_path)
         
-        # Commit all changes
-        await run_command_async(f'git commit -m "Added {len(successful_stages)} DVC stages"', cwd=project_path)
+            # Commit all changes
+            await run_command_async(f'git commit -m "Added {len(successful_stages)} DVC stages"', cwd=project_path)
         
         return f"Successfully added {len(successful_stages)} stages."
         
@@ -467,14 +514,15 @@ async def add_stage(user_id: str, project_id:str, name: str, deps: list = None,
         
         print(f"Executing DVC stage command: {stage_command}")
         
-        # Execute the stage creation command
-        await run_command_async(stage_command, cwd=project_path)
+        async with scheduler.project_lock(project_path):
+            # Execute the stage creation command
+            await run_command_async(stage_command, cwd=project_path)
         
-        # Add the dvc.yaml file to git
-        await run_command_async("git add dvc.yaml", cwd=project_path)
+            # Add the dvc.yaml file to git
+            await run_command_async("git add dvc.yaml", cwd=project_path)
         
-        # Commit the changes
-        await run_command_async(f'git commit -m "Added DVC stage: {name}"', cwd=project_path)
+            # Commit the changes
+            await run_command_async(f'git commit -m "Added DVC stage: {name}"', cwd=project_path)
         
         return f"Stage '{name}' added successfully."
         
@@ -490,6 +538,10 @@ async def repro(
     dry_run: bool = False,
     no_commit: bool = False,
     cwd: str = None,
+    log_callback=None,
+    jobs: int = None,
+    stage_stats_file: str = None,
+    git_commit: bool = True,
 ):
     """
     Run the `dvc repro` command with various options to reproduce a pipeline stage.
@@ -503,6 +555,17 @@ async def repro(
         dry_run (bool, optional): Show what will be done without actually executing.
         no_commit (bool, optional): Do not commit changes to cache.
         cwd (str, optional): Directory to run the `dvc repro` command.
+        log_callback (callable, optional): Coroutine called with (stream, line)
+            for every line of output while the command runs. When given, only
+            the tail of the output is returned.
+        jobs (int, optional): Run up to `jobs` independent stages at the same
+            time instead of one after another.
+        stage_stats_file (str, optional): Record the timing, exit status,
+            CPU time and peak RSS of every stage command in this file
+            (JSON lines, see `stage_shell.read_stage_stats`).
+        git_commit (bool, optional): Commit the updated dvc.lock to git
+            afterwards. Off for runs in a pooled checkout, which is reset
+            once the run is over.
 
     Returns:
         str: The output of the `dvc repro` command.
@@ -510,7 +573,7 @@ async def repro(
     Raises:
         Exception: If the `dvc repro` command fails.
     """
-    project_path = os.path.join(REPO_ROOT, user_id, project_id)
+    project_path = cwd or os.path.join(REPO_ROOT, user_id, project_id)
     
     # Build the command
     command = "dvc repro"
@@ -528,27 +591,74 @@ async def repro(
     # Print debugging info (optional)
     print(f"Running command: {command} in {project_path}")
 
-    # Run the command asynchronously
-    process = await asyncio.create_subprocess_shell(
-        command,
-        cwd=project_path,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
+    # Hold the project until the results are committed
+    async with scheduler.project_lock(project_path):
+        if jobs and jobs > 1 and not dry_run and not no_commit:
+            try:
+                stdout = await parallel_repro.parallel_repro(
+                    project_path,
+                    targets=[target] if target else None,
+                    pipeline=pipeline,
+                    force=force,
+                    jobs=jobs,
+                    log_callback=log_callback,
+                    stage_stats_file=stage_stats_file,
+                )
+                if git_commit:
+                    await safe_git_commit(project_path, "pipeline repro")
+                return stdout
+            except parallel_repro.ParallelReproUnsupported as e:
+                print(f"Parallel repro not possible ({str(e)}), running `{command}`")
+
+        # DVC runs stage commands with $SHELL, which records their cost
+        env = stage_shell.stage_env(stage_stats_file) if stage_stats_file else None
+        async with scheduler.command_slot(command, project_path):
+            if log_callback is not None:
+                # Stream the output as it is produced
+                returncode, stdout, stderr = await process_runner.run_command(
+                    command, cwd=project_path, on_line=log_callback, env=env
+                )
+            else:
+                # Run the command on a pre-warmed DVC worker
+                returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path, env=env)
 
-    if process.returncode != 0:
-        raise Exception(f"Error running `dvc repro`: {stderr.decode().strip()}")
+        if returncode != 0:
+            raise Exception(f"Error running `dvc repro`: {stderr}")
     
-    # Use safe git commit to handle cases where there are no changes
-    await safe_git_commit(project_path, "pipeline repro")
+        # Use safe git commit to handle cases where there are no changes
+        if git_commit:
+            await safe_git_commit(project_path, "pipeline repro")
+
+    return stdout
+
+async def dry_run_pipeline(user_id: str, project_id: str) -> Dict[str, Any]:
+    """
+    Find out what `dvc repro` would run, without running it.
+
+    The native staleness check is used when the project allows it, which
+    avoids starting `dvc repro --dry`.
+
+    Returns:
+        dict: {"output": str, "stale_stages": list or None when DVC was used}
+    """
+    project_path = os.path.join(REPO_ROOT, user_id, project_id)
 
-    return stdout.decode().strip()
+    try:
+        result = await staleness.get_staleness(project_path)
+        return {"output": staleness.format_dry_run(result), "stale_stages": result["stale"]}
+    except staleness.StalenessUnsupported as e:
+        logger.info(f"Falling back to `dvc repro --dry` for {user_id}/{project_id}: {str(e)}")
+
+    output = await repro(user_id, project_id, pipeline=True, dry_run=True)
+    return {"output": output, "stale_stages": None}
 
 async def dvc_metrics_show(user_id: str, project_id:str, all_commits: bool = False, json: bool = False, yaml: bool = False):
     """
     Show metrics using `dvc metrics show`.
 
+    Metrics are read in-process through the DVC engine; the CLI is only
+    used when the engine is not available.
+
     Args:
         cwd (str): The directory to run the command in.
         all_commits (bool, optional): Show metrics from all commits.
@@ -559,6 +669,20 @@ async def dvc_metrics_show(user_id: str, project_id:str, all_commits: bool = Fal
         str: The output of the `dvc metrics show` command.
     """
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
+
+    try:
+        metrics = await dvc_engine.get_metrics(project_path, all_commits=all_commits)
+        # `json` and `yaml` are flags here and shadow the modules
+        if json:
+            import json as json_module
+            return json_module.dumps(metrics)
+        if yaml:
+            import yaml as yaml_module
+            return yaml_module.safe_dump(metrics, default_flow_style=False)
+        return dvc_engine.format_metrics_table(metrics, all_commits=all_commits)
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc metrics show` for {user_id}/{project_id}: {str(e)}")
+
     command = "dvc metrics show"
     if all_commits:
         command += " --all-commits"
@@ -567,15 +691,38 @@ async def dvc_metrics_show(user_id: str, project_id:str, all_commits: bool = Fal
     if yaml:
         command += " --yaml"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+
+    if returncode != 0:
+        raise Exception(f"`dvc metrics show` failed: {stderr}")
+
+    return stdout
+
+async def dvc_params_show(user_id: str, project_id: str):
+    """
+    Show the parameters used by the pipeline, like `dvc params show --json`.
+
+    Args:
+        user_id (str): The user ID
+        project_id (str): The project ID
+
+    Returns:
+        dict: Parameters per revision and params file.
+    """
+    project_path = os.path.join(REPO_ROOT, user_id, project_id)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc metrics show` failed: {stderr.decode().strip()}")
+    try:
+        return await dvc_engine.get_params(project_path)
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc params show` for {user_id}/{project_id}: {str(e)}")
 
-    return stdout.decode().strip()
+    command = "dvc params show --json"
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+    if returncode != 0:
+        raise Exception(f"`dvc params show` failed: {stderr}")
+    return json.loads(stdout) if stdout else {}
 
 async def dvc_metrics_diff(
     user_id: str, project_id:str,
@@ -624,15 +771,13 @@ async def dvc_metrics_diff(
     if md:
         command += " --md"
 
-    process = await asyncio.create_subprocess_shell(
-        command, cwd=project_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
 
-    if process.returncode != 0:
-        raise Exception(f"`dvc metrics diff` failed: {stderr.decode().strip()}")
+    if returncode != 0:
+        raise Exception(f"`dvc metrics diff` failed: {stderr}")
 
-    return stdout.decode().strip()
+    return stdout
 
 async def dvc_plots_show(
     user_id: str, project_id:str,
@@ -708,23 +853,106 @@ async def dvc_plots_diff(
     except Exception as e:
         raise Exception(f"Failed to show plots diff: {str(e)}")
 
+def _empty_dvc_status():
+    return {
+        "tracked": [],
+        "untracked": [],
+        "modified": [],
+        "total_size": 0
+    }
+
+def _file_size(project_path: str, file_path: str) -> int:
+    try:
+        return os.path.getsize(os.path.join(project_path, file_path))
+    except OSError:
+        return 0
+
+async def _get_dvc_status_from_engine(project_path: str):
+    """
+    Build the status result from the in-process `repo.status()` output.
+    """
+    status = await dvc_engine.get_status(project_path)
+    outs = await dvc_engine.list_outs(project_path)
+
+    result = _empty_dvc_status()
+    seen = set()
+
+    for entries in status.values():
+        for entry in entries:
+            if not isinstance(entry, dict):
+                # e.g. "always changed"
+                continue
+            for changes in entry.values():
+                if not isinstance(changes, dict):
+                    continue
+                for file_path, state in changes.items():
+                    if file_path in seen:
+                        continue
+                    # Params report a dict of changed keys instead of a state
+                    if isinstance(state, dict) or state == "modified":
+                        section = "modified"
+                    else:
+                        # "new", "deleted", "not in cache"
+                        section = "untracked"
+                    seen.add(file_path)
+                    file_size = _file_size(project_path, file_path)
+                    result[section].append({"path": file_path, "size": file_size})
+                    result["total_size"] += file_size
+
+    for file_path in outs:
+        if file_path in seen:
+            continue
+        file_size = _file_size(project_path, file_path)
+        result["tracked"].append({"path": file_path, "size": file_size})
+        result["total_size"] += file_size
+
+    return result
+
+async def _get_dvc_status_from_staleness(project_path: str):
+    """
+    Build the status result from the native staleness check.
+    """
+    result_staleness = await staleness.get_staleness(project_path)
+
+    result = _empty_dvc_status()
+    for file_path, state in result_staleness["files"].items():
+        section = "modified" if state == "modified" else "untracked"
+        file_size = _file_size(project_path, file_path)
+        result[section].append({"path": file_path, "size": file_size})
+        result["total_size"] += file_size
+
+    for file_path in dict.fromkeys(result_staleness["outs"]):
+        if file_path in result_staleness["files"]:
+            continue
+        file_size = _file_size(project_path, file_path)
+        result["tracked"].append({"path": file_path, "size": file_size})
+        result["total_size"] += file_size
+
+    result["stale_stages"] = result_staleness["stale"]
+    return result
+
 async def get_dvc_status(user_id: str, project_id: str):
     """
     Get DVC status showing tracked, untracked, and modified files.
     """
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
-    
+
+    try:
+        return await _get_dvc_status_from_staleness(project_path)
+    except staleness.StalenessUnsupported as e:
+        logger.info(f"Falling back to the DVC engine for the status of {user_id}/{project_id}: {str(e)}")
+
+    try:
+        return await _get_dvc_status_from_engine(project_path)
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc status` for {user_id}/{project_id}: {str(e)}")
+
     try:
         # Get DVC status
         status_output = await run_command_async("dvc status", cwd=project_path)
         
         # Initialize result structure
-        result = {
-            "tracked": [],
-            "untracked": [],
-            "modified": [],
-            "total_size": 0
-        }
+        result = _empty_dvc_status()
         
         # Parse the status output
         lines = status_output.strip().split('\n')
@@ -757,10 +985,7 @@ async def get_dvc_status(user_id: str, project_id: str):
                     file_path = parts[0]
                     
                     # Get file size
-                    try:
-                        file_size = os.path.getsize(os.path.join(project_path, file_path))
-                    except OSError:
-                        file_size = 0
+                    file_size = _file_size(project_path, file_path)
                     
                     file_info = {
                         "path": file_path,
@@ -775,12 +1000,7 @@ async def get_dvc_status(user_id: str, project_id: str):
     except Exception as e:
         # If DVC status fails, return empty result
         logger.warning(f"DVC status failed for {user_id}/{project_id}: {str(e)}")
-        return {
-            "tracked": [],
-            "untracked": [],
-            "modified": [],
-            "total_size": 0
-        }
+        return _empty_dvc_status()
 
 async def create_pipeline_template(user_id: str, project_id: str, template_name: str, stages: list):
     """
@@ -875,6 +1095,7 @@ async def create_pipeline_template(user_id: str, project_id: str, template_name:
         
         with open(dvc_yaml_path, 'w') as f:
             f.write(dvc_yaml_content)
+        pipeline_index.invalidate(project_path)
         
         print("dvc.yaml file written successfully")
         
@@ -912,8 +1133,7 @@ async def get_pipeline_stages(user_id: str, project_id: str):
         return {"stages": {}}
     
     try:
-        with open(dvc_yaml_path, 'r') as f:
-            pipeline_config = yaml.safe_load(f)
+        pipeline_config = pipeline_index.get_index(project_path).config
         
         return pipeline_config or {"stages": {}}
     except Exception as e:
@@ -939,8 +1159,8 @@ async def update_pipeline_stage(user_id: str, project_id: str, stage_name: str,
         raise Exception("No dvc.yaml file found")
     
     try:
-        with open(dvc_yaml_path, 'r') as f:
-            pipeline_config = yaml.safe_load(f) or {"stages": {}}
+        # Copy: the cached index is shared with other requests
+        pipeline_config = copy.deepcopy(pipeline_index.get_index(project_path).config) or {"stages": {}}
         
         # Update the stage
         if 'stages' not in pipeline_config:
@@ -954,8 +1174,7 @@ async def update_pipeline_stage(user_id: str, project_id: str, stage_name: str,
             pipeline_config['stages'][stage_name][key] = value
         
         # Write back to file
-        with open(dvc_yaml_path, 'w') as f:
-            yaml.dump(pipeline_config, f, default_flow_style=False)
+        pipeline_index.write_dvc_yaml(project_path, pipeline_config)
         
         # Add to git and commit
         await run_command_async("git add dvc.yaml", cwd=project_path)
@@ -985,8 +1204,8 @@ async def remove_pipeline_stage(user_id: str, project_id: str, stage_name: str):
         raise Exception("No dvc.yaml file found")
     
     try:
-        with open(dvc_yaml_path, 'r') as f:
-            pipeline_config = yaml.safe_load(f) or {"stages": {}}
+        # Copy: the cached index is shared with other requests
+        pipeline_config = copy.deepcopy(pipeline_index.get_index(project_path).config) or {"stages": {}}
         
         # Remove the stage
         if 'stages' in pipeline_config and stage_name in pipeline_config['stages']:
@@ -995,8 +1214,7 @@ async def remove_pipeline_stage(user_id: str, project_id: str, stage_name: str):
             raise Exception(f"Stage '{stage_name}' not found")
         
         # Write back to file
-        with open(dvc_yaml_path, 'w') as f:
-            yaml.dump(pipeline_config, f, default_flow_style=False)
+        pipeline_index.write_dvc_yaml(project_path, pipeline_config)
         
         # Add to git and commit
         await run_command_async("git add dvc.yaml", cwd=project_path)
@@ -1021,13 +1239,18 @@ async def validate_pipeline(user_id: str, project_id: str):
     project_path = os.path.join(REPO_ROOT, user_id, project_id)
     
     try:
-        # Run dvc check to validate the pipeline
-        result = await run_command_async("dvc check", cwd=project_path)
+        if dvc_engine.is_available():
+            # Load the stages and build the DAG in-process
+            result = await dvc_engine.check_pipeline(project_path)
+            details = f"{result['stages']} stages loaded"
+        else:
+            # `dvc dag` fails on invalid dvc.yaml files, overlapping outputs and cycles
+            details = await run_command_async("dvc dag", cwd=project_path)
         
         return {
             "valid": True,
             "message": "Pipeline validation successful",
-            "details": result
+            "details": details
         }
     except Exception as e:
         return {
@@ -1036,6 +1259,47 @@ async def validate_pipeline(user_id: str, project_id: str):
             "details": str(e)
         }
 
+async def get_pipeline_dag(user_id: str, project_id: str):
+    """
+    Gets the stage DAG of the pipeline.
+    
+    Args:
+        user_id (str): The user ID
+        project_id (str): The project ID
+    
+    Returns:
+        dict: Stages in topological order and the edges between them
+    """
+    project_path = os.path.join(REPO_ROOT, user_id, project_id)
+    
+    try:
+        return await dvc_engine.get_dag(project_path)
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc dag` for {user_id}/{project_id}: {str(e)}")
+    
+    # `dvc dag --dot` lists the edges as `"downstream" -> "upstream";`
+    command = "dvc dag --dot"
+    async with scheduler.command_slot(command, project_path):
+        returncode, result, stderr = await process_runner.capture_command(command, cwd=project_path)
+    if returncode != 0:
+        raise Exception(f"`dvc dag` failed: {stderr}")
+    stages = []
+    edges = []
+    for line in result.splitlines():
+        line = line.strip().rstrip(";")
+        if "->" in line:
+            downstream, upstream = [part.strip().strip('"') for part in line.split("->", 1)]
+            edges.append([upstream, downstream])
+            for name in (upstream, downstream):
+                if name not in stages:
+                    stages.append(name)
+        elif line.startswith('"') and line.endswith('"'):
+            name = line.strip('"')
+            if name not in stages:
+                stages.append(name)
+    
+    return {"stages": stages, "edges": edges}
+
 # Data Source Management Functions
 
 async def add_data_source(user_id: str, project_id: str, name: str, source_type: str, source_path: str, destination: str, description: str = None):
@@ -1244,6 +1508,19 @@ async def list_remote_storages(user_id: str, project_id: str):
     if not os.path.exists(project_path):
         raise Exception(f"Project path does not exist: {project_path}")
     
+    try:
+        config = await dvc_engine.get_remotes(project_path)
+        remotes = {}
+        for name, settings in config["remotes"].items():
+            remotes[name] = {
+                "name": name,
+                "url": settings["url"],
+                "type": "default" if name == config["default"] else "cache"
+            }
+        return {"remotes": remotes}
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc remote list` for {user_id}/{project_id}: {str(e)}")
+    
     try:
         # Get remote storage information
         result = await run_command_async("dvc remote list", cwd=project_path)
@@ -1732,6 +2009,7 @@ async def create_parameter_set(user_id: str, project_id: str, parameter_set: Dic
         params_file = os.path.join(project_path, "params.yaml")
         with open(params_file, 'w') as f:
             f.write(yaml_content)
+        pipeline_index.invalidate(project_path)
         
         # Add to git using safe commit
         git_success = await safe_git_commit(
@@ -1784,6 +2062,7 @@ async def update_parameter_set(user_id: str, project_id: str, parameter_set: Dic
         # Save updated parameters
         with open(params_file, 'w') as f:
             f.write(yaml_content)
+        pipeline_index.invalidate(project_path)
         
         # Add to git using safe commit
         git_success = await safe_git_commit(
@@ -2331,6 +2610,7 @@ async def import_parameters_from_upload(user_id: str, project_id: str, file_cont
         
         with open(params_yaml_path, 'w') as f:
             f.write(params_yaml_content)
+        pipeline_index.invalidate(project_path)
         
         result["params_yaml_path"] = params_yaml_path
         result["params_yaml_content"] = params_yaml_content
@@ -2414,22 +2694,23 @@ async def safe_git_commit(project_path: str, commit_message: str, files_to_add:
         bool: True if successful, False otherwise
     """
     try:
-        # Check if there are any changes to commit
-        result = await run_command_async("git status --porcelain", cwd=project_path)
-        if not result.strip():
-            print("No changes to commit")
-            return True
-        
-        # Add files to staging
-        if files_to_add:
-            for file_path in files_to_add:
-                await run_command_async(f"git add {file_path}", cwd=project_path)
-        else:
-            # Add all changes including untracked files
-            await run_command_async("git add .", cwd=project_path)
+        async with scheduler.project_lock(project_path):
+            # Check if there are any changes to commit
+            result = await run_command_async("git status --porcelain", cwd=project_path)
+            if not result.strip():
+                print("No changes to commit")
+                return True
+        
+            # Add files to staging
+            if files_to_add:
+                for file_path in files_to_add:
+                    await run_command_async(f"git add {file_path}", cwd=project_path)
+            else:
+                # Add all changes including untracked files
+                await run_command_async("git add .", cwd=project_path)
         
-        # Commit the changes
-        await run_command_async(f'git commit -m "{commit_message}"', cwd=project_path)
+            # Commit the changes
+            await run_command_async(f'git commit -m "{commit_message}"', cwd=project_path)
         return True
         
     except Exception as e:
@@ -0,0 +1,150 @@
+"""
+Long-lived DVC worker process used by app.worker_pool.
+
+The worker imports DVC (and the configured heavy libraries) once and then
+executes `dvc` commands in-process. Jobs are read as JSON lines from stdin
+and results are written as JSON lines to stdout:
+
+    job:    {"argv": ["repro", "train"], "cwd": "/path/to/project", "env": {...}}
+    result: {"returncode": 0, "stdout": "...", "stderr": "...",
+             "rss_mb": 312.5, "recycle": false}
+
+Run with `python -m app.dvc_worker`.
+"""
+import os
+import sys
+import json
+import tempfile
+import importlib
+import traceback
+from app.process_runner import OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES, join_output
+
+PRELOAD_MODULES = [
+    name.strip()
+    for name in os.getenv("DVC_WORKER_PRELOAD", "dvc.cli,dvc.repo,pandas,sklearn").split(",")
+    if name.strip()
+]
+MAX_JOBS = int(os.getenv("DVC_WORKER_MAX_JOBS", "50"))
+MAX_RSS_MB = float(os.getenv("DVC_WORKER_MAX_RSS_MB", "1024"))
+
+def _rss_mb() -> float:
+    """
+    Current resident set size of the worker in megabytes.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Not on Linux: fall back to the peak RSS (reported in KB on Linux,
+        # bytes on macOS, so this is only a rough guard)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _read_output(f) -> str:
+    """
+    Start and end of a captured stream, bounded like the output of the
+    commands the server runs itself.
+    """
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    head = f.read(OUTPUT_HEAD_BYTES)
+    tail_start = max(len(head), size - OUTPUT_TAIL_BYTES)
+    f.seek(tail_start)
+    tail = f.read()
+    return join_output(head, tail_start - len(head), tail)
+
+def run_job(job: dict) -> dict:
+    """
+    Execute a single `dvc` command in this process.
+
+    stdout/stderr are redirected at the file descriptor level so the output
+    of the stage commands DVC spawns is captured as well.
+    """
+    from dvc.cli import main as dvc_main
+
+    saved_cwd = os.getcwd()
+    saved_env = dict(os.environ)
+    out = tempfile.TemporaryFile()
+    err = tempfile.TemporaryFile()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+    os.dup2(out.fileno(), 1)
+    os.dup2(err.fileno(), 2)
+    try:
+        if job.get("env") is not None:
+            os.environ.clear()
+            os.environ.update(job["env"])
+        if job.get("cwd"):
+            os.chdir(job["cwd"])
+        try:
+            returncode = dvc_main(job["argv"])
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 255
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+    try:
+        return {
+            "returncode": returncode if returncode is not None else 0,
+            "stdout": _read_output(out),
+            "stderr": _read_output(err),
+        }
+    finally:
+        out.close()
+        err.close()
+
+def main():
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"dvc worker: could not preload {name}: {e}", file=sys.stderr)
+
+    # Keep the protocol pipes on private descriptors so that nothing a job
+    # prints, and no child process it starts, can read from or write to them.
+    proto_in = os.fdopen(os.dup(0), "rb")
+    proto_out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    os.close(devnull)
+
+    def send(message: dict):
+        proto_out.write(json.dumps(message).encode() + b"\n")
+        proto_out.flush()
+
+    send({"ready": True, "pid": os.getpid()})
+
+    jobs = 0
+    for line in proto_in:
+        if not line.strip():
+            continue
+        result = run_job(json.loads(line))
+        jobs += 1
+
+        rss = _rss_mb()
+        result["rss_mb"] = round(rss, 1)
+        result["recycle"] = bool(
+            (MAX_JOBS and jobs >= MAX_JOBS) or (MAX_RSS_MB and rss >= MAX_RSS_MB)
+        )
+        send(result)
+        if result["recycle"]:
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import re
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+# Windows reported when the caller does not ask for specific ones
+DEFAULT_WINDOWS = ["1h", "24h", "7d"]
+
+PERCENTILES = (50, 95, 99)
+
+_WINDOW = re.compile(r"^(\d+)([mhdw])$")
+_WINDOW_UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+def parse_window(window: str) -> timedelta:
+    """
+    Parse a window such as "30m", "24h", "7d" or "2w".
+
+    Raises:
+        ValueError: If the window is not in that form.
+    """
+    match = _WINDOW.match(window.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid time window '{window}', expected e.g. 30m, 24h, 7d or 2w")
+    return timedelta(**{_WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+def _group_stage(key) -> Dict[str, Any]:
+    """
+    $group stage counting finished runs and collecting the durations of the
+    successful ones. Percentiles are taken from the sorted durations here
+    rather than with $percentile, which needs MongoDB 7.0.
+    """
+    return {
+        "$group": {
+            "_id": key,
+            "runs": {"$sum": 1},
+            "failed": {"$sum": {"$cond": [{"$eq": ["$status", "failed"]}, 1, 0]}},
+            "durations": {
+                "$push": {"$cond": [
+                    {"$and": [{"$eq": ["$status", "completed"]}, {"$ne": ["$duration", None]}]},
+                    "$duration",
+                    "$$REMOVE",
+                ]}
+            },
+        }
+    }
+
+def build_pipeline(user_id: str, project_id: str, since: str, config_id: str = None) -> List[Dict[str, Any]]:
+    """
+    Aggregation over pipeline_executions for the executions of a project that
+    finished after `since` (ISO timestamp).
+
+    The $match uses the (user_id, project_id, end_time) index; end_time is an
+    ISO string, so the range compares in time order.
+    """
+    match: Dict[str, Any] = {
+        "user_id": user_id,
+        "project_id": project_id,
+        "end_time": {"$gte": since},
+        "status": {"$in": ["completed", "failed"]},
+    }
+    if config_id:
+        match["pipeline_config_id"] = config_id
+
+    return [
+        {"$match": match},
+        {"$project": {"pipeline_config_id": 1, "status": 1, "duration": 1, "stages": 1}},
+        {"$facet": {
+            "project": [_group_stage(None)],
+            "configs": [_group_stage("$pipeline_config_id")],
+            "stages": [
+                {"$unwind": "$stages"},
+                {"$replaceRoot": {"newRoot": "$stages"}},
+                _group_stage("$name"),
+            ],
+        }},
+    ]
+
+def summarize_group(group: Dict[str, Any], hours: float) -> Dict[str, Any]:
+    """Turn one $group result into the figures returned by the API."""
+    durations = sorted(group.get("durations") or [])
+    runs = group.get("runs", 0)
+    failed = group.get("failed", 0)
+    summary = {
+        "runs": runs,
+        "completed": runs - failed,
+        "failed": failed,
+        "failure_rate": round(failed / runs, 4) if runs else None,
+        # Finished runs per hour
+        "throughput_per_hour": round(runs / hours, 4) if hours else None,
+    }
+    for p in PERCENTILES:
+        value = percentile(durations, p)
+        summary[f"p{p}_duration"] = round(value, 3) if value is not None else None
+    return summary
+
+async def get_execution_stats(collection, user_id: str, project_id: str, windows: List[str] = None,
+                              config_id: str = None, now: datetime = None) -> Dict[str, Any]:
+    """
+    Duration percentiles, failure rate and throughput of a project's pipeline
+    executions, per project, configuration and stage, for each rolling window.
+
+    Args:
+        collection: The pipeline_executions collection.
+        windows (list): Windows such as "24h" or "7d" (default DEFAULT_WINDOWS).
+        config_id (str): Only count executions of this configuration.
+
+    Returns:
+        dict: {window: {"since", "project", "configs", "stages"}}
+
+    Raises:
+        ValueError: If a window is invalid.
+    """
+    windows = windows or DEFAULT_WINDOWS
+    spans = {window: parse_window(window) for window in windows}
+    now = now or datetime.now()
+
+    results = {}
+    for window, span in spans.items():
+        since = (now - span).isoformat()
+        hours = span.total_seconds() / 3600
+        facets = await collection.aggregate(build_pipeline(user_id, project_id, since, config_id)).to_list(1)
+        facets = facets[0] if facets else {}
+
+        project = facets.get("project") or [{}]
+        results[window] = {
+            "since": since,
+            "project": summarize_group(project[0], hours),
+            "configs": {
+                # Executions started without a configuration are under "none"
+                str(group["_id"] or "none"): summarize_group(group, hours)
+                for group in facets.get("configs", [])
+            },
+            "stages": {
+                str(group["_id"]): summarize_group(group, hours)
+                for group in facets.get("stages", [])
+                if group["_id"] is not None
+            },
+        }
+    return results
+
+async def predict_duration(collection, user_id: str, project_id: str, config_id: str = None,
+                           targets: List[str] = None, dry_run: bool = False,
+                           history: int = 20) -> Optional[float]:
+    """
+    Expected duration (seconds) of an execution, from the project's recent
+    completed executions.
+
+    The median duration of the last `history` runs of the same configuration
+    and targets is used. Without such runs, the per-stage medians of the
+    project's recent runs are added up: over the targets when they are
+    stage names, otherwise over every stage seen.
+
+    Returns:
+        float: The prediction, or None without any history.
+    """
+    query: Dict[str, Any] = {
+        "user_id": user_id,
+        "project_id": project_id,
+        "status": "completed",
+        "duration": {"$ne": None},
+        "options.dry_run": True if dry_run else {"$ne": True},
+    }
+    recent = await collection.find(
+        query, {"pipeline_config_id": 1, "duration": 1, "options.targets": 1, "stages": 1}
+    ).sort([("end_time", -1)]).limit(history * 5).to_list(history * 5)
+
+    targets = sorted(targets or [])
+    same = [
+        execution["duration"] for execution in recent
+        if execution.get("pipeline_config_id") == config_id
+        and sorted((execution.get("options") or {}).get("targets") or []) == targets
+    ]
+    same = sorted(same[:history])
+    if same:
+        return round(percentile(same, 50), 3)
+
+    stage_durations: Dict[str, List[float]] = {}
+    for execution in recent:
+        for stage in execution.get("stages") or []:
+            if stage.get("status") == "completed" and stage.get("duration") is not None:
+                stage_durations.setdefault(stage["name"], []).append(stage["duration"])
+    names = [t for t in targets if t in stage_durations] if targets else list(stage_durations)
+    if not names or (targets and len(names) < len(targets)):
+        return None
+    return round(sum(percentile(sorted(stage_durations[name]), 50) for name in names), 3)
@@ -0,0 +1,272 @@
+"""
+Index of a project's experiments in MongoDB, one document per experiment
+ref (refs/exps/<baseline[:2]>/<baseline[2:]>/<name>):
+
+    {user_id, project_id, ref, name, rev, baseline, parent, created_at,
+     indexed_at, params: {...}, metrics: {...}}
+
+The index is kept up to date incrementally: a sync lists the experiment
+refs (one `git for-each-ref`), compares them with the indexed ones and only
+reads the params and metrics of the experiments that were added or moved.
+Syncs run after the experiment endpoints change refs, and before the index
+is queried so experiments finished by queue workers are picked up too.
+"""
+import os
+import re
+import json
+import shlex
+import hashlib
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from app import scheduler
+from app import process_runner
+from app import dvc_engine
+from app import exp_table
+from app.worktree_pool import EXPERIMENT_REF
+from app.init_db import get_experiments_collection
+
+logger = logging.getLogger(__name__)
+
+# Largest page of the index one request may ask for
+MAX_PAGE_SIZE = int(os.getenv("EXP_INDEX_MAX_PAGE_SIZE", "1000"))
+
+_REF_FORMAT = "%(refname) %(objectname) %(committerdate:unix) %(parent)"
+
+# Fields of the index that filters and sorting may use
+_QUERY_FIELD = re.compile(r"^(name|rev|baseline|parent|created_at|indexed_at|(params|metrics)\.[A-Za-z0-9_.\-]+)$")
+_MONGO_OPERATORS = {">=": "$gte", "<=": "$lte", ">": "$gt", "<": "$lt"}
+
+# Hash of the experiment refs of each project at its last sync
+_synced: Dict[Tuple[str, str], str] = {}
+_sync_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+_sync_tasks = set()
+_indexes_ready = False
+
+async def _ensure_indexes(collection):
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    await collection.create_index([("user_id", ASCENDING), ("project_id", ASCENDING), ("ref", ASCENDING)], unique=True)
+    await collection.create_index([("user_id", ASCENDING), ("project_id", ASCENDING), ("baseline", ASCENDING)])
+    await collection.create_index([("user_id", ASCENDING), ("project_id", ASCENDING), ("name", ASCENDING)])
+    await collection.create_index([("user_id", ASCENDING), ("project_id", ASCENDING), ("created_at", DESCENDING)])
+    _indexes_ready = True
+
+def _parse_refs(output: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Experiment refs of `git for-each-ref --format=_REF_FORMAT refs/exps`
+    output. DVC's own refs (stash, exec, celery) are skipped.
+    """
+    refs = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 3 or not EXPERIMENT_REF.match(parts[0]):
+            continue
+        ref, rev, timestamp = parts[:3]
+        _, _, prefix, rest, name = ref.split("/", 4)
+        refs[ref] = {
+            "ref": ref,
+            "name": name,
+            "rev": rev,
+            "baseline": prefix + rest,
+            "parent": parts[3] if len(parts) > 3 else None,
+            "created_at": datetime.fromtimestamp(int(timestamp)).isoformat(),
+        }
+    return refs
+
+async def list_experiment_refs(project_path: str) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+    """
+    Returns:
+        tuple: (hash of the refs, {ref: {"ref", "name", "rev", "baseline",
+            "parent", "created_at"}})
+    """
+    command = f"git for-each-ref --format={shlex.quote(_REF_FORMAT)} refs/exps"
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+    if returncode != 0:
+        raise Exception(f"Listing experiment refs failed: {stderr}")
+    return hashlib.sha1(stdout.encode()).hexdigest(), _parse_refs(stdout)
+
+def _nest(flat: Dict[str, Any]) -> Dict[str, Any]:
+    """{"train.lr": 0.1} -> {"train": {"lr": 0.1}}, as the engine returns them."""
+    nested: Dict[str, Any] = {}
+    for key, value in flat.items():
+        node = nested
+        *parents, leaf = key.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if not isinstance(node, dict):
+                break
+        else:
+            node[leaf] = value
+    return nested
+
+async def _read_with_cli(project_path: str, experiment: Dict[str, Any]) -> Dict[str, Any]:
+    """Params and metrics of one experiment, from `dvc params/metrics diff`."""
+    data = {}
+    for kind in ("params", "metrics"):
+        command = f"dvc {kind} diff {experiment['baseline']} {experiment['rev']} --all --json"
+        async with scheduler.command_slot(command, project_path):
+            returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+        if returncode != 0:
+            raise Exception(f"`dvc {kind} diff` failed: {stderr}")
+        # DVC prints warnings about unreadable revisions before the JSON
+        output = stdout[stdout.find("{"):] if "{" in stdout else "{}"
+        flat = {}
+        for values in json.loads(output).values():
+            flat.update({key: value.get("new") for key, value in values.items()})
+        data[kind] = _nest(flat)
+    return data
+
+async def read_experiments(project_path: str, experiments: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Params and metrics of some experiments, by rev.
+    """
+    revs = [experiment["rev"] for experiment in experiments]
+    if not revs:
+        return {}
+    try:
+        return await dvc_engine.get_revision_data(project_path, revs)
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc params/metrics diff` for {project_path}: {str(e)}")
+    return {experiment["rev"]: await _read_with_cli(project_path, experiment) for experiment in experiments}
+
+async def sync_experiments(user_id: str, project_id: str, project_path: str) -> Dict[str, int]:
+    """
+    Bring the index of a project in line with its experiment refs.
+
+    Returns:
+        dict: Number of experiments "added", "updated" and "removed", and
+            the "total" now indexed.
+    """
+    key = (user_id, project_id)
+    lock = _sync_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        digest, refs = await list_experiment_refs(project_path)
+        result = {"added": 0, "updated": 0, "removed": 0, "total": len(refs)}
+        if _synced.get(key) == digest:
+            return result
+
+        collection = await get_experiments_collection()
+        await _ensure_indexes(collection)
+        owner = {"user_id": user_id, "project_id": project_id}
+        indexed = {
+            doc["ref"]: doc["rev"]
+            async for doc in collection.find(owner, {"ref": 1, "rev": 1, "_id": 0})
+        }
+        changed = [experiment for ref, experiment in refs.items() if indexed.get(ref) != experiment["rev"]]
+        removed = [ref for ref in indexed if ref not in refs]
+
+        data = await read_experiments(project_path, changed)
+        now = datetime.now().isoformat()
+        operations = [
+            UpdateOne(
+                {**owner, "ref": experiment["ref"]},
+                {"$set": {**owner, **experiment, **data.get(experiment["rev"], {}), "indexed_at": now}},
+                upsert=True,
+            )
+            for experiment in changed
+        ]
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+        if removed:
+            await collection.delete_many({**owner, "ref": {"$in": removed}})
+
+        _synced[key] = digest
+        result["added"] = sum(1 for experiment in changed if experiment["ref"] not in indexed)
+        result["updated"] = len(changed) - result["added"]
+        result["removed"] = len(removed)
+        return result
+
+def schedule_sync(user_id: str, project_id: str, project_path: str):
+    """
+    Sync the index in the background after a command changed experiment
+    refs; failures are logged and caught up by the next sync.
+    """
+    async def _sync():
+        try:
+            await sync_experiments(user_id, project_id, project_path)
+        except Exception as e:
+            logger.error(f"Indexing the experiments of {user_id}/{project_id} failed: {e}")
+
+    task = asyncio.create_task(_sync())
+    _sync_tasks.add(task)
+    task.add_done_callback(_sync_tasks.discard)
+
+def _value(text: str) -> Any:
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def build_query(user_id: str, project_id: str, filters: List[str] = None) -> Dict[str, Any]:
+    """
+    MongoDB query for "<field><operator><value>" filters, e.g.
+    "metrics.acc>=0.9", "params.train.optimizer==adam" or "name~lr-".
+
+    Raises:
+        ValueError: On filters over unknown fields or with bad values.
+    """
+    query: Dict[str, Any] = {"user_id": user_id, "project_id": project_id}
+    conditions = []
+    for expression in filters or []:
+        field, op, value = exp_table.parse_filter(expression)
+        if not _QUERY_FIELD.match(field):
+            raise ValueError(f"Cannot filter on '{field}': use name, rev, baseline, parent, created_at, params.<key> or metrics.<key>")
+        if op == "~":
+            conditions.append({field: {"$regex": re.escape(value)}})
+        elif op in ("==", "!="):
+            # Numbers are stored as numbers, "0.1" also matches 0.1
+            number = _value(value)
+            values = [value] if number == value else [number, value]
+            if op == "==":
+                conditions.append({field: {"$in": values}})
+            else:
+                # Missing values never match, as in the experiment table
+                conditions.append({field: {"$exists": True, "$nin": values}})
+        else:
+            conditions.append({field: {_MONGO_OPERATORS[op]: _value(value)}})
+    if conditions:
+        query["$and"] = conditions
+    return query
+
+async def query_experiments(
+    user_id: str,
+    project_id: str,
+    filters: List[str] = None,
+    sort_by: str = "created_at",
+    sort_order: str = "desc",
+    offset: int = 0,
+    limit: int = 100,
+) -> Dict[str, Any]:
+    """
+    Page of the indexed experiments of a project.
+
+    Returns:
+        dict: {"total", "offset", "limit", "experiments": [...]}
+
+    Raises:
+        ValueError: On bad filters, sort fields or pages.
+    """
+    if offset < 0 or limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}")
+    if not _QUERY_FIELD.match(sort_by):
+        raise ValueError(f"Cannot sort by '{sort_by}'")
+    if sort_order not in ("asc", "desc"):
+        raise ValueError("sort_order must be 'asc' or 'desc'")
+
+    query = build_query(user_id, project_id, filters)
+    collection = await get_experiments_collection()
+    total = await collection.count_documents(query)
+    cursor = collection.find(query, {"_id": 0}).sort(
+        [(sort_by, ASCENDING if sort_order == "asc" else DESCENDING), ("ref", ASCENDING)]
+    ).skip(offset).limit(limit)
+    return {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "experiments": await cursor.to_list(None),
+    }
@@ -0,0 +1,360 @@
+"""
+Hyperparameter sweeps over `params.yaml` keys, run by DVC's experiment queue.
+
+A sweep expands a grid, random or list spec into parameter combinations,
+queues one experiment per combination (`dvc exp run --queue`) and starts
+`dvc queue` workers. Its experiments are named `<sweep_id>-<n>`, so the
+progress of a sweep is read back from the queue status. The combinations
+are kept in `.dvc/tmp/sweeps/<sweep_id>.json` inside the project.
+"""
+import os
+import re
+import json
+import math
+import random
+import shlex
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from app import scheduler
+from app import worker_pool
+from app import dvc_engine
+
+logger = logging.getLogger(__name__)
+
+# Largest number of experiments one sweep may queue
+MAX_RUNS = int(os.getenv("EXP_SWEEP_MAX_RUNS", "1000"))
+# Seconds between two reads of the queue status while a sweep is followed
+POLL_INTERVAL = float(os.getenv("EXP_SWEEP_POLL_INTERVAL", "5"))
+
+SWEEPS_DIR = os.path.join(".dvc", "tmp", "sweeps")
+QUEUE_START_LOG = os.path.join(".dvc", "tmp", "queue-start.log")
+
+# Sweep ids prefix experiment names, which end up in git refs
+_SWEEP_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+# `dvc queue status` names, as reported per run
+_STATUSES = {"Queued": "queued", "Running": "running", "Success": "success", "Failed": "failed"}
+
+def _sample(name: str, spec: Any, rng: random.Random) -> Any:
+    """
+    Draw one value for a random sweep. `spec` is a list of values to choose
+    from, or {"min", "max"} with optional "log" (log-uniform) and "int".
+    """
+    if isinstance(spec, list):
+        if not spec:
+            raise ValueError(f"No values to choose from for '{name}'")
+        return rng.choice(spec)
+    if not isinstance(spec, dict) or "min" not in spec or "max" not in spec:
+        raise ValueError(f"'{name}' must be a list of values or {{\"min\", \"max\"}}")
+    low, high = spec["min"], spec["max"]
+    if low > high:
+        raise ValueError(f"'{name}': min is greater than max")
+    if spec.get("log"):
+        if low <= 0:
+            raise ValueError(f"'{name}': log-uniform ranges must be positive")
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    if spec.get("int"):
+        return min(max(int(round(value)), math.ceil(low)), math.floor(high))
+    return value
+
+def expand_sweep(
+    grid: Dict[str, List[Any]] = None,
+    random_spec: Dict[str, Any] = None,
+    runs: List[Dict[str, Any]] = None,
+    samples: int = None,
+    seed: int = None,
+    set_param: Dict[str, Any] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Parameter combinations of a sweep, in the order they are queued.
+
+    Args:
+        grid (dict): Values per key; every combination is run.
+        random_spec (dict): Distribution per key (see `_sample`); `samples`
+            combinations are drawn, reproducibly when `seed` is given.
+        runs (list): The combinations themselves.
+        set_param (dict, optional): Values added to every combination.
+
+    Raises:
+        ValueError: If not exactly one spec is given, or it is invalid or
+            larger than MAX_RUNS.
+    """
+    if sum(spec is not None for spec in (grid, random_spec, runs)) != 1:
+        raise ValueError("Give exactly one of 'grid', 'random' or 'runs'")
+
+    if grid is not None:
+        if not grid or any(not isinstance(values, list) or not values for values in grid.values()):
+            raise ValueError("'grid' must map each parameter to a non-empty list of values")
+        total = math.prod(len(values) for values in grid.values())
+        if total > MAX_RUNS:
+            raise ValueError(f"The grid has {total} combinations, more than the limit of {MAX_RUNS}")
+        keys = list(grid)
+        combinations = [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+    elif random_spec is not None:
+        if not random_spec:
+            raise ValueError("'random' must give at least one parameter")
+        if not samples or samples < 1 or samples > MAX_RUNS:
+            raise ValueError(f"'samples' must be between 1 and {MAX_RUNS} for a random sweep")
+        rng = random.Random(seed)
+        combinations = [
+            {name: _sample(name, spec, rng) for name, spec in random_spec.items()}
+            for _ in range(samples)
+        ]
+    else:
+        if not runs or len(runs) > MAX_RUNS:
+            raise ValueError(f"'runs' must list between 1 and {MAX_RUNS} combinations")
+        combinations = [dict(run) for run in runs]
+
+    return [{**(set_param or {}), **combination} for combination in combinations]
+
+def new_sweep_id() -> str:
+    return f"sweep-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+def _override(name: str, value: Any) -> str:
+    """
+    A `-S` override. Values are written as JSON so strings are quoted and
+    never read as DVC/Hydra sweep syntax (`a,b`, `range(...)`).
+    """
+    return shlex.quote(f"{name}={json.dumps(value)}")
+
+def sweep_file(project_path: str, sweep_id: str) -> str:
+    return os.path.join(project_path, SWEEPS_DIR, f"{sweep_id}.json")
+
+def load_sweep(project_path: str, sweep_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(sweep_file(project_path, sweep_id), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_sweep(project_path: str, sweep: Dict[str, Any]):
+    path = sweep_file(project_path, sweep["sweep_id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Replaced in one step, so readers never see a partial file
+    with open(path + ".tmp", "w") as f:
+        json.dump(sweep, f)
+    os.replace(path + ".tmp", path)
+
+def new_sweep(
+    project_path: str,
+    sweep_id: str,
+    combinations: List[Dict[str, Any]],
+    jobs: int = 1,
+    targets: List[str] = None,
+) -> Dict[str, Any]:
+    """
+    The record of a new sweep, with one run per combination (not saved yet).
+
+    Raises:
+        ValueError: If the sweep id is invalid or already used.
+    """
+    if not _SWEEP_ID.match(sweep_id):
+        raise ValueError("Sweep names may only contain letters, digits, '_', '.' and '-'")
+    if os.path.exists(sweep_file(project_path, sweep_id)):
+        raise ValueError(f"A sweep named '{sweep_id}' already exists")
+    return {
+        "sweep_id": sweep_id,
+        "created_at": datetime.now().isoformat(),
+        "jobs": jobs,
+        "targets": targets or [],
+        "runs": [
+            {"name": f"{sweep_id}-{n}", "params": params}
+            for n, params in enumerate(combinations, start=1)
+        ],
+    }
+
+async def queue_run(project_path: str, run: Dict[str, Any], targets: List[str] = None):
+    """Queue the experiment of one run of a sweep."""
+    command = f"dvc exp run --queue -n {shlex.quote(run['name'])}"
+    command += "".join(f" -S {_override(name, value)}" for name, value in run["params"].items())
+    if targets:
+        command += " " + " ".join(shlex.quote(target) for target in targets)
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path)
+    if returncode != 0:
+        raise Exception(f"Queueing experiment {run['name']} failed: {stderr or stdout}")
+
+async def start_workers(project_path: str, jobs: int):
+    """
+    Make sure `jobs` queue workers run. Workers that are still alive are
+    kept; they exit on their own once the queue stays empty.
+    """
+    command = f"dvc queue start -j {jobs}"
+    # The detached workers hold on to the pipes of the command for several
+    # seconds after it is done, so its output goes to a file instead
+    output_file = os.path.join(project_path, QUEUE_START_LOG)
+    async with scheduler.command_slot(command, project_path):
+        returncode, _, _ = await worker_pool.run_command(
+            f"{command} > {shlex.quote(output_file)} 2>&1", cwd=project_path
+        )
+    if returncode != 0:
+        with open(output_file, "r", errors="replace") as f:
+            raise Exception(f"`{command}` failed: {f.read().strip()}")
+
+async def start_sweep(
+    project_path: str,
+    sweep_id: str,
+    combinations: List[Dict[str, Any]],
+    jobs: int = 1,
+    targets: List[str] = None,
+) -> Dict[str, Any]:
+    """
+    Queue one experiment per combination and start `jobs` queue workers.
+
+    The experiments are queued back to back while holding the project, each
+    on a pre-warmed DVC worker, so a sweep of hundreds of runs does not pay
+    for hundreds of `dvc` process starts.
+
+    Returns:
+        dict: The sweep, as stored in the project.
+    """
+    sweep = new_sweep(project_path, sweep_id, combinations, jobs=jobs, targets=targets)
+
+    async with scheduler.project_lock(project_path):
+        save_sweep(project_path, sweep)
+        queued = []
+        try:
+            for run in sweep["runs"]:
+                await queue_run(project_path, run, targets)
+                queued.append(run["name"])
+        except BaseException:
+            # All or nothing: a sweep with a bad combination is not started
+            await remove_runs(project_path, queued)
+            os.remove(sweep_file(project_path, sweep_id))
+            raise
+
+    await start_workers(project_path, jobs)
+    return sweep
+
+async def remove_runs(project_path: str, names: List[str]):
+    """Take queued experiments out of the queue."""
+    if not names:
+        return
+    command = "dvc queue remove " + " ".join(shlex.quote(name) for name in names)
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path)
+    if returncode != 0:
+        logger.warning(f"Could not remove queued experiments {names}: {stderr}")
+
+async def kill_run(project_path: str, name: str):
+    """Stop a running experiment (`dvc queue kill`); it ends as failed."""
+    command = f"dvc queue kill {shlex.quote(name)}"
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path)
+    if returncode != 0:
+        logger.warning(f"Could not kill experiment {name}: {stderr}")
+
+async def cancel_sweep(project_path: str, sweep: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Stop a sweep: kill its running experiments, take its queued ones out of
+    the queue and drop the runs an adaptive sweep has not queued yet. The
+    runs that finished are kept.
+    """
+    statuses = await queue_status(project_path)
+    queued = []
+    for run in sweep["runs"]:
+        status = statuses.get(run["name"], {}).get("status")
+        if run.get("stopped_at") is not None:
+            continue
+        if run.pop("pending", None) or status in ("queued", "running"):
+            run["cancelled"] = True
+        if status == "running":
+            await kill_run(project_path, run["name"])
+        elif status == "queued":
+            queued.append(run["name"])
+    await remove_runs(project_path, queued)
+    save_sweep(project_path, sweep)
+    return sweep
+
+async def queue_status(project_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Status of the experiments in the project's queue, by name.
+    """
+    try:
+        entries = await dvc_engine.get_queue_status(project_path)
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc queue status` for {project_path}: {str(e)}")
+        command = "dvc queue status"
+        async with scheduler.command_slot(command, project_path):
+            returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path)
+        if returncode != 0:
+            raise Exception(f"`dvc queue status` failed: {stderr}")
+        # Task, Name, Created (may contain spaces), Status
+        entries = []
+        for line in stdout.splitlines()[1:]:
+            parts = line.split()
+            if len(parts) >= 4 and parts[-1] in _STATUSES:
+                entries.append({"rev": parts[0], "name": parts[1], "status": parts[-1]})
+    return {
+        entry["name"]: {"rev": entry["rev"], "status": _STATUSES.get(entry["status"], "unknown")}
+        for entry in entries
+        if entry.get("name")
+    }
+
+async def sweep_progress(project_path: str, sweep: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Aggregate progress of a sweep: counts per status and every run with its
+    parameters and status. Runs of an adaptive sweep are "pending" until
+    they are queued and "stopped" when stopped early, or "interrupted" if
+    the sweep's driver failed before queueing them; runs of a cancelled
+    sweep that had not finished are "cancelled". Runs missing from the
+    queue (removed with `dvc queue remove`) are "unknown".
+    """
+    statuses = await queue_status(project_path)
+    counts = {
+        "pending": 0, "queued": 0, "running": 0, "success": 0,
+        "failed": 0, "stopped": 0, "cancelled": 0, "interrupted": 0, "unknown": 0,
+    }
+    runs = []
+    for run in sweep["runs"]:
+        entry = statuses.get(run["name"], {"rev": None, "status": "unknown"})
+        if run.get("stopped_at") is not None:
+            entry = {**entry, "status": "stopped"}
+        elif run.get("cancelled"):
+            entry = {**entry, "status": "cancelled"}
+        elif run.get("interrupted"):
+            entry = {"rev": None, "status": "interrupted"}
+        elif run.get("pending"):
+            entry = {"rev": None, "status": "pending"}
+        counts[entry["status"]] += 1
+        runs.append({**run, **entry})
+    finished = len(runs) - counts["pending"] - counts["queued"] - counts["running"]
+    progress = {
+        "sweep_id": sweep["sweep_id"],
+        "created_at": sweep["created_at"],
+        "jobs": sweep["jobs"],
+        "total": len(runs),
+        **counts,
+        "done": finished == len(runs),
+        "progress": round(finished / len(runs), 4) if runs else 1.0,
+        "runs": runs,
+    }
+    if sweep.get("early_stopping"):
+        progress["early_stopping"] = sweep["early_stopping"]
+    return progress
+
+async def follow_sweep(project_path: str, sweep_id: str):
+    """
+    Yield the progress of a sweep every time a run changes status, until
+    every run is finished; None is yielded while nothing changes.
+    """
+    previous = None
+    while True:
+        sweep = load_sweep(project_path, sweep_id)
+        if sweep is None:
+            return
+        progress = await sweep_progress(project_path, sweep)
+        current = [run["status"] for run in progress["runs"]]
+        if current != previous:
+            yield progress
+            previous = current
+        else:
+            yield None
+        if progress["done"]:
+            return
+        await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,236 @@
+"""
+The experiment table of a project (`dvc exp show`) as a pandas DataFrame,
+with server-side column selection, filters, sorting and pagination.
+
+Building the table reads every experiment from git, which takes seconds on
+projects with thousands of experiments, so tables are cached per project.
+A cached table is used as long as the project's version is the same: its
+git refs (HEAD, branches, refs/exps), the state files of the queue's
+running experiments and the workspace's dvc.yaml, dvc.lock and
+params.yaml. Reading the version costs one `git show-ref` and a few stats.
+"""
+import io
+import os
+import glob
+import shlex
+import hashlib
+import asyncio
+import logging
+import operator
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+from app import scheduler
+from app import process_runner
+from app import dvc_engine
+from app import adaptive_sweep
+
+logger = logging.getLogger(__name__)
+
+# Experiment tables kept in memory (one per project and set of options)
+CACHE_SIZE = int(os.getenv("EXP_TABLE_CACHE_SIZE", "16"))
+# Largest page one request may ask for
+MAX_PAGE_ROWS = int(os.getenv("EXP_TABLE_MAX_ROWS", "1000"))
+
+# Columns `dvc exp show` starts every table with
+_INFO_COLUMNS = ["Experiment", "rev", "typ", "Created", "parent", "State", "Executor"]
+# Columns every page keeps, so rows can be told apart
+KEY_COLUMNS = ["Experiment", "rev"]
+
+# Workspace files the workspace row is read from
+_WORKSPACE_FILES = ("dvc.yaml", "dvc.lock", "params.yaml")
+
+# <column><operator><value>, e.g. "acc>=0.9", "State==Success", "Experiment~lr-"
+_FILTER = re.compile(r"^(?P<column>.+?)\s*(?P<op>==|!=|>=|<=|>|<|~)\s*(?P<value>.*)$")
+_OPERATORS = {
+    "==": operator.eq, "!=": operator.ne,
+    ">=": operator.ge, "<=": operator.le, ">": operator.gt, "<": operator.lt,
+}
+
+_tables: "OrderedDict[Tuple, Tuple[str, pd.DataFrame, Optional[Dict[str, List[str]]]]]" = OrderedDict()
+_build_locks: Dict[Tuple, asyncio.Lock] = {}
+
+async def table_version(project_path: str) -> str:
+    """
+    Hash of everything the experiment table of a project is built from.
+    """
+    command = "git show-ref --head"
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+    # show-ref exits with 1 when there are no refs yet
+    if returncode not in (0, 1):
+        raise Exception(f"`{command}` failed: {stderr}")
+
+    digest = hashlib.sha1(stdout.encode())
+    files = [os.path.join(project_path, name) for name in _WORKSPACE_FILES]
+    files += sorted(glob.glob(os.path.join(project_path, adaptive_sweep.EXEC_RUN_DIR, "*", "*.run")))
+    for path in files:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()[:16]
+
+async def _build(project_path: str, all_commits: bool, rev: str, num: int, param_deps: bool):
+    """
+    Returns:
+        tuple: (DataFrame, {"metrics", "params", "deps"} column groups, or
+            None when the table was read through the CLI).
+    """
+    try:
+        table = await dvc_engine.get_experiment_table(
+            project_path, all_commits=all_commits, rev=rev, num=num, param_deps=param_deps
+        )
+        frame = pd.DataFrame(table["rows"], columns=table["columns"]).infer_objects()
+        return frame, table["groups"]
+    except dvc_engine.EngineUnavailable as e:
+        logger.info(f"Falling back to `dvc exp show --csv` for {project_path}: {str(e)}")
+
+    command = "dvc exp show --csv"
+    if all_commits:
+        command += " -A"
+    if rev:
+        command += f" --rev {shlex.quote(rev)}"
+    if num != 1:
+        command += f" -n {int(num)}"
+    if param_deps:
+        command += " --param-deps"
+    async with scheduler.command_slot(command, project_path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+    if returncode != 0:
+        raise Exception(f"`dvc exp show` failed: {stderr or stdout}")
+    # "!" marks values that could not be read; revs can look like numbers
+    frame = pd.read_csv(
+        io.StringIO(stdout), na_values=["!"],
+        dtype={column: "string" for column in _INFO_COLUMNS},
+    )
+    return frame, None
+
+async def get_table(
+    project_path: str,
+    all_commits: bool = False,
+    rev: str = None,
+    num: int = 1,
+    param_deps: bool = False,
+    refresh: bool = False,
+) -> Tuple[str, pd.DataFrame, Optional[Dict[str, List[str]]]]:
+    """
+    The experiment table of a project, from the cache unless the project
+    changed since it was built.
+
+    Returns:
+        tuple: (version, DataFrame, column groups)
+    """
+    key = (os.path.abspath(project_path), all_commits, rev, num, param_deps)
+    lock = _build_locks.setdefault(key, asyncio.Lock())
+    # Concurrent requests for a stale table wait for one rebuild
+    async with lock:
+        version = await table_version(project_path)
+        cached = _tables.get(key)
+        if cached is not None and cached[0] == version and not refresh:
+            _tables.move_to_end(key)
+            return cached
+
+        frame, groups = await _build(project_path, all_commits, rev, num, param_deps)
+        _tables[key] = (version, frame, groups)
+        _tables.move_to_end(key)
+        while len(_tables) > CACHE_SIZE:
+            old_key, _ = _tables.popitem(last=False)
+            _build_locks.pop(old_key, None)
+        return _tables[key]
+
+def parse_filter(expression: str) -> Tuple[str, str, str]:
+    """
+    Split a "<column><operator><value>" filter.
+
+    Raises:
+        ValueError: If the expression is not a filter.
+    """
+    match = _FILTER.match(expression.strip())
+    if not match:
+        raise ValueError(f"Invalid filter '{expression}': expected <column><operator><value> with one of == != >= <= > < ~")
+    return match.group("column"), match.group("op"), match.group("value")
+
+def _filter_mask(frame: pd.DataFrame, expression: str) -> pd.Series:
+    column, op, value = parse_filter(expression)
+    if column not in frame.columns:
+        raise ValueError(f"Unknown column '{column}' in filter '{expression}'")
+    series = frame[column]
+
+    if op == "~":
+        return series.astype("string").str.contains(value, regex=False).fillna(False).astype(bool)
+    if pd.api.types.is_numeric_dtype(series):
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"Column '{column}' is numeric, '{value}' is not a number")
+        return _OPERATORS[op](series, number).fillna(False).astype(bool)
+    if op not in ("==", "!="):
+        raise ValueError(f"Column '{column}' is not numeric; use ==, != or ~")
+    # Missing cells never match
+    return (_OPERATORS[op](series.astype("string"), value) & series.notna()).fillna(False).astype(bool)
+
+def query_table(
+    frame: pd.DataFrame,
+    groups: Optional[Dict[str, List[str]]] = None,
+    columns: List[str] = None,
+    filters: List[str] = None,
+    sort_by: str = None,
+    sort_order: str = "asc",
+    offset: int = 0,
+    limit: int = 100,
+) -> Dict[str, Any]:
+    """
+    Select, filter, sort and page an experiment table.
+
+    Args:
+        columns (list, optional): Columns to return; KEY_COLUMNS are always
+            returned. Defaults to every column.
+        filters (list, optional): "<column><operator><value>" expressions,
+            all of which a row must match. `~` matches a substring.
+        sort_by (str, optional): Column to sort by; empty cells go last.
+        sort_order (str): "asc" or "desc".
+
+    Returns:
+        dict: {"total": matching rows, "offset", "limit", "columns",
+               "groups", "rows": [[...], ...]}
+
+    Raises:
+        ValueError: On unknown columns, bad filters or a bad page.
+    """
+    if offset < 0 or limit < 1 or limit > MAX_PAGE_ROWS:
+        raise ValueError(f"offset must be >= 0 and limit between 1 and {MAX_PAGE_ROWS}")
+    if sort_order not in ("asc", "desc"):
+        raise ValueError("sort_order must be 'asc' or 'desc'")
+
+    selected = list(frame.columns)
+    if columns:
+        unknown = [column for column in columns if column not in frame.columns]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        selected = [column for column in KEY_COLUMNS if column in frame.columns]
+        selected += [column for column in columns if column not in selected]
+
+    view = frame
+    for expression in filters or []:
+        view = view[_filter_mask(view, expression)]
+    if sort_by:
+        if sort_by not in frame.columns:
+            raise ValueError(f"Unknown column '{sort_by}' in sort_by")
+        view = view.sort_values(sort_by, ascending=sort_order == "asc", na_position="last", kind="stable")
+
+    page = view.iloc[offset:offset + limit][selected]
+    return {
+        "total": len(view),
+        "offset": offset,
+        "limit": limit,
+        "columns": selected,
+        "groups": {
+            name: [column for column in group if column in selected]
+            for name, group in groups.items()
+        } if groups is not None else None,
+        # NaN is not valid JSON
+        "rows": page.astype(object).where(page.notna(), None).values.tolist(),
+    }
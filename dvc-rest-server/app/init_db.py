@@ -8,13 +8,17 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-__all__ = ['init_db', 'close_db', 'get_database', 'get_users_collection', 'get_projects_collection', 'get_pipeline_configs_collection', 'get_data_sources_collection', 'get_remote_storages_collection', 'get_code_files_collection', 'get_models_collection', 'get_pipeline_executions_collection', 'get_model_paths_collection', 'get_model_evaluations_collection']
+__all__ = ['init_db', 'close_db', 'get_database', 'get_users_collection', 'get_projects_collection', 'get_pipeline_configs_collection', 'get_data_sources_collection', 'get_remote_storages_collection', 'get_code_files_collection', 'get_models_collection', 'get_pipeline_executions_collection', 'get_model_paths_collection', 'get_model_evaluations_collection', 'get_execution_logs_collection', 'get_experiments_collection']
 
 # MongoDB connection string from environment variable
 MONGODB_URL = os.getenv('MONGODB_URL')
 if not MONGODB_URL:
     raise ValueError("MONGODB_URL environment variable is not set. Please set it before running the application.")
 
+# Set MONGODB_TLS=false to connect to a local mongod without TLS
+MONGODB_TLS = os.getenv('MONGODB_TLS', 'true').lower() not in ('0', 'false', 'no')
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '10'))
+
 # Global variables for database and collections
 client = None
 db = None
@@ -28,6 +32,8 @@ models_collection = None
 pipeline_executions_collection = None
 model_paths_collection = None
 model_evaluations_collection = None
+execution_logs_collection = None
+experiments_collection = None
 
 async def init_if_needed():
     """Initialize database if not already initialized"""
@@ -99,29 +105,46 @@ async def get_model_evaluations_collection():
     global model_evaluations_collection
     return model_evaluations_collection
 
+async def get_execution_logs_collection():
+    """Get execution log chunks collection"""
+    await init_if_needed()
+    global execution_logs_collection
+    return execution_logs_collection
+
+async def get_experiments_collection():
+    """Get experiment index collection"""
+    await init_if_needed()
+    global experiments_collection
+    return experiments_collection
+
 async def init_db():
     """Initialize database connection"""
-    global client, db, users_collection, projects_collection, pipeline_configs_collection, data_sources_collection, remote_storages_collection, code_files_collection, models_collection, pipeline_executions_collection, model_paths_collection, model_evaluations_collection
+    global client, db, users_collection, projects_collection, pipeline_configs_collection, data_sources_collection, remote_storages_collection, code_files_collection, models_collection, pipeline_executions_collection, model_paths_collection, model_evaluations_collection, execution_logs_collection, experiments_collection
     
     try:
         # Create a new client and connect to the server
         # Updated connection options to handle SSL/TLS issues
+        tls_options = {}
+        if MONGODB_TLS:
+            tls_options = {
+                "tls": True,
+                "tlsCAFile": certifi.where(),
+                # Additional SSL options to handle TLS issues
+                "tlsAllowInvalidCertificates": False,
+                "tlsAllowInvalidHostnames": False,
+            }
         client = AsyncIOMotorClient(
             MONGODB_URL,
-            tlsCAFile=certifi.where(),
             serverSelectionTimeoutMS=30000,  # Increased timeout
             connectTimeoutMS=30000,          # Increased connect timeout
             socketTimeoutMS=30000,           # Increased socket timeout
-            tls=True,
             retryWrites=True,
             retryReads=True,
-            # Additional SSL options to handle TLS issues
-            tlsAllowInvalidCertificates=False,
-            tlsAllowInvalidHostnames=False,
             # Connection pool settings
-            maxPoolSize=10,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
             minPoolSize=1,
-            maxIdleTimeMS=30000
+            maxIdleTimeMS=30000,
+            **tls_options
         )
         
         # Send a ping to confirm a successful connection
@@ -140,6 +163,8 @@ async def init_db():
         pipeline_executions_collection = db.get_collection("pipeline_executions")
         model_paths_collection = db.get_collection("model_paths")
         model_evaluations_collection = db.get_collection("model_evaluations")
+        execution_logs_collection = db.get_collection("execution_logs")
+        experiments_collection = db.get_collection("experiments")
         print("Collections initialized successfully")
         
         # Initialize collections if they don't exist
@@ -164,6 +189,10 @@ async def init_db():
             await db.create_collection("model_paths")
         if "model_evaluations" not in collections:
             await db.create_collection("model_evaluations")
+        if "execution_logs" not in collections:
+            await db.create_collection("execution_logs")
+        if "experiments" not in collections:
+            await db.create_collection("experiments")
             
         print("Database and collections initialized successfully")
         
@@ -195,6 +224,8 @@ async def init_db():
             pipeline_executions_collection = db.get_collection("pipeline_executions")
             model_paths_collection = db.get_collection("model_paths")
             model_evaluations_collection = db.get_collection("model_evaluations")
+            execution_logs_collection = db.get_collection("execution_logs")
+            experiments_collection = db.get_collection("experiments")
             print("Local database and collections initialized successfully")
             
         except Exception as local_e:
@@ -212,11 +243,13 @@ async def init_db():
             pipeline_executions_collection = None
             model_paths_collection = None
             model_evaluations_collection = None
+            execution_logs_collection = None
+            experiments_collection = None
             raise e
 
 async def close_db():
     """Close database connection"""
-    global client, db, users_collection, projects_collection, pipeline_configs_collection, data_sources_collection, remote_storages_collection, code_files_collection, models_collection, pipeline_executions_collection, model_paths_collection, model_evaluations_collection
+    global client, db, users_collection, projects_collection, pipeline_configs_collection, data_sources_collection, remote_storages_collection, code_files_collection, models_collection, pipeline_executions_collection, model_paths_collection, model_evaluations_collection, execution_logs_collection, experiments_collection
     if client:
         client.close()
     client = None
@@ -230,4 +263,6 @@ async def close_db():
     models_collection = None
     pipeline_executions_collection = None
     model_paths_collection = None
-    model_evaluations_collection = None
\ No newline at end of file
+    model_evaluations_collection = None
+    execution_logs_collection = None
+    experiments_collection = None
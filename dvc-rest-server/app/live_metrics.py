@@ -0,0 +1,297 @@
+"""
+Live metrics of running experiments, read from the files DVCLive writes
+while they run.
+
+DVCLive appends one line per step to `<metrics_dir>/plots/metrics/<metric>.tsv`
+and rewrites `<metrics_dir>/metrics.json` with the latest values. A
+MetricsWatcher follows these files in every workspace where an experiment
+of the project may run: the project itself (`dvc exp run`, `repro`), its
+leased checkouts (`dvc exp run --temp`, evaluations) and the workspaces of
+the running queue experiments. Only the bytes appended since the last scan
+are read. New points are pushed to subscribers, and a compact series per
+run and metric is kept for clients that connect later.
+"""
+import os
+import glob
+import json
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from app import worktree_pool
+from app import adaptive_sweep
+
+logger = logging.getLogger(__name__)
+
+# Points kept per metric of a run; when there are more, every other point
+# is dropped so the series keeps covering the whole run
+MAX_POINTS = int(os.getenv("LIVE_METRICS_MAX_POINTS", "500"))
+# Seconds between two scans of the workspaces while someone is subscribed
+POLL_INTERVAL = float(os.getenv("LIVE_METRICS_POLL_INTERVAL", "1"))
+# Interval of the SSE keep-alive comments (seconds)
+KEEPALIVE_INTERVAL = 15.0
+
+_SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Name of the run of the project's own workspace
+WORKSPACE_RUN = "workspace"
+
+class MetricSeries:
+    """
+    The points of one metric, thinned out to at most MAX_POINTS. The last
+    point is always kept.
+    """
+
+    def __init__(self, max_points: int = MAX_POINTS):
+        self.max_points = max_points
+        self.points: List[Tuple[int, float]] = []
+        self.last: Optional[Tuple[int, float]] = None
+        self._stride = 1
+        self._skipped = 0
+
+    def add(self, step: int, value: float):
+        self.last = (step, value)
+        self._skipped += 1
+        if self._skipped < self._stride:
+            return
+        self._skipped = 0
+        self.points.append(self.last)
+        if len(self.points) > self.max_points:
+            self.points = self.points[::2]
+            self._stride *= 2
+
+    def snapshot(self) -> List[Tuple[int, float]]:
+        if self.last is not None and (not self.points or self.points[-1] != self.last):
+            return self.points + [self.last]
+        return list(self.points)
+
+class TsvTail:
+    """
+    Reads the lines appended to a DVCLive step file since the last read.
+    """
+
+    def __init__(self, path: str, column: str):
+        self.path = path
+        self.column = column
+        self._inode = None
+        self._offset = 0
+        self._header: Optional[List[str]] = None
+        self._partial = b""
+
+    def read(self) -> Tuple[bool, List[Tuple[int, float]]]:
+        """
+        Returns:
+            tuple: (reset, [(step, value), ...]). `reset` is True when the
+                file was recreated (a new run started in the workspace), in
+                which case the points start from the beginning again.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False, []
+        reset = False
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            reset = self._inode is not None
+            self._inode, self._offset, self._header, self._partial = stat.st_ino, 0, None, b""
+        if stat.st_size == self._offset:
+            return reset, []
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        self._offset += len(data)
+        lines = (self._partial + data).split(b"\n")
+        # The last line is incomplete until DVCLive writes its newline
+        self._partial = lines.pop()
+
+        points = []
+        for line in lines:
+            fields = line.decode("utf-8", errors="replace").rstrip("\r").split("\t")
+            if self._header is None:
+                self._header = fields
+                continue
+            row = dict(zip(self._header, fields))
+            try:
+                points.append((int(row["step"]), float(row[self.column])))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return reset, points
+
+class RunMetrics:
+    """The metrics DVCLive writes in one workspace."""
+
+    def __init__(self, name: str, workspace: str, metrics_dir: str):
+        self.name = name
+        self.workspace = workspace
+        self.metrics_dir = os.path.join(workspace, metrics_dir)
+        self.series: Dict[str, MetricSeries] = {}
+        self.summary: Optional[Dict[str, Any]] = None
+        self._tails: Dict[str, TsvTail] = {}
+        self._summary_mtime = None
+
+    def scan(self) -> Optional[Dict[str, Any]]:
+        """
+        Read what was written since the last scan.
+
+        Returns:
+            dict: {"run", "points": {metric: [[step, value], ...]},
+                   "reset": [metrics that restarted], "summary"?}, or None
+                   when nothing changed.
+        """
+        plots_dir = os.path.join(self.metrics_dir, "plots", "metrics")
+        for path in glob.glob(os.path.join(plots_dir, "**", "*.tsv"), recursive=True):
+            metric = os.path.relpath(path, plots_dir)[:-len(".tsv")].replace(os.sep, "/")
+            if metric not in self._tails:
+                self._tails[metric] = TsvTail(path, os.path.basename(metric))
+
+        update: Dict[str, Any] = {"run": self.name, "points": {}, "reset": []}
+        for metric, tail in self._tails.items():
+            reset, points = tail.read()
+            if reset or metric not in self.series:
+                self.series[metric] = MetricSeries()
+                if reset:
+                    update["reset"].append(metric)
+            for step, value in points:
+                self.series[metric].add(step, value)
+            if points:
+                update["points"][metric] = [list(point) for point in points]
+
+        summary_path = os.path.join(self.metrics_dir, "metrics.json")
+        try:
+            mtime = os.stat(summary_path).st_mtime_ns
+            if mtime != self._summary_mtime:
+                with open(summary_path, "r") as f:
+                    self.summary = json.load(f)
+                self._summary_mtime = mtime
+                update["summary"] = self.summary
+        except (OSError, ValueError):
+            # Missing, or being rewritten right now
+            pass
+
+        if not update["points"] and not update["reset"] and "summary" not in update:
+            return None
+        return update
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workspace": self.workspace,
+            "summary": self.summary,
+            "metrics": {
+                metric: [list(point) for point in series.snapshot()]
+                for metric, series in self.series.items()
+            },
+        }
+
+class MetricsWatcher:
+    """
+    Follows the live metrics of every run of one project and fans the new
+    points out to subscribers. The workspaces are scanned while someone is
+    subscribed, and on every snapshot request.
+    """
+
+    def __init__(self, project_path: str, metrics_dir: str = "dvclive"):
+        self.project_path = project_path
+        self.metrics_dir = metrics_dir
+        self.runs: Dict[str, RunMetrics] = {}
+        self.subscribers = set()
+        self.seq = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _workspaces(self) -> Dict[str, str]:
+        workspaces = {WORKSPACE_RUN: self.project_path}
+        for path in worktree_pool.leased_checkouts(self.project_path):
+            workspaces[f"checkout-{os.path.basename(path)}"] = path
+        workspaces.update(adaptive_sweep.running_workspaces(self.project_path))
+        return workspaces
+
+    def _scan(self, workspaces: Dict[str, str]) -> List[Dict[str, Any]]:
+        events = []
+        for name in list(self.runs):
+            if workspaces.get(name) != self.runs[name].workspace:
+                # Pick up the last steps if the workspace is still there
+                update = self.runs.pop(name).scan()
+                if update is not None:
+                    events.append(update)
+                events.append({"run": name, "finished": True})
+        for name, workspace in workspaces.items():
+            if name not in self.runs:
+                self.runs[name] = RunMetrics(name, workspace, self.metrics_dir)
+            update = self.runs[name].scan()
+            if update is not None:
+                events.append(update)
+        return events
+
+    def _publish(self, event: Dict[str, Any]):
+        self.seq += 1
+        event = {"seq": self.seq, **event}
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow client: drop its oldest pending update
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def refresh(self):
+        """Scan the workspaces once and publish what changed."""
+        async with self._lock:
+            workspaces = self._workspaces()
+            for event in await asyncio.to_thread(self._scan, workspaces):
+                self._publish(event)
+
+    def snapshot(self, run: str = None) -> Dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "runs": {
+                name: metrics.snapshot()
+                for name, metrics in self.runs.items()
+                if (run is None or name == run) and (metrics.series or metrics.summary)
+            },
+        }
+
+    async def _poll(self):
+        while self.subscribers:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Reading live metrics of {self.project_path} failed: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def subscribe(self, run: str = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield a snapshot of the runs ({"seq", "runs"}), then every update
+        ({"seq", "run", "points", "reset", "summary"?} or {"seq", "run",
+        "finished"}). Yields None when nothing happened for
+        KEEPALIVE_INTERVAL seconds.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        await self.refresh()
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+        try:
+            yield self.snapshot(run)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if run is None or event["run"] == run:
+                    yield event
+        finally:
+            self.subscribers.discard(queue)
+
+_watchers: Dict[Tuple[str, str], MetricsWatcher] = {}
+
+def get_watcher(project_path: str, metrics_dir: str = "dvclive") -> MetricsWatcher:
+    """
+    Return the watcher of a project's metrics directory.
+
+    Raises:
+        ValueError: If `metrics_dir` points outside of the workspaces.
+    """
+    if os.path.isabs(metrics_dir) or ".." in metrics_dir.replace("\\", "/").split("/"):
+        raise ValueError("'metrics_dir' must be a path inside the workspace")
+    key = (os.path.abspath(project_path), metrics_dir)
+    if key not in _watchers:
+        _watchers[key] = MetricsWatcher(key[0], metrics_dir)
+    return _watchers[key]
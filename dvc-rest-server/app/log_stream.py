@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Lines kept per channel so late subscribers can catch up
+BACKLOG_LINES = int(os.getenv("LOG_STREAM_BACKLOG", "1000"))
+# How long a finished channel stays around for late subscribers (seconds)
+CHANNEL_RETENTION = float(os.getenv("LOG_STREAM_RETENTION", "300"))
+# Interval of the SSE keep-alive comments (seconds)
+KEEPALIVE_INTERVAL = 15.0
+# Batching of the log lines written to MongoDB
+FLUSH_LINES = int(os.getenv("LOG_FLUSH_LINES", "100"))
+FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+# Lines per stored chunk; lines are at most 64 KB, so a chunk stays well
+# below the 16 MB document limit
+CHUNK_LINES = int(os.getenv("LOG_CHUNK_LINES", "200"))
+
+_SUBSCRIBER_QUEUE_SIZE = 10000
+
+class LogChannel:
+    """
+    Fan-out of the output of one run to any number of subscribers.
+    """
+
+    def __init__(self, channel_id: str):
+        self.channel_id = channel_id
+        self.backlog: deque = deque(maxlen=BACKLOG_LINES)
+        self.subscribers = set()
+        self.seq = 0
+        self.closed = False
+        self.status: Optional[str] = None
+
+    def publish(self, stream: str, line: str) -> Dict[str, Any]:
+        self.seq += 1
+        event = {"seq": self.seq, "stream": stream, "line": line, "time": time.time()}
+        self.backlog.append(event)
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow client: drop its oldest pending line instead of
+                # letting the queue grow without bounds
+                queue.get_nowait()
+            queue.put_nowait(event)
+        return event
+
+    def close(self, status: str = None):
+        self.closed = True
+        self.status = status
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def subscribe(self) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield the backlog, then live events until the channel is closed.
+        Yields None when nothing happened for KEEPALIVE_INTERVAL seconds.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        backlog = list(self.backlog)
+        self.subscribers.add(queue)
+        try:
+            for event in backlog:
+                yield event
+            if self.closed:
+                return
+            last_seq = backlog[-1]["seq"] if backlog else 0
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                if event["seq"] <= last_seq:
+                    continue
+                last_seq = event["seq"]
+                yield event
+        finally:
+            self.subscribers.discard(queue)
+
+_channels: Dict[str, LogChannel] = {}
+
+def open_channel(channel_id: str) -> LogChannel:
+    """
+    Return the live channel for `channel_id`, creating a new one if there is
+    none yet or the previous one has finished.
+    """
+    channel = _channels.get(channel_id)
+    if channel is None or channel.closed:
+        channel = LogChannel(channel_id)
+        _channels[channel_id] = channel
+    return channel
+
+def get_channel(channel_id: str) -> Optional[LogChannel]:
+    return _channels.get(channel_id)
+
+def close_channel(channel_id: str, status: str = None):
+    """
+    Close a channel and forget it after CHANNEL_RETENTION seconds.
+    """
+    channel = _channels.get(channel_id)
+    if channel is None:
+        return
+    channel.close(status)
+
+    def _forget():
+        if _channels.get(channel_id) is channel:
+            del _channels[channel_id]
+
+    try:
+        asyncio.get_running_loop().call_later(CHANNEL_RETENTION, _forget)
+    except RuntimeError:
+        _forget()
+
+def format_sse(event: Optional[Dict[str, Any]], event_type: str = "log") -> str:
+    """
+    Encode an event as a Server-Sent Events message (None is a keep-alive).
+    """
+    if event is None:
+        return ": keepalive\n\n"
+    message = f"event: {event_type}\n"
+    if "seq" in event:
+        message += f"id: {event['seq']}\n"
+    return message + f"data: {json.dumps(event)}\n\n"
+
+class ExecutionLog:
+    """
+    Output sink for one run: publishes every line to the SSE channel and
+    stores it in batches as chunks of CHUNK_LINES lines.
+
+    Chunks are documents {execution_id, start_line, line_count, lines} so
+    a run's output never grows the run record itself.
+
+    Args:
+        channel_id (str): Channel subscribers attach to; also the
+            execution_id the chunks are stored under.
+        collection (optional): Motor collection holding the log chunks.
+    """
+
+    def __init__(self, channel_id: str, collection=None):
+        self.channel_id = channel_id
+        self.channel = open_channel(channel_id)
+        self.collection = collection
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        # Chunk being filled; looked up on the first flush so a re-queued
+        # run continues after the lines of its previous attempt
+        self._chunk_start: Optional[int] = None
+        self._chunk_count = 0
+
+    async def write(self, stream: str, line: str):
+        self.channel.publish(stream, line)
+        if self.collection is None:
+            return
+        self._buffer.append(line)
+        if len(self._buffer) >= FLUSH_LINES or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer or self.collection is None:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            if self._chunk_start is None:
+                last = await self.collection.find_one(
+                    {"execution_id": self.channel_id}, sort=[("start_line", -1)]
+                )
+                self._chunk_start = last["start_line"] if last else 0
+                self._chunk_count = last["line_count"] if last else 0
+
+            while batch:
+                if self._chunk_count >= CHUNK_LINES:
+                    self._chunk_start += self._chunk_count
+                    self._chunk_count = 0
+                room = CHUNK_LINES - self._chunk_count
+                part, batch = batch[:room], batch[room:]
+                await self.collection.update_one(
+                    {"execution_id": self.channel_id, "start_line": self._chunk_start},
+                    {
+                        "$push": {"lines": {"$each": part}},
+                        "$inc": {"line_count": len(part)},
+                        "$setOnInsert": {"created_at": datetime.now().isoformat()},
+                    },
+                    upsert=True,
+                )
+                self._chunk_count += len(part)
+        except Exception as e:
+            # Look the position up again on the next flush
+            self._chunk_start = None
+            logger.warning(f"Failed to store {len(batch)} log lines for {self.channel_id}: {e}")
+
+    async def close(self, status: str = None):
+        await self.flush()
+        close_channel(self.channel_id, status)
+
+async def count_log_lines(collection, execution_id: str) -> int:
+    """Number of stored lines of a run."""
+    last = await collection.find_one(
+        {"execution_id": execution_id}, {"start_line": 1, "line_count": 1}, sort=[("start_line", -1)]
+    )
+    return last["start_line"] + last["line_count"] if last else 0
+
+async def read_log_lines(collection, execution_id: str, offset: int = 0, limit: int = 1000) -> List[str]:
+    """
+    Stored lines `offset` to `offset + limit` of a run, reading only the
+    chunks that hold them.
+    """
+    if limit <= 0:
+        return []
+    first = await collection.find_one(
+        {"execution_id": execution_id, "start_line": {"$lte": offset}},
+        {"start_line": 1},
+        sort=[("start_line", -1)],
+    )
+    first_line = first["start_line"] if first else 0
+    chunks = await collection.find(
+        {"execution_id": execution_id, "start_line": {"$gte": first_line, "$lt": offset + limit}}
+    ).sort("start_line", 1).to_list(None)
+
+    lines = []
+    for chunk in chunks:
+        begin = max(offset - chunk["start_line"], 0)
+        lines.extend(chunk["lines"][begin:])
+    return lines[:limit]
+
+async def tail_log_lines(collection, execution_id: str, count: int = 100) -> Tuple[int, int, List[str]]:
+    """
+    Last `count` stored lines of a run.
+
+    Returns:
+        tuple: (offset of the first returned line, total lines, lines)
+    """
+    total = await count_log_lines(collection, execution_id)
+    offset = max(total - count, 0)
+    return offset, total, await read_log_lines(collection, execution_id, offset, count)
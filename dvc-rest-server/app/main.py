@@ -1,7 +1,8 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import router
+from app.routes import router, project_busy_handler
 from app.init_db import init_db, close_db
+from app import dvc_engine, worker_pool, pipeline_jobs, adaptive_sweep, dvc_handler
 
 app = FastAPI()
 
@@ -17,9 +18,16 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    await worker_pool.start_pool()
+    await pipeline_jobs.start_workers()
+    adaptive_sweep.resume_sweeps(dvc_handler.REPO_ROOT)
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await pipeline_jobs.stop_workers()
     await close_db()
+    await worker_pool.stop_pool()
+    dvc_engine.close_all()
 
+app.add_exception_handler(HTTPException, project_busy_handler)
 app.include_router(router) 
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import shlex
+import asyncio
+import logging
+from typing import Any, Dict, List
+from app import dvc_engine, worker_pool, scheduler, process_runner, stage_shell
+
+logger = logging.getLogger(__name__)
+
+# Default number of stages run at the same time by a parallel repro
+DEFAULT_JOBS = int(os.getenv("PIPELINE_STAGE_JOBS", str(os.cpu_count() or 4)))
+
+class ParallelReproUnsupported(Exception):
+    """Raised when a pipeline has to be reproduced with plain `dvc repro`."""
+
+def select_stages(plan: Dict[str, Dict[str, Any]], targets: List[str] = None, pipeline: bool = False) -> List[str]:
+    """
+    Pick the stages a repro of `targets` visits, in topological order.
+
+    Args:
+        plan (dict): Stage plan from `dvc_engine.get_stage_plan`.
+        targets (list, optional): Target stages; all stages when empty.
+        pipeline (bool, optional): Include the whole pipeline the targets
+            belong to, like `dvc repro --pipeline`.
+
+    Returns:
+        list: Stage names.
+    """
+    if not targets:
+        return list(plan)
+
+    missing = [target for target in targets if target not in plan]
+    if missing:
+        # Paths, dvc.yaml files and globs are resolved by DVC itself
+        raise ParallelReproUnsupported(f"Unknown stage(s): {', '.join(missing)}")
+
+    neighbours = {name: set(stage["upstream"]) for name, stage in plan.items()}
+    if pipeline:
+        for name, stage in plan.items():
+            for upstream in stage["upstream"]:
+                neighbours[upstream].add(name)
+
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        pending.extend(neighbours[name])
+    return [name for name in plan if name in selected]
+
+async def parallel_repro(
+    project_path: str,
+    targets: List[str] = None,
+    pipeline: bool = False,
+    force: bool = False,
+    jobs: int = None,
+    log_callback=None,
+    stage_stats_file: str = None,
+) -> str:
+    """
+    Reproduce the pipeline running independent stages at the same time.
+
+    Each stage is reproduced on its own with `dvc repro --single-item` as
+    soon as the stages it depends on are done, so DVC still decides whether
+    it changed, runs it and records it in dvc.lock. DVC only holds the repo
+    lock around its checks and commits, not while the stage command runs;
+    `--wait-for-lock` makes the stages take turns there instead of failing.
+    The caller holds the project lock, so nothing else runs in between.
+
+    Args:
+        project_path (str): Path of the DVC project.
+        targets (list, optional): Stages to reproduce (with their upstream).
+        pipeline (bool, optional): Reproduce the whole pipeline of the targets.
+        force (bool, optional): Run the stages even if they are up to date.
+        jobs (int, optional): Number of stages run at the same time.
+        log_callback (callable, optional): Coroutine called with (stream, line)
+            for every line of output.
+        stage_stats_file (str, optional): Record the timing and resource
+            usage of every stage command in this file (see stage_shell).
+
+    Returns:
+        str: Summary of the stages that ran.
+
+    Raises:
+        ParallelReproUnsupported: If the targets are not stage names, or
+            the DVC engine is not available.
+        Exception: If a stage fails.
+    """
+    try:
+        plan = await dvc_engine.get_stage_plan(project_path)
+    except dvc_engine.EngineUnavailable as e:
+        raise ParallelReproUnsupported(str(e)) from e
+
+    names = select_stages(plan, targets, pipeline)
+
+    jobs = max(1, jobs or DEFAULT_JOBS)
+    slots = asyncio.Semaphore(jobs)
+    done = {name: asyncio.Event() for name in names}
+    failed: Dict[str, str] = {}
+    ran: List[str] = []
+    # DVC runs stage commands with $SHELL, which records their cost
+    env = stage_shell.stage_env(stage_stats_file) if stage_stats_file else None
+
+    async def emit(stream: str, line: str):
+        if log_callback is not None:
+            await log_callback(stream, line)
+
+    async def run_stage(name: str):
+        stage = plan[name]
+        try:
+            for upstream in stage["upstream"]:
+                if upstream in done:
+                    await done[upstream].wait()
+            if failed:
+                # Stop starting new stages once one has failed, like `dvc repro`
+                return
+
+            async with slots:
+                if failed:
+                    return
+                if stage["frozen"] or not (stage["cmd"] or stage["is_import"]):
+                    # Data sources (.dvc files) and frozen stages are not run
+                    return
+
+                command = f"dvc --wait-for-lock repro --single-item {shlex.quote(name)}"
+                if force:
+                    command += " --force"
+                async with scheduler.command_slot(command, project_path):
+                    if log_callback is not None:
+                        returncode, stdout, stderr = await process_runner.run_command(
+                            command, cwd=project_path, on_line=log_callback, env=env
+                        )
+                    else:
+                        returncode, stdout, stderr = await worker_pool.run_command(command, cwd=project_path, env=env)
+                if returncode != 0:
+                    # DVC already printed "ERROR: failed to reproduce '<stage>': ..."
+                    errors = [line for line in stderr.splitlines() if line.startswith("ERROR: ")]
+                    failed[name] = errors[-1][len("ERROR: "):] if errors else f"failed to reproduce '{name}': {stderr}"
+                    return
+                if "didn't change, skipping" not in stdout:
+                    ran.append(name)
+        except Exception as e:
+            failed[name] = str(e)
+            await emit("stderr", f"ERROR: {str(e)}")
+        finally:
+            done[name].set()
+
+    await asyncio.gather(*(run_stage(name) for name in names))
+
+    if failed:
+        raise Exception(f"Error running parallel repro: {next(iter(failed.values()))}")
+
+    if not ran:
+        return "Data and pipelines are up to date."
+    return f"Reproduced {len(ran)} stage(s) with {jobs} job(s): {', '.join(ran)}"
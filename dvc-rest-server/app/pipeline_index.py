@@ -0,0 +1,190 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import yaml
+
+# Files the index is built from, relative to the project root
+PIPELINE_FILES = ("dvc.yaml", "dvc.lock", "params.yaml")
+
+_Fingerprint = Tuple[Optional[Tuple[int, int, int]], ...]
+
+def _entry_paths(entries) -> List[str]:
+    """Paths of a deps/outs/metrics/plots list (entries are str or {path: options})."""
+    paths = []
+    for entry in entries or []:
+        if isinstance(entry, dict):
+            paths.extend(str(path) for path in entry)
+        else:
+            paths.append(str(entry))
+    return paths
+
+def _param_names(entries) -> List[str]:
+    """Parameter names of a stage; `{file: [keys]}` entries are expanded to `file:key`."""
+    names = []
+    for entry in entries or []:
+        if isinstance(entry, dict):
+            for params_file, keys in entry.items():
+                for key in keys or []:
+                    names.append(f"{params_file}:{key}")
+        else:
+            names.append(str(entry))
+    return names
+
+def _overlaps(path: str, other: str) -> bool:
+    return path == other or path.startswith(other + os.sep) or other.startswith(path + os.sep)
+
+class PipelineIndex:
+    """
+    Parsed view of a project's dvc.yaml, dvc.lock and params.yaml.
+
+    Instances are shared between requests and must be treated as read-only;
+    copy `config` (or `params`) before changing it.
+    """
+
+    def __init__(self, project_path: str, config: Dict[str, Any], lock: Dict[str, Any], params: Dict[str, Any]):
+        self.project_path = project_path
+        self.config = config
+        self.lock = lock
+        self.params = params
+        self.stages: Dict[str, Dict[str, Any]] = config.get("stages") or {}
+
+        self.deps: Dict[str, List[str]] = {}
+        self.outs: Dict[str, List[str]] = {}
+        self.stage_params: Dict[str, List[str]] = {}
+        self.metrics: Dict[str, List[str]] = {}
+        self.plots: Dict[str, List[str]] = {}
+        for name, stage in self.stages.items():
+            stage = stage or {}
+            self.deps[name] = _entry_paths(stage.get("deps"))
+            self.outs[name] = _entry_paths(stage.get("outs"))
+            self.stage_params[name] = _param_names(stage.get("params"))
+            self.metrics[name] = _entry_paths(stage.get("metrics"))
+            self.plots[name] = _entry_paths(stage.get("plots"))
+
+        self.upstream = self._build_upstream()
+        self.order = self._topological_order()
+
+    def _normalized(self, name: str, path: str) -> str:
+        wdir = (self.stages.get(name) or {}).get("wdir", ".")
+        return os.path.normpath(os.path.join(str(wdir), path))
+
+    def _build_upstream(self) -> Dict[str, List[str]]:
+        """Stages each stage depends on, matching its deps against the outputs of the others."""
+        produced = [
+            (name, self._normalized(name, path))
+            for name in self.stages
+            for path in self.outs[name] + self.metrics[name] + self.plots[name]
+        ]
+        upstream = {}
+        for name in self.stages:
+            found = []
+            for dep in self.deps[name]:
+                dep_path = self._normalized(name, dep)
+                for producer, out_path in produced:
+                    if producer != name and producer not in found and _overlaps(dep_path, out_path):
+                        found.append(producer)
+            upstream[name] = found
+        return upstream
+
+    def _topological_order(self) -> List[str]:
+        """Stages in execution order, keeping the dvc.yaml order between independent stages."""
+        order = []
+        remaining = list(self.stages)
+        while remaining:
+            ready = [name for name in remaining if all(up in order for up in self.upstream[name])]
+            if not ready:
+                # A cycle: DVC rejects it anyway, list the rest as written
+                order.extend(remaining)
+                break
+            order.extend(ready)
+            remaining = [name for name in remaining if name not in ready]
+        return order
+
+    def param_owners(self) -> Dict[str, str]:
+        """
+        Map parameter names to the stage that namespaces them in params.yaml
+        (a `train.lr` param of the `train` stage maps `lr` to `train`).
+        """
+        owners = {}
+        for name, params in self.stage_params.items():
+            for param in params:
+                if "." in param:
+                    prefix, param_name = param.split(".", 1)
+                    if prefix == name:
+                        owners[param_name] = name
+        return owners
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stages": list(self.stages),
+            "order": self.order,
+            "upstream": self.upstream,
+            "deps": self.deps,
+            "outs": self.outs,
+            "params": self.stage_params,
+            "metrics": self.metrics,
+            "plots": self.plots,
+        }
+
+_indexes: Dict[str, Tuple[_Fingerprint, PipelineIndex]] = {}
+_indexes_lock = threading.Lock()
+
+def _fingerprint(project_path: str) -> _Fingerprint:
+    fingerprint = []
+    for filename in PIPELINE_FILES:
+        try:
+            st = os.stat(os.path.join(project_path, filename))
+            fingerprint.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except FileNotFoundError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+def _load_yaml(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+def get_index(project_path: str) -> PipelineIndex:
+    """
+    Return the pipeline index of a project.
+
+    The files are only parsed again when the (mtime, size, inode) of one of
+    them changed since the last call.
+
+    Raises:
+        yaml.YAMLError: If one of the files is not valid YAML.
+    """
+    project_path = os.path.realpath(project_path)
+    fingerprint = _fingerprint(project_path)
+    with _indexes_lock:
+        cached = _indexes.get(project_path)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+    index = PipelineIndex(
+        project_path,
+        _load_yaml(os.path.join(project_path, "dvc.yaml")),
+        _load_yaml(os.path.join(project_path, "dvc.lock")),
+        _load_yaml(os.path.join(project_path, "params.yaml")),
+    )
+    with _indexes_lock:
+        _indexes[project_path] = (fingerprint, index)
+    return index
+
+def invalidate(project_path: str):
+    """Drop the cached index of a project."""
+    with _indexes_lock:
+        _indexes.pop(os.path.realpath(project_path), None)
+
+def write_dvc_yaml(project_path: str, config: Dict[str, Any]):
+    """Write dvc.yaml and drop the cached index."""
+    with open(os.path.join(project_path, "dvc.yaml"), "w") as f:
+        yaml.dump(config, f, default_flow_style=False)
+    invalidate(project_path)
+
+def write_params(project_path: str, params: Dict[str, Any]):
+    """Write params.yaml and drop the cached index."""
+    with open(os.path.join(project_path, "params.yaml"), "w") as f:
+        yaml.dump(params, f, default_flow_style=False)
+    invalidate(project_path)
@@ -0,0 +1,864 @@
+import os
+import re
+import json
+import socket
+import hashlib
+import asyncio
+import logging
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, ASCENDING
+from app import log_stream
+from app import pipeline_index
+from app import staleness
+from app import stage_shell
+from app import scheduler
+from app import resource_limits
+from app import execution_stats
+from app.dvc_handler import REPO_ROOT, repro, get_pipeline_dag, run_command_async, clear_stale_dvc_locks
+from app.init_db import get_pipeline_executions_collection, get_pipeline_configs_collection, get_projects_collection, get_execution_logs_collection
+
+logger = logging.getLogger(__name__)
+
+# Number of pipeline executions the API process runs itself. Set it to 0
+# when standalone workers (worker.py) take care of the queue.
+QUEUE_WORKERS = int(os.getenv("PIPELINE_QUEUE_WORKERS", "2"))
+# A worker that has not renewed its lease for this long is considered dead
+LEASE_SECONDS = float(os.getenv("PIPELINE_LEASE_SECONDS", "60"))
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 4
+# How often idle workers look for queued executions
+POLL_INTERVAL = float(os.getenv("PIPELINE_POLL_INTERVAL", "2"))
+# Executions whose worker died this many times are failed instead of re-queued
+MAX_ATTEMPTS = int(os.getenv("PIPELINE_MAX_ATTEMPTS", "3"))
+# Executions one user may have running at the same time (0 for no quota)
+USER_MAX_RUNNING = int(os.getenv("PIPELINE_USER_MAX_RUNNING", "0"))
+# Queued executions looked at when choosing the next one to run
+CLAIM_SCAN_LIMIT = int(os.getenv("PIPELINE_CLAIM_SCAN_LIMIT", "1000"))
+
+# Return the earlier completed execution instead of queueing a run that
+# would find nothing to do (see find_memoized_execution)
+MEMOIZE_EXECUTIONS = os.getenv("PIPELINE_MEMOIZE", "true").lower() in ("1", "true", "yes")
+
+# Fields of a pipeline configuration that do not change what it runs
+_CONFIG_BOOKKEEPING = {"_id", "created_at", "updated_at", "last_executed", "execution_count"}
+
+MODEL_EXTENSIONS = ['.pkl', '.joblib', '.h5', '.hdf5', '.pb', '.onnx', '.pt', '.pth', '.model', '.bin']
+
+# `dvc repro` announces every stage it visits
+_STAGE_LINE = re.compile(r"^(?:Running stage|Stage) '([^']+)'")
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+# Executions run by this process, and those of them being cancelled
+_running: Dict[str, asyncio.Task] = {}
+_cancelling: set = set()
+
+def new_execution_id() -> str:
+    return f"exec_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+
+async def create_execution(
+    user_id: str,
+    project_id: str,
+    pipeline_config_id: str = None,
+    force: bool = False,
+    dry_run: bool = False,
+    targets: list = None,
+    parameters: Dict[str, Any] = None,
+    pipeline: bool = False,
+    parallel_jobs: int = None,
+    priority: str = None,
+) -> Dict[str, Any]:
+    """
+    Insert a queued pipeline execution record.
+
+    Dry runs are interactive unless another priority class is given.
+
+    Returns:
+        dict: The execution record
+    """
+    execution_data = {
+        "execution_id": new_execution_id(),
+        "pipeline_config_id": pipeline_config_id,
+        "user_id": user_id,
+        "project_id": project_id,
+        "status": "queued",
+        "priority": priority or ("interactive" if dry_run else scheduler.DEFAULT_PRIORITY),
+        "queued_at": datetime.now().isoformat(),
+        "start_time": None,
+        "end_time": None,
+        "duration": None,
+        "stages": [],
+        "output_files": [],
+        "models_produced": [],
+        "error_message": None,
+        "parameters_used": parameters or {},
+        "metrics": {},
+        "progress": {},
+        # What the queue worker has to run
+        "options": {
+            "force": force,
+            "dry_run": dry_run,
+            "targets": targets or [],
+            "pipeline": pipeline,
+            "parallel_jobs": parallel_jobs,
+        },
+    }
+
+    executions_collection = await get_pipeline_executions_collection()
+    try:
+        # Lets the queue run short executions first and report ETAs
+        execution_data["expected_duration"] = await execution_stats.predict_duration(
+            executions_collection, user_id, project_id, pipeline_config_id, targets, dry_run
+        )
+    except Exception as e:
+        logger.warning(f"Could not predict the duration of {execution_data['execution_id']}: {e}")
+        execution_data["expected_duration"] = None
+    await executions_collection.insert_one(execution_data)
+    return execution_data
+
+async def compute_fingerprint(
+    user_id: str,
+    project_id: str,
+    pipeline_config: Dict[str, Any] = None,
+    parameters: Dict[str, Any] = None,
+    targets: list = None,
+    pipeline: bool = False,
+) -> str:
+    """
+    Fingerprint of what an execution would run: the configuration document,
+    the request parameters and targets, params.yaml, the hashes recorded in
+    dvc.lock and git HEAD.
+    """
+    project_path = os.path.join(REPO_ROOT, user_id, project_id)
+    index = await asyncio.to_thread(pipeline_index.get_index, project_path)
+    try:
+        head = (await run_command_async("git rev-parse HEAD", cwd=project_path)).strip()
+    except Exception:
+        # No commit yet
+        head = None
+
+    config = {
+        key: value for key, value in (pipeline_config or {}).items()
+        if key not in _CONFIG_BOOKKEEPING
+    }
+    payload = {
+        "config": config,
+        "parameters": parameters or {},
+        "targets": targets or [],
+        "pipeline": pipeline,
+        "params": index.params,
+        "lock": index.lock,
+        "head": head,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def _execution_fingerprint(execution: Dict[str, Any]) -> Optional[str]:
+    """Fingerprint of the project state an execution left behind."""
+    pipeline_config = None
+    if execution.get("pipeline_config_id"):
+        pipeline_configs_collection = await get_pipeline_configs_collection()
+        pipeline_config = await pipeline_configs_collection.find_one({"_id": ObjectId(execution["pipeline_config_id"])})
+    options = execution.get("options", {})
+    return await compute_fingerprint(
+        execution["user_id"],
+        execution["project_id"],
+        pipeline_config=pipeline_config,
+        parameters=execution.get("parameters_used"),
+        targets=options.get("targets"),
+        pipeline=options.get("pipeline", False),
+    )
+
+async def find_memoized_execution(
+    user_id: str,
+    project_id: str,
+    pipeline_config: Dict[str, Any] = None,
+    parameters: Dict[str, Any] = None,
+    targets: list = None,
+    pipeline: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """
+    Find a completed execution that already ran this request on the current
+    project state, so it does not have to be queued again.
+
+    Completed executions store the fingerprint of the state they left
+    behind. A match also requires the workspace to agree with dvc.lock (no
+    stale stage), since dvc.lock alone does not show edited dependencies.
+
+    Returns:
+        dict: The execution record, or None when the request has to run.
+    """
+    if not MEMOIZE_EXECUTIONS:
+        return None
+    project_path = os.path.join(REPO_ROOT, user_id, project_id)
+    try:
+        fingerprint = await compute_fingerprint(user_id, project_id, pipeline_config, parameters, targets, pipeline)
+        executions_collection = await get_pipeline_executions_collection()
+        execution = await executions_collection.find_one(
+            {"user_id": user_id, "project_id": project_id, "fingerprint": fingerprint, "status": "completed"},
+            sort=[("end_time", -1)],
+        )
+        if execution is None:
+            return None
+        if (await staleness.get_staleness(project_path))["stale"]:
+            return None
+        return execution
+    except Exception as e:
+        # Memoization is an optimization: run the pipeline when in doubt
+        logger.warning(f"Could not look up a memoized execution for {user_id}/{project_id}: {e}")
+        return None
+
+def _is_model(path: str) -> bool:
+    return any(path.endswith(ext) for ext in MODEL_EXTENSIONS)
+
+def snapshot_outputs(project_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Outputs recorded in dvc.lock, keyed by their path in the project.
+    """
+    index = pipeline_index.get_index(project_path)
+    outputs = {}
+    for stage_name, entry in (index.lock.get("stages") or {}).items():
+        wdir = str((index.stages.get(stage_name) or {}).get("wdir", "."))
+        for out in entry.get("outs") or []:
+            path = os.path.normpath(os.path.join(wdir, out["path"]))
+            outputs[path] = {
+                "path": path,
+                "stage": stage_name,
+                "md5": out.get("md5"),
+                "size": out.get("size"),
+                "nfiles": out.get("nfiles"),
+            }
+    return outputs
+
+def find_outputs_produced(project_path: str, before: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Compare dvc.lock with the snapshot taken before the run.
+
+    Returns:
+        tuple: (output_files, models_produced) - the outputs whose hash is new
+        or changed, and those of them that are models. Model directories list
+        their model files under "files".
+    """
+    output_files = []
+    models_produced = []
+    for path, output in snapshot_outputs(project_path).items():
+        if output["md5"] is None or before.get(path, {}).get("md5") == output["md5"]:
+            continue
+        output_files.append(output)
+
+        if output["md5"].endswith(".dir"):
+            # Look for model files in the directory manifest
+            manifest_path = staleness.cache_object(staleness.cache_dir(project_path), output["md5"])
+            try:
+                with open(manifest_path, "r") as f:
+                    model_files = [item["relpath"] for item in json.load(f) if _is_model(item["relpath"])]
+            except (OSError, ValueError, KeyError):
+                model_files = []
+            if model_files:
+                models_produced.append({**output, "files": model_files})
+        elif _is_model(path):
+            models_produced.append(output)
+    return output_files, models_produced
+
+async def _count_stages(user_id: str, project_id: str, targets: list) -> Optional[int]:
+    if targets:
+        # Partial runs only visit the stages the targets depend on
+        return None
+    try:
+        dag = await get_pipeline_dag(user_id, project_id)
+        return len(dag.get("stages", []))
+    except Exception:
+        return None
+
+def _lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)
+
+def _project_lease_filter(project_id: str, worker_id: str) -> Dict[str, Any]:
+    return {
+        "_id": ObjectId(project_id),
+        "$or": [
+            {"pipeline_lease": None},
+            {"pipeline_lease.owner": worker_id},
+            {"pipeline_lease.expires_at": {"$lt": datetime.now(timezone.utc)}},
+        ],
+    }
+
+async def _acquire_project_lease(project_id: str, worker_id: str) -> bool:
+    """
+    Take the pipeline lease of a project so executions of the same project
+    never run concurrently in different worker processes.
+    """
+    projects_collection = await get_projects_collection()
+    result = await projects_collection.update_one(
+        _project_lease_filter(project_id, worker_id),
+        {"$set": {"pipeline_lease": {"owner": worker_id, "expires_at": _lease_expiry()}}},
+    )
+    return result.matched_count == 1
+
+async def _release_project_lease(project_id: str, worker_id: str):
+    projects_collection = await get_projects_collection()
+    await projects_collection.update_one(
+        {"_id": ObjectId(project_id), "pipeline_lease.owner": worker_id},
+        {"$set": {"pipeline_lease": None}},
+    )
+
+async def claim_execution(worker_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Atomically lease the queued execution that should run next, among those
+    whose project is not busy: interactive before normal before batch, then
+    the user with the fewest running executions for their weight, then the
+    shortest expected execution, aged by its wait (see scheduler.pick_next).
+    Users with USER_MAX_RUNNING executions running are skipped.
+
+    Returns:
+        dict: The claimed execution record, or None if there is nothing to run
+    """
+    executions_collection = await get_pipeline_executions_collection()
+    running_executions = await executions_collection.find(
+        {"status": "running", "lease_owner": {"$exists": True}},
+        {"user_id": 1, "project_id": 1},
+    ).to_list(None)
+    skipped = {execution["project_id"] for execution in running_executions}
+    running: Dict[str, int] = {}
+    for execution in running_executions:
+        running[execution.get("user_id")] = running.get(execution.get("user_id"), 0) + 1
+
+    while True:
+        candidates = await executions_collection.find(
+            {"status": "queued", "project_id": {"$nin": list(skipped)}},
+            {"execution_id": 1, "user_id": 1, "project_id": 1, "priority": 1, "queued_at": 1, "expected_duration": 1},
+        ).sort([("queued_at", ASCENDING)]).limit(CLAIM_SCAN_LIMIT).to_list(CLAIM_SCAN_LIMIT)
+        candidate = scheduler.pick_next(candidates, running, USER_MAX_RUNNING)
+        if candidate is None:
+            return None
+
+        now = datetime.now(timezone.utc)
+        execution = await executions_collection.find_one_and_update(
+            {"execution_id": candidate["execution_id"], "status": "queued"},
+            {
+                "$set": {
+                    "status": "running",
+                    "start_time": datetime.now().isoformat(),
+                    "lease_owner": worker_id,
+                    "lease_expires_at": _lease_expiry(),
+                    "heartbeat_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if not execution:
+            # Claimed or cancelled in the meantime
+            continue
+
+        if await _acquire_project_lease(execution["project_id"], worker_id):
+            return execution
+
+        # Another worker started a run of this project in the meantime
+        await executions_collection.update_one(
+            {"execution_id": execution["execution_id"], "lease_owner": worker_id},
+            {
+                "$set": {"status": "queued", "start_time": None},
+                "$unset": {"lease_owner": "", "lease_expires_at": "", "heartbeat_at": ""},
+                "$inc": {"attempts": -1},
+            },
+        )
+        skipped.add(execution["project_id"])
+
+async def queue_stats() -> Dict[str, Any]:
+    """
+    Depth of the pipeline queue and how long its executions have been
+    waiting, per priority class and per user.
+    """
+    executions_collection = await get_pipeline_executions_collection()
+    executions = await executions_collection.find(
+        {"status": {"$in": ["queued", "running"]}},
+        {"user_id": 1, "status": 1, "priority": 1, "queued_at": 1},
+    ).to_list(None)
+
+    now = datetime.now()
+    classes = {priority: {"queued": 0, "running": 0, "longest_wait": None} for priority in scheduler.PRIORITY_CLASSES}
+    users: Dict[str, Dict[str, int]] = {}
+    waits = []
+    for execution in executions:
+        priority = execution.get("priority") or scheduler.DEFAULT_PRIORITY
+        counts = classes.setdefault(priority, {"queued": 0, "running": 0, "longest_wait": None})
+        user = users.setdefault(execution.get("user_id"), {"queued": 0, "running": 0})
+        counts[execution["status"]] += 1
+        user[execution["status"]] += 1
+        if execution["status"] == "queued" and execution.get("queued_at"):
+            wait = (now - datetime.fromisoformat(execution["queued_at"])).total_seconds()
+            waits.append(wait)
+            counts["longest_wait"] = round(max(counts["longest_wait"] or 0, wait), 3)
+
+    waits.sort()
+    return {
+        "queued": len(waits),
+        "running": sum(user["running"] for user in users.values()),
+        "p50_wait": round(execution_stats.percentile(waits, 50), 3) if waits else None,
+        "longest_wait": round(waits[-1], 3) if waits else None,
+        "user_max_running": USER_MAX_RUNNING,
+        "classes": classes,
+        "users": users,
+    }
+
+def _remaining(execution: Dict[str, Any], now: datetime) -> float:
+    """Expected seconds left of a running execution."""
+    expected = execution.get("expected_duration")
+    if expected is None:
+        expected = scheduler.UNKNOWN_DURATION
+    if not execution.get("start_time"):
+        return expected
+    elapsed = (now - datetime.fromisoformat(execution["start_time"])).total_seconds()
+    return max(0.0, expected - elapsed)
+
+async def estimate_eta(execution: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Expected start and end of a queued or running execution.
+
+    A running execution is expected to end `expected_duration` after it
+    started. A queued one starts once the running executions and the queued
+    ones ordered before it (priority class, then shortest expected first)
+    are done, shared out over as many workers as are busy.
+
+    Returns:
+        dict: {"expected_duration", "expected_start", "expected_end",
+        "remaining"} (seconds and ISO timestamps), or None once finished.
+    """
+    if execution.get("status") not in ("queued", "running"):
+        return None
+    now = datetime.now()
+    expected = execution.get("expected_duration")
+    duration = scheduler.UNKNOWN_DURATION if expected is None else expected
+
+    if execution["status"] == "running":
+        start = datetime.fromisoformat(execution["start_time"]) if execution.get("start_time") else now
+        remaining = _remaining(execution, now)
+    else:
+        executions_collection = await get_pipeline_executions_collection()
+        active = await executions_collection.find(
+            {"status": {"$in": ["queued", "running"]}},
+            {"execution_id": 1, "status": 1, "priority": 1, "queued_at": 1, "start_time": 1, "expected_duration": 1},
+        ).to_list(None)
+        running = [e for e in active if e["status"] == "running"]
+        own_key = (scheduler.priority_rank(execution.get("priority")), scheduler.sjf_score(execution, now))
+        ahead = [
+            e for e in active
+            if e["status"] == "queued" and e["execution_id"] != execution["execution_id"]
+            and (scheduler.priority_rank(e.get("priority")), scheduler.sjf_score(e, now)) < own_key
+        ]
+        backlog = sum(_remaining(e, now) for e in running) + sum(_remaining(e, now) for e in ahead)
+        wait = backlog / max(1, len(running))
+        start = now + timedelta(seconds=wait)
+        remaining = wait + duration
+
+    return {
+        "expected_duration": expected,
+        "expected_start": start.isoformat(),
+        "expected_end": (now + timedelta(seconds=remaining)).isoformat(),
+        "remaining": round(remaining, 3),
+    }
+
+async def requeue_expired():
+    """
+    Put executions whose worker stopped heartbeating back in the queue, or
+    fail them once they have used up MAX_ATTEMPTS.
+    """
+    executions_collection = await get_pipeline_executions_collection()
+    now = datetime.now(timezone.utc)
+    expired = {"status": "running", "lease_expires_at": {"$lt": now}}
+    clear_lease = {"lease_owner": "", "lease_expires_at": "", "heartbeat_at": ""}
+
+    # Nothing left to cancel once the worker is gone
+    cancelled = await executions_collection.update_many(
+        {**expired, "cancel_requested": True},
+        {
+            "$set": {"status": "cancelled", "end_time": datetime.now().isoformat(), "error_message": "Cancelled by user"},
+            "$unset": {**clear_lease, "cancel_requested": ""},
+        },
+    )
+    failed = await executions_collection.update_many(
+        {**expired, "attempts": {"$gte": MAX_ATTEMPTS}},
+        {
+            "$set": {
+                "status": "failed",
+                "end_time": datetime.now().isoformat(),
+                "error_message": f"Worker lost {MAX_ATTEMPTS} times while running the pipeline"
+            },
+            "$unset": clear_lease,
+        },
+    )
+    requeued = await executions_collection.update_many(
+        expired,
+        {"$set": {"status": "queued", "start_time": None}, "$unset": clear_lease},
+    )
+    if cancelled.modified_count or failed.modified_count or requeued.modified_count:
+        logger.warning(
+            f"Expired pipeline leases: {requeued.modified_count} re-queued, "
+            f"{failed.modified_count} failed, {cancelled.modified_count} cancelled"
+        )
+
+async def _heartbeat(execution: Dict[str, Any], worker_id: str, task: asyncio.Task):
+    """
+    Renew the execution and project leases while the execution runs. If the
+    lease was taken over by another worker, or a cancellation was requested,
+    the local run is cancelled.
+    """
+    executions_collection = await get_pipeline_executions_collection()
+    projects_collection = await get_projects_collection()
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            renewed = await executions_collection.find_one_and_update(
+                {"execution_id": execution["execution_id"], "lease_owner": worker_id},
+                {"$set": {"lease_expires_at": _lease_expiry(), "heartbeat_at": datetime.now(timezone.utc)}},
+                projection={"cancel_requested": 1},
+            )
+            await projects_collection.update_one(
+                {"_id": ObjectId(execution["project_id"]), "pipeline_lease.owner": worker_id},
+                {"$set": {"pipeline_lease.expires_at": _lease_expiry()}},
+            )
+        except Exception as e:
+            # Keep running, the lease only expires after LEASE_SECONDS
+            logger.warning(f"Heartbeat of {execution['execution_id']} failed: {e}")
+            continue
+        if renewed is None:
+            logger.error(f"Lost the lease of {execution['execution_id']}, stopping the local run")
+            task.cancel()
+            return
+        if renewed.get("cancel_requested"):
+            # Cancelled through an API process that does not run it
+            logger.info(f"Cancelling pipeline execution {execution['execution_id']}")
+            _cancelling.add(execution["execution_id"])
+            task.cancel()
+            return
+
+async def run_execution(execution: Dict[str, Any], worker_id: str):
+    """
+    Run a claimed pipeline execution and record its progress, output and
+    timing in the execution record.
+    """
+    executions_collection = await get_pipeline_executions_collection()
+    execution_id = execution["execution_id"]
+    start_time = execution["start_time"]
+
+    user_id = execution["user_id"]
+    project_id = execution["project_id"]
+    options = execution.get("options", {})
+    targets = options.get("targets") or []
+    # Only the lease owner may write the outcome
+    query = {"execution_id": execution_id, "lease_owner": worker_id}
+    clear_lease = {"lease_owner": "", "lease_expires_at": "", "heartbeat_at": ""}
+
+    progress = {
+        "stages_total": await _count_stages(user_id, project_id, targets),
+        "stages_started": 0,
+        "current_stage": None,
+    }
+    await executions_collection.update_one(query, {"$set": {"progress": progress, "worker": worker_id}})
+
+    execution_log = log_stream.ExecutionLog(execution_id, await get_execution_logs_collection())
+
+    project_path = os.path.join(REPO_ROOT, user_id, project_id)
+    try:
+        outputs_before = await asyncio.to_thread(snapshot_outputs, project_path)
+    except Exception as e:
+        logger.warning(f"Could not read dvc.lock of {user_id}/{project_id}: {e}")
+        outputs_before = {}
+
+    # Timing and resource usage of every stage command (see stage_shell)
+    stage_stats_file = os.path.join(project_path, ".dvc", "tmp", f"stage-stats-{execution_id}.jsonl")
+
+    def collect_stages() -> List[Dict[str, Any]]:
+        return stage_shell.summarize_stage_stats(stage_shell.read_stage_stats(stage_stats_file))
+
+    async def on_output(stream: str, line: str):
+        await execution_log.write(stream, line)
+        match = _STAGE_LINE.match(line)
+        if match:
+            progress["stages_started"] += 1
+            progress["current_stage"] = match.group(1)
+            # Stages finished so far
+            await executions_collection.update_one(
+                query, {"$set": {"progress": progress, "stages": collect_stages()}}
+            )
+
+    try:
+        await repro(
+            user_id,
+            project_id,
+            target=targets[0] if targets else None,
+            pipeline=options.get("pipeline", False),
+            force=options.get("force", False),
+            dry_run=options.get("dry_run", False),
+            log_callback=on_output,
+            jobs=options.get("parallel_jobs"),
+            stage_stats_file=stage_stats_file,
+        )
+
+        end_time = datetime.now().isoformat()
+        duration = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
+
+        # Outputs (and models) whose hash changed in dvc.lock
+        output_files, models_produced = await asyncio.to_thread(
+            find_outputs_produced, project_path, outputs_before
+        )
+
+        fingerprint = None
+        if not options.get("dry_run", False):
+            try:
+                fingerprint = await _execution_fingerprint(execution)
+            except Exception as e:
+                logger.warning(f"Could not fingerprint execution {execution_id}: {e}")
+
+        progress["current_stage"] = None
+        await execution_log.flush()
+        await executions_collection.update_one(
+            query,
+            {
+                "$set": {
+                    "status": "completed",
+                    "fingerprint": fingerprint,
+                    "end_time": end_time,
+                    "duration": duration,
+                    "output_files": output_files,
+                    "models_produced": models_produced,
+                    "stages": collect_stages(),
+                    "metrics": {},  # Will be populated from result parsing if needed
+                    "progress": progress,
+                },
+                "$unset": clear_lease,
+            }
+        )
+        await execution_log.close("completed")
+
+        if execution.get("pipeline_config_id"):
+            # Update pipeline configuration with execution info
+            pipeline_configs_collection = await get_pipeline_configs_collection()
+            await pipeline_configs_collection.update_one(
+                {"_id": ObjectId(execution["pipeline_config_id"])},
+                {
+                    "$set": {
+                        "last_executed": end_time,
+                        "updated_at": end_time
+                    },
+                    "$inc": {"execution_count": 1}
+                }
+            )
+    except asyncio.CancelledError:
+        if execution_id in _cancelling:
+            # The commands were killed on the way out of repro
+            await _record_cancelled(execution, query, clear_lease, execution_log, collect_stages())
+            return
+        # The worker is stopping (or lost its lease): give the execution back
+        # so another worker picks it up
+        await execution_log.write("stderr", "Worker stopped, execution re-queued")
+        await execution_log.flush()
+        await executions_collection.update_one(
+            query,
+            {"$set": {"status": "queued", "start_time": None}, "$unset": clear_lease}
+        )
+        await execution_log.close("queued")
+        raise
+    except Exception as e:
+        end_time = datetime.now().isoformat()
+        duration = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
+        print(f"Error in pipeline execution {execution_id}:", str(e))
+        print("Traceback:", traceback.format_exc())
+
+        # Update execution record with failure
+        stages = collect_stages()
+        limit_breaches = resource_limits.find_breaches(stages, str(e))
+        await execution_log.write("stderr", f"Error: {str(e)}")
+        for breach in limit_breaches:
+            await execution_log.write("stderr", f"Resource limit exceeded: {breach['limit']} (stage {breach['stage']})")
+        await execution_log.flush()
+        await executions_collection.update_one(
+            query,
+            {
+                "$set": {
+                    "status": "failed",
+                    "end_time": end_time,
+                    "duration": duration,
+                    "stages": stages,
+                    "limit_breaches": limit_breaches,
+                    "error_message": str(e)
+                },
+                "$unset": clear_lease,
+            }
+        )
+        await execution_log.close("failed")
+    finally:
+        try:
+            os.remove(stage_stats_file)
+        except OSError:
+            pass
+
+async def _record_cancelled(execution: Dict[str, Any], query: Dict[str, Any], clear_lease: Dict[str, str],
+                            execution_log: log_stream.ExecutionLog, stages: List[Dict[str, Any]]):
+    """Mark a running execution cancelled once its commands are gone."""
+    project_path = os.path.join(REPO_ROOT, execution["user_id"], execution["project_id"])
+    async with scheduler.project_lock(project_path):
+        await asyncio.to_thread(clear_stale_dvc_locks, project_path)
+
+    end_time = datetime.now().isoformat()
+    duration = (datetime.fromisoformat(end_time) - datetime.fromisoformat(execution["start_time"])).total_seconds()
+    await execution_log.write("stderr", "Execution cancelled")
+    await execution_log.flush()
+    executions_collection = await get_pipeline_executions_collection()
+    await executions_collection.update_one(
+        query,
+        {
+            "$set": {
+                "status": "cancelled",
+                "end_time": end_time,
+                "duration": duration,
+                "stages": stages,
+                "error_message": "Cancelled by user",
+            },
+            "$unset": {**clear_lease, "cancel_requested": ""},
+        }
+    )
+    await execution_log.close("cancelled")
+
+async def cancel_execution(user_id: str, project_id: str, execution_id: str) -> Optional[str]:
+    """
+    Cancel a queued or running execution.
+
+    Queued executions are cancelled right away. Running ones are flagged:
+    the worker running them (here, or the next heartbeat of a worker in
+    another process) cancels the run, which kills the process group of the
+    running commands and clears DVC's locks.
+
+    Returns:
+        str: "cancelled", "cancelling", the final status of an execution
+        that already finished, or None if there is no such execution.
+    """
+    executions_collection = await get_pipeline_executions_collection()
+    query = {"execution_id": execution_id, "user_id": user_id, "project_id": project_id}
+
+    now = datetime.now().isoformat()
+    cancelled = await executions_collection.find_one_and_update(
+        {**query, "status": "queued"},
+        {"$set": {"status": "cancelled", "end_time": now, "error_message": "Cancelled by user"}},
+    )
+    if cancelled is not None:
+        return "cancelled"
+
+    running = await executions_collection.find_one_and_update(
+        {**query, "status": "running"},
+        {"$set": {"cancel_requested": True, "cancel_requested_at": now}},
+    )
+    if running is None:
+        execution = await executions_collection.find_one(query, {"status": 1})
+        return execution["status"] if execution else None
+
+    task = _running.get(execution_id)
+    if task is not None:
+        _cancelling.add(execution_id)
+        task.cancel()
+    return "cancelling"
+
+async def _run_leased(execution: Dict[str, Any], worker_id: str):
+    """Run a claimed execution while a heartbeat keeps its leases alive."""
+    # Its commands compete for the command slots in its priority class
+    with scheduler.priority(execution.get("priority")):
+        task = asyncio.create_task(run_execution(execution, worker_id))
+    heartbeat = asyncio.create_task(_heartbeat(execution, worker_id, task))
+    _running[execution["execution_id"]] = task
+    try:
+        # asyncio.wait does not raise when the heartbeat cancels the run
+        await asyncio.wait({task})
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    finally:
+        _running.pop(execution["execution_id"], None)
+        heartbeat.cancel()
+        await _release_project_lease(execution["project_id"], worker_id)
+    if task.cancelled() and execution["execution_id"] in _cancelling:
+        # Cancelled before run_execution got to record it
+        executions_collection = await get_pipeline_executions_collection()
+        await executions_collection.update_one(
+            {"execution_id": execution["execution_id"], "lease_owner": worker_id},
+            {
+                "$set": {"status": "cancelled", "end_time": datetime.now().isoformat(), "error_message": "Cancelled by user"},
+                "$unset": {"lease_owner": "", "lease_expires_at": "", "heartbeat_at": "", "cancel_requested": ""},
+            }
+        )
+    _cancelling.discard(execution["execution_id"])
+    if not task.cancelled() and task.exception():
+        logger.error(f"Pipeline execution {execution['execution_id']} crashed: {task.exception()}")
+
+async def consume(worker_id: str):
+    """
+    Worker loop: claim queued executions one at a time and run them.
+    """
+    while True:
+        try:
+            execution = await claim_execution(worker_id)
+            if execution is None:
+                await requeue_expired()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                _wakeup.clear()
+                continue
+            logger.info(f"Worker {worker_id} running {execution['execution_id']}")
+            await _run_leased(execution, worker_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Pipeline worker {worker_id} error: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+async def enqueue(execution_id: str):
+    """
+    Tell local workers that an execution was queued. Standalone workers
+    find it on their next poll.
+    """
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def _ensure_indexes():
+    executions_collection = await get_pipeline_executions_collection()
+    await executions_collection.create_index([("status", ASCENDING), ("queued_at", ASCENDING)])
+    await executions_collection.create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+    await executions_collection.create_index([("user_id", ASCENDING), ("project_id", ASCENDING), ("fingerprint", ASCENDING)])
+    # Range scans of finished executions for /pipeline/executions/stats
+    await executions_collection.create_index([("user_id", ASCENDING), ("project_id", ASCENDING), ("end_time", ASCENDING)])
+    execution_logs_collection = await get_execution_logs_collection()
+    await execution_logs_collection.create_index([("execution_id", ASCENDING), ("start_line", ASCENDING)], unique=True)
+
+async def start_workers(count: int = QUEUE_WORKERS):
+    """
+    Start `count` workers in this process. Called on server startup and by
+    worker.py.
+    """
+    global _wakeup
+    if _workers:
+        return
+    try:
+        await _ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create pipeline execution indexes: {e}")
+    if count <= 0:
+        return
+    _wakeup = asyncio.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    for i in range(count):
+        _workers.append(asyncio.create_task(consume(f"{prefix}:{i}")))
+
+async def stop_workers():
+    """
+    Stop the workers. Running executions are put back in the queue.
+    """
+    global _wakeup
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _wakeup = None
@@ -0,0 +1,206 @@
+import os
+import re
+import codecs
+import signal
+import asyncio
+import logging
+from asyncio.subprocess import PIPE
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from app import resource_limits
+
+logger = logging.getLogger(__name__)
+
+# Bytes kept in memory of each output stream: its start and its end, with
+# whatever was printed in between dropped
+OUTPUT_HEAD_BYTES = int(os.getenv("PROCESS_OUTPUT_HEAD_BYTES", str(1024 * 1024)))
+OUTPUT_TAIL_BYTES = int(os.getenv("PROCESS_OUTPUT_TAIL_BYTES", str(1024 * 1024)))
+# Lines longer than this are split so one runaway line cannot grow unbounded
+MAX_LINE_LENGTH = 64 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+# Seconds a cancelled command gets to exit after SIGINT before it is killed
+KILL_GRACE_SECONDS = float(os.getenv("PROCESS_KILL_GRACE", "10"))
+
+# Progress bars rewrite the line with \r, treat it as a line break too
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+LineCallback = Callable[[str, str], Awaitable[None]]
+OutputCallback = Callable[[str, bytes], Awaitable[None]]
+
+def join_output(head: bytes, omitted: int, tail: bytes) -> str:
+    """Text of a bounded output, marking where bytes were dropped."""
+    text = head.decode(errors="replace")
+    if omitted:
+        text += f"\n... [{omitted} bytes of output omitted] ...\n"
+    return (text + tail.decode(errors="replace")).strip()
+
+class OutputBuffer:
+    """
+    Keeps the first `head_bytes` of a stream and a ring buffer of its last
+    `tail_bytes`, however much is written to it.
+    """
+
+    def __init__(self, head_bytes: int = None, tail_bytes: int = None):
+        self.head_bytes = OUTPUT_HEAD_BYTES if head_bytes is None else head_bytes
+        self.tail_bytes = OUTPUT_TAIL_BYTES if tail_bytes is None else tail_bytes
+        self.total = 0
+        self._head = bytearray()
+        self._ring = bytearray(self.tail_bytes)
+        self._pos = 0
+        self._filled = 0
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        size = self.tail_bytes
+        if not data or not size:
+            return
+        if len(data) >= size:
+            self._ring[:] = data[-size:]
+            self._pos = 0
+            self._filled = size
+            return
+        first = min(len(data), size - self._pos)
+        self._ring[self._pos:self._pos + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+        self._pos = (self._pos + len(data)) % size
+        self._filled = min(size, self._filled + len(data))
+
+    def tail(self) -> bytes:
+        if self._filled < self.tail_bytes:
+            return bytes(self._ring[:self._filled])
+        return bytes(self._ring[self._pos:] + self._ring[:self._pos])
+
+    @property
+    def omitted(self) -> int:
+        return self.total - len(self._head) - self._filled
+
+    def getvalue(self) -> str:
+        return join_output(bytes(self._head), self.omitted, self.tail())
+
+async def _pump(reader: asyncio.StreamReader, name: str, buffer: OutputBuffer,
+                on_line: Optional[LineCallback], on_output: Optional[OutputCallback]):
+    """
+    Read a process stream chunk by chunk into `buffer`, handing out the raw
+    chunks and the complete lines to the callbacks.
+    """
+    pending = ""
+    # Characters can be split between chunks
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = await reader.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if on_output is not None:
+            await on_output(name, chunk)
+        if on_line is None:
+            continue
+        pending += decoder.decode(chunk)
+        parts = _LINE_BREAK.split(pending)
+        pending = parts.pop()
+        while len(pending) > MAX_LINE_LENGTH:
+            parts.append(pending[:MAX_LINE_LENGTH])
+            pending = pending[MAX_LINE_LENGTH:]
+        for line in parts:
+            if line:
+                await on_line(name, line)
+    if on_line is None:
+        return
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        await on_line(name, pending)
+
+def _signal_group(pgid: int, sig: int):
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def terminate_process_group(process: asyncio.subprocess.Process, grace: float = None):
+    """
+    Stop a process started with `start_new_session=True` together with every
+    process it started.
+
+    The group first gets SIGINT, so DVC releases its locks and stage commands
+    can clean up, and SIGKILL once the process exited or `grace` seconds
+    passed, which also takes care of children left behind.
+    """
+    _signal_group(process.pid, signal.SIGINT)
+    try:
+        await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS if grace is None else grace)
+    except asyncio.TimeoutError:
+        pass
+    _signal_group(process.pid, signal.SIGKILL)
+    await process.wait()
+
+async def run_command(
+    command: str,
+    cwd: str = None,
+    on_line: Optional[LineCallback] = None,
+    env: Dict[str, str] = None,
+    on_output: Optional[OutputCallback] = None,
+) -> Tuple[int, str, str]:
+    """
+    Run a shell command, reading its output as it is produced instead of
+    buffering all of it with `communicate()`.
+
+    Args:
+        command (str): The shell command to run.
+        cwd (str, optional): Working directory.
+        on_line (callable, optional): Coroutine called with ("stdout" or
+            "stderr", line) for every line of output.
+        env (dict, optional): Environment for the process.
+        on_output (callable, optional): Coroutine called with ("stdout" or
+            "stderr", bytes) for every chunk read, for consumers that need
+            the whole output.
+
+    Returns:
+        tuple: (returncode, stdout, stderr) where stdout/stderr hold at most
+        the first OUTPUT_HEAD_BYTES and the last OUTPUT_TAIL_BYTES of each
+        stream.
+    """
+    # The limits are applied by a wrapper exec'd in the child: a preexec_fn
+    # is not safe in a process that runs threads
+    argv = resource_limits.limited_argv(["/bin/sh", "-c", command], cwd)
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        cwd=cwd,
+        stdout=PIPE,
+        stderr=PIPE,
+        env=env,
+        # Own process group, so cancelling kills the whole command tree
+        start_new_session=True,
+    )
+    buffers = {"stdout": OutputBuffer(), "stderr": OutputBuffer()}
+
+    try:
+        await asyncio.gather(
+            _pump(process.stdout, "stdout", buffers["stdout"], on_line, on_output),
+            _pump(process.stderr, "stderr", buffers["stderr"], on_line, on_output),
+        )
+        returncode = await process.wait()
+    except BaseException:
+        # Do not leave the command (or anything it started) running when
+        # the caller goes away
+        await terminate_process_group(process)
+        raise
+
+    return returncode, buffers["stdout"].getvalue(), buffers["stderr"].getvalue()
+
+async def capture_command(command: str, cwd: str = None, env: Dict[str, str] = None) -> Tuple[int, str, str]:
+    """
+    Like `run_command`, but returns all of stdout. For commands whose output
+    is data (JSON, tables, listings) that must not be cut.
+    """
+    chunks = []
+
+    async def collect(stream: str, data: bytes):
+        if stream == "stdout":
+            chunks.append(data)
+
+    returncode, _, stderr = await run_command(command, cwd=cwd, env=env, on_output=collect)
+    return returncode, b"".join(chunks).decode(errors="replace").strip(), stderr
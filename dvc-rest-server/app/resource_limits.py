@@ -0,0 +1,161 @@
+"""
+Resource limits for the commands the server starts (dvc, git and stage
+commands), so that one runaway training script cannot take the API host
+down with it.
+
+Limits are configured with environment variables and are off by default:
+
+- SUBPROCESS_CPU_SECONDS, SUBPROCESS_MEMORY_MB, SUBPROCESS_MAX_OPEN_FILES:
+  rlimits (CPU time, address space, open files) of every process started.
+- SUBPROCESS_CGROUP_ROOT: a delegated cgroup v2 directory. Commands are
+  placed in a child cgroup per project (or per user with
+  SUBPROCESS_CGROUP_PER=user), limited by SUBPROCESS_CGROUP_MEMORY_MAX,
+  SUBPROCESS_CGROUP_CPU_MAX and SUBPROCESS_CGROUP_PIDS_MAX (cgroup syntax,
+  e.g. "8G", "400000 100000", "512").
+
+Plain processes are started through the stage shell wrapper
+(app.stage_shell), which applies the limits and then execs the command.
+Commands run by the pre-warmed DVC workers keep the worker itself
+unlimited, and their stage commands get the limits from the wrapper too.
+"""
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from app import stage_shell
+
+logger = logging.getLogger(__name__)
+
+CPU_SECONDS = int(os.getenv("SUBPROCESS_CPU_SECONDS", "0"))
+MEMORY_MB = int(os.getenv("SUBPROCESS_MEMORY_MB", "0"))
+OPEN_FILES = int(os.getenv("SUBPROCESS_MAX_OPEN_FILES", "0"))
+
+CGROUP_ROOT = os.getenv("SUBPROCESS_CGROUP_ROOT", "")
+CGROUP_PER = os.getenv("SUBPROCESS_CGROUP_PER", "project")
+CGROUP_MEMORY_MAX = os.getenv("SUBPROCESS_CGROUP_MEMORY_MAX", "")
+CGROUP_CPU_MAX = os.getenv("SUBPROCESS_CGROUP_CPU_MAX", "")
+CGROUP_PIDS_MAX = os.getenv("SUBPROCESS_CGROUP_PIDS_MAX", "")
+
+_CONTROLLERS = ("cpu", "memory", "pids")
+
+# Messages of commands that failed on an rlimit without being killed
+_BREACH_MESSAGES = {
+    "memory_mb": ("MemoryError", "Cannot allocate memory", "std::bad_alloc", "out of memory"),
+    "open_files": ("Too many open files",),
+}
+
+# cgroup name -> its directory, or None when it could not be set up
+_cgroups: Dict[str, Optional[str]] = {}
+_cgroups_lock = threading.Lock()
+
+def is_enabled() -> bool:
+    return bool(CPU_SECONDS or MEMORY_MB or OPEN_FILES or CGROUP_ROOT)
+
+def _cgroup_name(cwd: str = None) -> Optional[str]:
+    """Relative cgroup of the project (or user) `cwd` belongs to."""
+    # Imported here because dvc_handler depends on this module
+    from app.dvc_handler import REPO_ROOT
+    from app.scheduler import project_key
+
+    rel = os.path.relpath(project_key(cwd), os.path.abspath(REPO_ROOT))
+    if rel.startswith(os.pardir):
+        return None
+    parts = rel.split(os.sep)
+    return parts[0] if CGROUP_PER == "user" else os.path.join(*parts[:2])
+
+def _write(path: str, value: str):
+    with open(path, "w") as f:
+        f.write(value)
+
+def _ensure_cgroup(name: str) -> Optional[str]:
+    """
+    Create the cgroup (and its parents) under CGROUP_ROOT and set its limits.
+    Failures are logged once and the command runs without a cgroup.
+    """
+    path = os.path.join(CGROUP_ROOT, name)
+    with _cgroups_lock:
+        if name in _cgroups:
+            return _cgroups[name]
+        try:
+            os.makedirs(path, exist_ok=True)
+            # Every level above the leaf has to hand the controllers down
+            parent = CGROUP_ROOT
+            for part in name.split(os.sep):
+                try:
+                    _write(os.path.join(parent, "cgroup.subtree_control"),
+                           " ".join(f"+{c}" for c in _CONTROLLERS))
+                except OSError as e:
+                    logger.warning(f"Could not enable cgroup controllers in {parent}: {e}")
+                parent = os.path.join(parent, part)
+            for filename, value in (("memory.max", CGROUP_MEMORY_MAX), ("cpu.max", CGROUP_CPU_MAX), ("pids.max", CGROUP_PIDS_MAX)):
+                if value:
+                    _write(os.path.join(path, filename), value)
+        except OSError as e:
+            logger.error(f"Could not set up cgroup {path}: {e}")
+            path = None
+        _cgroups[name] = path
+        return path
+
+def limits_for(cwd: str = None) -> Dict[str, Any]:
+    """
+    Limits of a command running in `cwd`, in the form `stage_shell.apply_limits`
+    takes. Empty when no limit is configured.
+    """
+    if not is_enabled():
+        return {}
+    limits: Dict[str, Any] = {}
+    if CPU_SECONDS:
+        limits["cpu_seconds"] = CPU_SECONDS
+    if MEMORY_MB:
+        limits["memory_mb"] = MEMORY_MB
+    if OPEN_FILES:
+        limits["open_files"] = OPEN_FILES
+    if CGROUP_ROOT:
+        name = _cgroup_name(cwd)
+        cgroup = _ensure_cgroup(name) if name else None
+        if cgroup:
+            limits["cgroup"] = cgroup
+    return limits
+
+def limited_argv(argv: List[str], cwd: str = None) -> List[str]:
+    """
+    Command line starting `argv` under the limits of `cwd`; `argv` itself
+    when there are none.
+    """
+    limits = limits_for(cwd)
+    if not limits:
+        return argv
+    return stage_shell.limited_argv(argv, limits)
+
+def pooled_env(env: Optional[Dict[str, str]], cwd: str = None) -> Optional[Dict[str, str]]:
+    """
+    Environment for a command run by a pre-warmed DVC worker: its stage
+    commands go through the stage shell wrapper, which applies the limits.
+    """
+    limits = limits_for(cwd)
+    if not limits:
+        return env
+    env = dict(os.environ if env is None else env)
+    if env.get("SHELL") != stage_shell.shell_path():
+        env = stage_shell.stage_env(None, env)
+    env[stage_shell.LIMITS_ENV] = json.dumps(limits)
+    return env
+
+def find_breaches(stages: List[Dict[str, Any]], error: str = "") -> List[Dict[str, Any]]:
+    """
+    Limits a failed run went over: stages the wrapper saw killed for it, and
+    errors matching what a process prints when an rlimit refuses it memory
+    or files.
+    """
+    breaches = [
+        {"stage": stage["name"], "limit": stage["limit"]}
+        for stage in stages
+        if stage.get("limit")
+    ]
+    configured = {"memory_mb": MEMORY_MB, "open_files": OPEN_FILES}
+    for limit, messages in _BREACH_MESSAGES.items():
+        if configured[limit] and any(message in (error or "") for message in messages):
+            failed = [stage["name"] for stage in stages if stage.get("status") == "failed"]
+            breaches.append({"stage": failed[-1] if failed else None, "limit": limit})
+    return breaches
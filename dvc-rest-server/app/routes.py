@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException, File, Form, UploadFile
+from fastapi import APIRouter, HTTPException, File, Form, UploadFile, Response, Query, Request
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import JSONResponse, StreamingResponse
 from app.classes import *
 from bson.objectid import ObjectId
 from typing import List, Optional, Dict, Any
-from app.init_db import get_users_collection, get_projects_collection, get_pipeline_configs_collection, get_data_sources_collection, get_remote_storages_collection, get_code_files_collection, get_models_collection, get_pipeline_executions_collection, get_model_paths_collection, get_model_evaluations_collection
+from app.init_db import get_users_collection, get_projects_collection, get_pipeline_configs_collection, get_data_sources_collection, get_remote_storages_collection, get_code_files_collection, get_models_collection, get_pipeline_executions_collection, get_model_paths_collection, get_model_evaluations_collection, get_execution_logs_collection
 from pydantic import BaseModel
 from app.dvc_handler import (
     create_project as dvc_create_project,
@@ -17,18 +19,21 @@ from app.dvc_handler import (
     create_dvc_branch as dvc_create_dvc_branch,
     delete_dvc_branch as dvc_delete_dvc_branch,
     dvc_metrics_show,
+    dvc_params_show,
     dvc_metrics_diff,
     dvc_plots_show,
     dvc_plots_diff,
     add_stages,
     add_stage,
     repro,
+    dry_run_pipeline,
     get_dvc_status,
     create_pipeline_template,
     get_pipeline_stages,
     update_pipeline_stage,
     remove_pipeline_stage,
     validate_pipeline,
+    get_pipeline_dag,
     add_data_source,
     remove_data_source,
     update_data_source,
@@ -55,15 +60,58 @@ from app.dvc_handler import (
     validate_parameters
 )
 from app.dvc_exp import *
+from app import log_stream
+from app import pipeline_jobs
+from app import pipeline_index
+from app import execution_stats
+from app import dvc_handler
+from app import scheduler
+from app import worktree_pool
+from app import exp_sweep
+from app import adaptive_sweep
+from app import live_metrics
+from app import exp_table
+from app import exp_index
 import traceback
 from datetime import datetime
 import os
 import asyncio
 import json
-import yaml
 
 router = APIRouter()
 
+# Largest page of log lines served by the execution log endpoints
+MAX_LOG_PAGE_LINES = 10000
+
+# Experiment runs and model evaluations of this process that can be
+# cancelled, by _task_key
+_background_tasks: Dict[str, asyncio.Task] = {}
+
+def _task_key(kind: str, user_id: str, project_id: str, run_id: str) -> str:
+    """
+    Key of a cancellable run ("exp:{user_id}:{project_id}:{stream_id}").
+    Scoped to the project so ids chosen by one user never reach another
+    user's runs or output.
+    """
+    return f"{kind}:{user_id}:{project_id}:{run_id}"
+
+async def project_busy_handler(request: Request, exc: HTTPException):
+    """
+    Exception handler for HTTPException, registered on the app. The routes
+    turn every error into a 500; a read that gave up waiting for a busy
+    project (scheduler.ProjectBusy) is answered with a 503 instead.
+    """
+    cause = exc.__cause__ or exc.__context__
+    while cause is not None:
+        if isinstance(cause, scheduler.ProjectBusy):
+            return JSONResponse(
+                status_code=503,
+                content={"detail": str(cause)},
+                headers={"Retry-After": str(int(scheduler.READ_LOCK_TIMEOUT) or 30)},
+            )
+        cause = cause.__cause__ or cause.__context__
+    return await http_exception_handler(request, exc)
+
 @router.get("/users/", response_model=List[User])
 async def get_users():
     """
@@ -367,6 +415,19 @@ async def show_metrics(user_id: str, project_id: str, request: MetricsShowReques
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{user_id}/{project_id}/params_show")
+async def show_params(user_id: str, project_id: str):
+    """
+    Show the pipeline parameters for a project.
+    """
+    try:
+        result = await dvc_params_show(user_id, project_id)
+        return result
+    except Exception as e:
+        print("Error in show_params:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{user_id}/{project_id}/metrics_diff")
 async def metrics_diff(user_id: str, project_id: str, request: MetricsDiffRequest):
     """
@@ -422,38 +483,346 @@ async def plots_diff(user_id: str, project_id: str, request: PlotsDiffRequest):
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
     
+def _index_experiments(user_id: str, project_id: str):
+    """Update the experiment index after a command changed experiment refs."""
+    exp_index.schedule_sync(user_id, project_id, os.path.join(dvc_handler.REPO_ROOT, user_id, project_id))
+
 @router.post("/{user_id}/{project_id}/exp/run")
 async def run_experiment(user_id: str, project_id:str, request: RunExperimentRequest):
+    key = _task_key("exp", user_id, project_id, request.stream_id)
+    if request.stream_id:
+        running = _background_tasks.get(key)
+        if running is not None and not running.done():
+            raise HTTPException(status_code=409, detail=f"An experiment with stream_id '{request.stream_id}' is already running")
+    # Clients can follow the output on /exp/stream/{stream_id}
+    experiment_log = log_stream.ExecutionLog(key) if request.stream_id else None
+    status = "failed"
     try:
-        result = await dvc_exp_run(
-            user_id, project_id,
-            quiet=request.quiet,
-            verbose=request.verbose,
-            force=request.force,
-            interactive=request.interactive,
-            single_item=request.single_item,
-            pipeline=request.pipeline,
-            recursive=request.recursive,
-            run_all=request.run_all,
-            queue=request.queue,
-            parallel_jobs=request.parallel_jobs,
-            temp=request.temp,
-            experiment_name=request.experiment_name,
+        # Dry runs are interactive, ahead of other users' batch work
+        with scheduler.priority(request.priority or ("interactive" if request.dry else None)):
+            # A task of its own, so /exp/stream/{stream_id}/cancel stops the
+            # run and not this request
+            run = asyncio.create_task(dvc_exp_run(
+                user_id, project_id,
+                quiet=request.quiet,
+                verbose=request.verbose,
+                force=request.force,
+                interactive=request.interactive,
+                single_item=request.single_item,
+                pipeline=request.pipeline,
+                recursive=request.recursive,
+                run_all=request.run_all,
+                queue=request.queue,
+                parallel_jobs=request.parallel_jobs,
+                temp=request.temp,
+                experiment_name=request.experiment_name,
+                set_param=request.set_param,
+                experiment_rev=request.experiment_rev,
+                cwd_reset=request.cwd_reset,
+                message=request.message,
+                downstream=request.downstream,
+                force_downstream=request.force_downstream,
+                pull=request.pull,
+                dry=request.dry,
+                allow_missing=request.allow_missing,
+                keep_running=request.keep_running,
+                ignore_errors=request.ignore_errors,
+                targets=request.targets,
+                log_callback=experiment_log.write if experiment_log else None,
+            ))
+        if request.stream_id:
+            _background_tasks[key] = run
+            run.add_done_callback(lambda _: _background_tasks.pop(key, None) if _background_tasks.get(key) is run else None)
+        try:
+            result = await asyncio.shield(run)
+        except asyncio.CancelledError:
+            status = "cancelled"
+            if run.cancelled():
+                return {"message": "Experiment run cancelled", "stream_id": request.stream_id, "status": "cancelled"}
+            # The client went away: stop the run with it
+            run.cancel()
+            await asyncio.wait({run})
+            raise
+        status = "completed"
+        _index_experiments(user_id, project_id)
+        return {"message": "Experiment run successfully", "output": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if experiment_log:
+            await experiment_log.close(status)
+
+@router.get("/{user_id}/{project_id}/exp/stream/{stream_id}")
+async def stream_experiment_output(user_id: str, project_id: str, stream_id: str):
+    """
+    Stream the output of a `dvc exp run` started with the same `stream_id`
+    as Server-Sent Events. Finished runs stay available for
+    log_stream.CHANNEL_RETENTION seconds.
+    """
+    channel = log_stream.get_channel(_task_key("exp", user_id, project_id, stream_id))
+    if channel is None:
+        raise HTTPException(status_code=404, detail="No experiment run with this stream_id")
+
+    async def events():
+        async for event in channel.subscribe():
+            yield log_stream.format_sse(event)
+        yield log_stream.format_sse({"status": channel.status}, event_type="end")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@router.post("/{user_id}/{project_id}/exp/stream/{stream_id}/cancel")
+async def cancel_experiment_run(user_id: str, project_id: str, stream_id: str):
+    """
+    Stop a `dvc exp run` started with this `stream_id`, killing the process
+    group of its commands.
+    """
+    # The key is scoped to the project, so a run found here was started in
+    # this user's project and its locks are in this project's path
+    task = _background_tasks.get(_task_key("exp", user_id, project_id, stream_id))
+    if task is None or task.done():
+        raise HTTPException(status_code=404, detail="No running experiment with this stream_id")
+    task.cancel()
+    await asyncio.wait({task})
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    await asyncio.to_thread(dvc_handler.clear_stale_dvc_locks, project_path)
+    return {"stream_id": stream_id, "status": "cancelled"}
+
+@router.post("/{user_id}/{project_id}/exp/sweep")
+async def sweep_experiments(user_id: str, project_id: str, request: ExperimentSweepRequest):
+    """
+    Queue one experiment per combination of a grid, random or list spec over
+    params.yaml keys and start `request.jobs` `dvc queue` workers. Progress
+    is on /exp/sweep/{sweep_id}.
+
+    With a `metric`, the sweep is adaptive: `request.jobs` runs are queued
+    at a time and the runs that trail at a rung are stopped early (see
+    app.adaptive_sweep).
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    try:
+        combinations = exp_sweep.expand_sweep(
+            grid=request.grid,
+            random_spec=request.random,
+            runs=request.runs,
+            samples=request.samples,
+            seed=request.seed,
             set_param=request.set_param,
-            experiment_rev=request.experiment_rev,
-            cwd_reset=request.cwd_reset,
-            message=request.message,
-            downstream=request.downstream,
-            force_downstream=request.force_downstream,
-            pull=request.pull,
-            dry=request.dry,
-            allow_missing=request.allow_missing,
-            keep_running=request.keep_running,
-            ignore_errors=request.ignore_errors,
+        )
+        sweep_id = request.name or exp_sweep.new_sweep_id()
+        if request.metric:
+            early_stopping = adaptive_sweep.early_stopping_spec(
+                request.metric,
+                mode=request.mode,
+                min_steps=request.min_steps,
+                max_steps=request.max_steps,
+                reduction_factor=request.reduction_factor,
+                metrics_dir=request.metrics_dir,
+            )
+            sweep = adaptive_sweep.new_adaptive_sweep(
+                project_path, sweep_id, combinations, early_stopping,
+                jobs=request.jobs, targets=request.targets,
+            )
+            adaptive_sweep.start_driver(project_path, sweep)
+            return {"message": f"Started adaptive sweep of {len(sweep['runs'])} experiments", **sweep}
+
+        sweep = await exp_sweep.start_sweep(
+            project_path,
+            sweep_id,
+            combinations,
+            jobs=request.jobs,
             targets=request.targets,
         )
-        return {"message": "Experiment run successfully", "output": result}
+        return {"message": f"Queued {len(sweep['runs'])} experiments", **sweep}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print("Error in sweep_experiments:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{user_id}/{project_id}/exp/sweep/{sweep_id}")
+async def get_sweep_progress(user_id: str, project_id: str, sweep_id: str):
+    """
+    Progress of a sweep: runs per status and the parameters and status of
+    every run.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    sweep = exp_sweep.load_sweep(project_path, sweep_id)
+    if sweep is None:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    try:
+        return await exp_sweep.sweep_progress(project_path, sweep)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/{user_id}/{project_id}/exp/sweep/{sweep_id}/cancel")
+async def cancel_sweep(user_id: str, project_id: str, sweep_id: str):
+    """
+    Stop a sweep: kill its running experiments and drop the ones that have
+    not started. Finished experiments are kept.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    if exp_sweep.load_sweep(project_path, sweep_id) is None:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    try:
+        # Stop the adaptive sweep's driver before it queues more runs
+        await adaptive_sweep.stop_driver(project_path, sweep_id)
+        sweep = await exp_sweep.cancel_sweep(project_path, exp_sweep.load_sweep(project_path, sweep_id))
+        return await exp_sweep.sweep_progress(project_path, sweep)
+    except Exception as e:
+        print("Error in cancel_sweep:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{user_id}/{project_id}/exp/sweep/{sweep_id}/stream")
+async def stream_sweep_progress(user_id: str, project_id: str, sweep_id: str):
+    """
+    Stream the progress of a sweep as Server-Sent Events, one `progress`
+    event each time a run changes status, until every run has finished.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    sweep = exp_sweep.load_sweep(project_path, sweep_id)
+    if sweep is None:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+
+    async def events():
+        async for progress in exp_sweep.follow_sweep(project_path, sweep_id):
+            yield log_stream.format_sse(progress, event_type="progress")
+        yield log_stream.format_sse({"status": "done"}, event_type="end")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@router.get("/{user_id}/{project_id}/exp/live")
+async def get_live_metrics(user_id: str, project_id: str, run: Optional[str] = None, metrics_dir: str = "dvclive"):
+    """
+    Metrics DVCLive has logged so far in the workspaces of the project's
+    experiments, as a compact series per run and metric. Only what was
+    appended since the previous request is read from disk.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    if not os.path.isdir(project_path):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        watcher = live_metrics.get_watcher(project_path, metrics_dir)
+        await watcher.refresh()
+        return watcher.snapshot(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print("Error in get_live_metrics:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{user_id}/{project_id}/exp/live/stream")
+async def stream_live_metrics(user_id: str, project_id: str, run: Optional[str] = None, metrics_dir: str = "dvclive"):
+    """
+    Stream live metrics as Server-Sent Events: a `snapshot` event with the
+    series so far, then a `metrics` event with the new points of a run each
+    time DVCLive logs some.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    if not os.path.isdir(project_path):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        watcher = live_metrics.get_watcher(project_path, metrics_dir)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        first = True
+        async for event in watcher.subscribe(run):
+            yield log_stream.format_sse(event, event_type="snapshot" if first else "metrics")
+            first = False
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@router.get("/{user_id}/{project_id}/exp/table")
+async def get_experiment_table(
+    user_id: str,
+    project_id: str,
+    columns: Optional[str] = None,
+    filters: Optional[List[str]] = Query(None, alias="filter"),
+    sort_by: Optional[str] = None,
+    sort_order: str = "asc",
+    offset: int = 0,
+    limit: int = 100,
+    all_commits: bool = False,
+    rev: Optional[str] = None,
+    num: int = 1,
+    param_deps: bool = False,
+    refresh: bool = False,
+):
+    """
+    The `dvc exp show` table as data, with column selection (`columns`,
+    comma separated), filters (`filter=acc>0.9`, repeatable), sorting and
+    pagination. The table is cached until the project's refs or workspace
+    change; `refresh` rebuilds it anyway.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    if not os.path.isdir(project_path):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        version, frame, groups = await exp_table.get_table(
+            project_path,
+            all_commits=all_commits,
+            rev=rev,
+            num=num,
+            param_deps=param_deps,
+            refresh=refresh,
+        )
+        page = exp_table.query_table(
+            frame,
+            groups,
+            columns=[column.strip() for column in columns.split(",") if column.strip()] if columns else None,
+            filters=filters,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            offset=offset,
+            limit=limit,
+        )
+        return {"version": version, **page}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        print("Error in get_experiment_table:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{user_id}/{project_id}/exp/index")
+async def query_experiment_index(
+    user_id: str,
+    project_id: str,
+    filters: Optional[List[str]] = Query(None, alias="filter"),
+    sort_by: str = "created_at",
+    sort_order: str = "desc",
+    offset: int = 0,
+    limit: int = 100,
+):
+    """
+    Query the experiments of a project from the index, e.g.
+    `filter=metrics.acc>=0.9&filter=params.train.optimizer==adam`. The
+    index is brought up to date with the project's experiment refs first.
+    """
+    project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+    if not os.path.isdir(project_path):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        sync = await exp_index.sync_experiments(user_id, project_id, project_path)
+        page = await exp_index.query_experiments(
+            user_id,
+            project_id,
+            filters=filters,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            offset=offset,
+            limit=limit,
+        )
+        return {"sync": sync, **page}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print("Error in query_experiment_index:", str(e))
+        print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{user_id}/{project_id}/exp/show")
@@ -494,6 +863,7 @@ async def list_experiments(user_id: str, project_id:str, request: ListExperiment
 async def apply_experiment(user_id: str, project_id:str, request: ApplyExperimentRequest):
     try:
         result = await dvc_exp_apply(user_id, project_id, experiment_id=request.experiment_id)
+        _index_experiments(user_id, project_id)
         return {"message": "Experiment applied successfully", "output": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -509,6 +879,7 @@ async def remove_experiments(user_id: str, project_id:str, request: RemoveExperi
             experiment_ids=request.experiment_ids,
             queue=request.queue,
         )
+        _index_experiments(user_id, project_id)
         return {"message": "Experiments removed successfully", "output": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -524,6 +895,7 @@ async def pull_experiment(user_id: str, project_id:str, request: PullExperimentR
             git_remote=request.git_remote,
             experiment_id=request.experiment_id,
         )
+        _index_experiments(user_id, project_id)
         return {"message": "Experiment pulled successfully", "output": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -552,6 +924,7 @@ async def save_experiment(user_id: str, project_id:str, request: SaveExperimentR
         result = await dvc_exp_save(
             user_id, project_id, name=request.name, force=request.force
         )
+        _index_experiments(user_id, project_id)
         return {"message": "Experiment saved successfully", "output": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1022,10 +1395,15 @@ async def delete_pipeline_config(user_id: str, project_id: str, config_id: str):
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to delete pipeline configuration: {str(e)}")
 
-@router.post("/{user_id}/{project_id}/pipeline/execute")
-async def execute_pipeline(user_id: str, project_id: str, request: PipelineExecutionRequest):
+@router.post("/{user_id}/{project_id}/pipeline/execute", status_code=202)
+async def execute_pipeline(user_id: str, project_id: str, request: PipelineExecutionRequest, response: Response):
     """
-    Execute a pipeline configuration.
+    Queue the execution of a pipeline.
+
+    Returns 202 with the execution_id right away; progress, output and timing
+    are available on /pipeline/executions/{execution_id} and its /stream.
+    When a completed execution already ran the same request on the current
+    project state, it is returned with 200 instead (unless `force` is set).
     """
     try:
         # Verify project exists and belongs to user
@@ -1048,116 +1426,34 @@ async def execute_pipeline(user_id: str, project_id: str, request: PipelineExecu
             })
             if not pipeline_config:
                 raise HTTPException(status_code=404, detail="Pipeline configuration not found")
+
+        if not request.force and not request.dry_run:
+            memoized = await pipeline_jobs.find_memoized_execution(
+                user_id,
+                project_id,
+                pipeline_config=pipeline_config,
+                parameters=request.parameters,
+                targets=request.targets
+            )
+            if memoized:
+                response.status_code = 200
+                return _memoized_execution_response(user_id, project_id, memoized)
         
-        # Execute the pipeline using existing DVC functionality
-        execution_id = f"exec_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        start_time = datetime.now().isoformat()
-        
-        # Create execution record
-        execution_data = {
-            "execution_id": execution_id,
-            "pipeline_config_id": request.pipeline_config_id,
-            "user_id": user_id,
-            "project_id": project_id,
-            "status": "running",
-            "start_time": start_time,
-            "end_time": None,
-            "duration": None,
-            "stages": [],
-            "output_files": [],
-            "models_produced": [],
-            "logs": [],
-            "error_message": None,
-            "parameters_used": request.parameters or {},
-            "metrics": {}
-        }
-        
-        # Save execution record to database
-        executions_collection = await get_pipeline_executions_collection()
-        await executions_collection.insert_one(execution_data)
+        # Create the execution record and queue it
+        execution = await pipeline_jobs.create_execution(
+            user_id,
+            project_id,
+            pipeline_config_id=request.pipeline_config_id,
+            force=request.force,
+            dry_run=request.dry_run,
+            targets=request.targets,
+            parameters=request.parameters,
+            parallel_jobs=request.parallel_jobs,
+            priority=request.priority
+        )
+        await pipeline_jobs.enqueue(execution["execution_id"])
         
-        try:
-            # Use the existing repro function to execute the pipeline
-            result = await repro(
-                user_id, 
-                project_id, 
-                force=request.force,
-                dry_run=request.dry_run,
-                target=request.targets[0] if request.targets else None
-            )
-            
-            end_time = datetime.now().isoformat()
-            duration = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
-            
-            # Detect models produced by scanning the project directory
-            REPO_ROOT = "/home/marialuiza/Documents/faculdade/9periodo/poc/git_repo"
-            project_path = os.path.join(REPO_ROOT, user_id, project_id)
-            models_produced = []
-            if os.path.exists(project_path):
-                model_extensions = ['.pkl', '.joblib', '.h5', '.hdf5', '.pb', '.onnx', '.pt', '.pth', '.model', '.bin']
-                for root, dirs, files in os.walk(project_path):
-                    for file in files:
-                        if any(file.endswith(ext) for ext in model_extensions):
-                            file_path = os.path.join(root, file)
-                            file_stat = os.stat(file_path)
-                            # Check if file was modified during execution
-                            if file_stat.st_mtime >= datetime.fromisoformat(start_time).timestamp():
-                                models_produced.append(file_path)
-            
-            # Update execution record with success
-            await executions_collection.update_one(
-                {"execution_id": execution_id},
-                {
-                    "$set": {
-                        "status": "completed",
-                        "end_time": end_time,
-                        "duration": duration,
-                        "output_files": [],  # Will be populated from result parsing if needed
-                        "models_produced": models_produced,
-                        "logs": [result] if result else [],  # Store the output as logs
-                        "metrics": {}  # Will be populated from result parsing if needed
-                    }
-                }
-            )
-            
-            return {
-                "execution_id": execution_id,
-                "status": "completed",
-                "start_time": start_time,
-                "end_time": end_time,
-                "duration": duration,
-                "output": result,
-                "models_produced": models_produced,
-                "error": None
-            }
-        except Exception as e:
-            end_time = datetime.now().isoformat()
-            duration = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
-            
-            # Update execution record with failure
-            await executions_collection.update_one(
-                {"execution_id": execution_id},
-                {
-                    "$set": {
-                        "status": "failed",
-                        "end_time": end_time,
-                        "duration": duration,
-                        "error_message": str(e),
-                        "logs": [f"Error: {str(e)}"]
-                    }
-                }
-            )
-            
-            return {
-                "execution_id": execution_id,
-                "status": "failed",
-                "start_time": start_time,
-                "end_time": end_time,
-                "duration": duration,
-                "output": None,
-                "models_produced": [],
-                "error": str(e)
-            }
+        return _queued_execution_response(user_id, project_id, execution)
             
     except HTTPException:
         raise
@@ -1166,6 +1462,24 @@ async def execute_pipeline(user_id: str, project_id: str, request: PipelineExecu
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to execute pipeline: {str(e)}")
 
+def _queued_execution_response(user_id: str, project_id: str, execution: Dict[str, Any]) -> Dict[str, Any]:
+    execution_url = f"/{user_id}/{project_id}/pipeline/executions/{execution['execution_id']}"
+    return {
+        "execution_id": execution["execution_id"],
+        "status": execution["status"],
+        "queued_at": execution["queued_at"],
+        "status_url": execution_url,
+        "stream_url": f"{execution_url}/stream"
+    }
+
+def _memoized_execution_response(user_id: str, project_id: str, execution: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **_queued_execution_response(user_id, project_id, execution),
+        "memoized": True,
+        "end_time": execution.get("end_time"),
+        "duration": execution.get("duration")
+    }
+
 @router.post("/{user_id}/{project_id}/pipeline/recover")
 async def recover_pipeline(user_id: str, project_id: str, config_id: str):
     """
@@ -1362,6 +1676,30 @@ async def validate_pipeline_endpoint(user_id: str, project_id: str):
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to validate pipeline: {str(e)}")
 
+@router.get("/{user_id}/{project_id}/pipeline/dag")
+async def get_pipeline_dag_endpoint(user_id: str, project_id: str):
+    """
+    Get the stage DAG of the current pipeline.
+    """
+    try:
+        # Verify project exists and belongs to user
+        project_collection = await get_projects_collection()
+        project = await project_collection.find_one({
+            "_id": ObjectId(project_id),
+            "user_id": user_id
+        })
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        
+        result = await get_pipeline_dag(user_id, project_id)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Error in get_pipeline_dag_endpoint:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to get pipeline DAG: {str(e)}")
+
 @router.post("/{user_id}/{project_id}/pipeline/run")
 async def run_pipeline_endpoint(user_id: str, project_id: str, request: PipelineRunRequest):
     """
@@ -2682,10 +3020,13 @@ async def upload_multiple_code_files_web(
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to upload multiple code files: {str(e)}")
 
-@router.post("/{user_id}/{project_id}/pipeline/config/{config_id}/execute")
-async def execute_pipeline_config(user_id: str, project_id: str, config_id: str, request: PipelineExecutionRequest = None):
+@router.post("/{user_id}/{project_id}/pipeline/config/{config_id}/execute", status_code=202)
+async def execute_pipeline_config(user_id: str, project_id: str, config_id: str, response: Response, request: PipelineExecutionRequest = None):
     """
-    Execute a specific pipeline configuration.
+    Validate a pipeline configuration and queue its execution.
+
+    Like /pipeline/execute, an earlier completed execution of the same
+    request on the current project state is returned with 200 instead.
     """
     try:
         # Verify project exists and belongs to user
@@ -2707,6 +3048,23 @@ async def execute_pipeline_config(user_id: str, project_id: str, config_id: str,
         
         if not config:
             raise HTTPException(status_code=404, detail="Pipeline configuration not found")
+
+        if not (request and (request.force or request.dry_run)):
+            memoized = await pipeline_jobs.find_memoized_execution(
+                user_id,
+                project_id,
+                pipeline_config=config,
+                parameters=request.parameters if request else {},
+                pipeline=True
+            )
+            if memoized:
+                response.status_code = 200
+                return {
+                    "message": f"Pipeline '{config['name']}' is up to date with execution {memoized['execution_id']}",
+                    "config_id": config_id,
+                    "config_name": config["name"],
+                    **_memoized_execution_response(user_id, project_id, memoized)
+                }
         
         # Validate pipeline before execution
         print("Validating pipeline before execution...")
@@ -2714,33 +3072,27 @@ async def execute_pipeline_config(user_id: str, project_id: str, config_id: str,
         if not validation_result.get("valid", False):
             raise HTTPException(status_code=400, detail=f"Pipeline validation failed: {validation_result.get('details', 'Unknown error')}")
         
-        # Execute the pipeline
-        print("Executing pipeline...")
-        execution_result = await repro(
-            user_id=user_id,
-            project_id=project_id,
-            pipeline=True,
+        # Queue the pipeline; the worker updates the configuration's
+        # execution info once the run completes
+        print("Queueing pipeline execution...")
+        execution = await pipeline_jobs.create_execution(
+            user_id,
+            project_id,
+            pipeline_config_id=config_id,
             force=request.force if request else False,
-            dry_run=request.dry_run if request else False
-        )
-        
-        # Update pipeline configuration with execution info
-        await pipeline_configs_collection.update_one(
-            {"_id": ObjectId(config_id)},
-            {
-                "$set": {
-                    "last_executed": datetime.now().isoformat(),
-                    "execution_count": config.get("execution_count", 0) + 1,
-                    "updated_at": datetime.now().isoformat()
-                }
-            }
+            dry_run=request.dry_run if request else False,
+            parameters=request.parameters if request else {},
+            pipeline=True,
+            parallel_jobs=request.parallel_jobs if request else None,
+            priority=request.priority if request else None
         )
+        await pipeline_jobs.enqueue(execution["execution_id"])
         
         return {
-            "message": f"Pipeline '{config['name']}' executed successfully",
+            "message": f"Pipeline '{config['name']}' queued for execution",
             "config_id": config_id,
             "config_name": config["name"],
-            "execution_result": execution_result,
+            **_queued_execution_response(user_id, project_id, execution),
             "validation": validation_result
         }
         
@@ -2783,18 +3135,14 @@ async def dry_run_pipeline_config(user_id: str, project_id: str, config_id: str)
         
         # Perform dry run
         print("Performing dry run...")
-        dry_run_result = await repro(
-            user_id=user_id,
-            project_id=project_id,
-            pipeline=True,
-            dry_run=True
-        )
+        dry_run_result = await dry_run_pipeline(user_id, project_id)
         
         return {
             "message": f"Dry run completed for pipeline '{config['name']}'",
             "config_id": config_id,
             "config_name": config["name"],
-            "dry_run_result": dry_run_result,
+            "dry_run_result": dry_run_result["output"],
+            "stale_stages": dry_run_result["stale_stages"],
             "validation": validation_result
         }
         
@@ -3213,9 +3561,12 @@ async def validate_parameters_endpoint(user_id: str, project_id: str, request: P
 
 # Pipeline Execution History Endpoints
 @router.get("/{user_id}/{project_id}/pipeline/executions")
-async def get_pipeline_executions(user_id: str, project_id: str, page: int = 1, page_size: int = 10):
+async def get_pipeline_executions(user_id: str, project_id: str, page: int = 1, page_size: int = 10, include_logs: bool = False):
     """
     Get pipeline execution history for a project.
+
+    Logs are left out unless `include_logs` is set; use the
+    `/pipeline/executions/{execution_id}/logs` endpoints to page through them.
     """
     try:
         # Validate project exists
@@ -3234,7 +3585,16 @@ async def get_pipeline_executions(user_id: str, project_id: str, page: int = 1,
         executions = await executions_collection.find({
             "user_id": user_id,
             "project_id": project_id
-        }).sort("start_time", -1).skip(skip).limit(page_size).to_list(None)
+        }, None if include_logs else {"logs": 0}).sort("start_time", -1).skip(skip).limit(page_size).to_list(None)
+
+        if include_logs:
+            execution_logs_collection = await get_execution_logs_collection()
+            for execution in executions:
+                total_lines = await log_stream.count_log_lines(execution_logs_collection, execution["execution_id"])
+                if total_lines:
+                    execution["logs"] = await log_stream.read_log_lines(
+                        execution_logs_collection, execution["execution_id"], 0, total_lines
+                    )
         
         total_count = await executions_collection.count_documents({
             "user_id": user_id,
@@ -3247,7 +3607,8 @@ async def get_pipeline_executions(user_id: str, project_id: str, page: int = 1,
                 execution_id=execution.get("execution_id", ""),
                 pipeline_config_id=execution.get("pipeline_config_id"),
                 status=execution.get("status", "unknown"),
-                start_time=execution.get("start_time", ""),
+                queued_at=execution.get("queued_at"),
+                start_time=execution.get("start_time"),
                 end_time=execution.get("end_time"),
                 duration=execution.get("duration"),
                 stages=execution.get("stages", []),
@@ -3256,7 +3617,8 @@ async def get_pipeline_executions(user_id: str, project_id: str, page: int = 1,
                 logs=execution.get("logs", []),
                 error_message=execution.get("error_message"),
                 parameters_used=execution.get("parameters_used", {}),
-                metrics=execution.get("metrics", {})
+                metrics=execution.get("metrics", {}),
+                progress=execution.get("progress", {})
             ) for execution in executions],
             total_count=total_count,
             page=page,
@@ -3267,10 +3629,71 @@ async def get_pipeline_executions(user_id: str, project_id: str, page: int = 1,
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{user_id}/{project_id}/pipeline/executions/stats")
+async def get_pipeline_execution_stats(user_id: str, project_id: str, windows: Optional[str] = None, config_id: Optional[str] = None):
+    """
+    Duration percentiles (p50/p95/p99), failure rate and throughput of the
+    finished pipeline executions of a project, per project, configuration
+    and stage.
+
+    `windows` is a comma-separated list of rolling windows such as
+    "1h,24h,7d" (the default).
+    """
+    try:
+        # Validate project exists
+        project_collection = await get_projects_collection()
+        project = await project_collection.find_one({
+            "_id": ObjectId(project_id),
+            "user_id": user_id
+        })
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        window_list = [w.strip() for w in windows.split(",") if w.strip()] if windows else None
+        executions_collection = await get_pipeline_executions_collection()
+        try:
+            stats = await execution_stats.get_execution_stats(
+                executions_collection, user_id, project_id, window_list, config_id
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        return {
+            "user_id": user_id,
+            "project_id": project_id,
+            "config_id": config_id,
+            "windows": stats,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting pipeline execution stats: {e}")
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """
+    Queue depth and wait times of the scheduler: the command slots of this
+    API process and the shared pipeline execution queue, per priority class
+    and per user, and the pooled checkouts of each project.
+    """
+    try:
+        return {
+            "commands": scheduler.stats(),
+            "pipeline_queue": await pipeline_jobs.queue_stats(),
+            "worktrees": worktree_pool.stats(),
+        }
+    except Exception as e:
+        print(f"Error getting scheduler stats: {e}")
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{user_id}/{project_id}/pipeline/executions/{execution_id}")
 async def get_pipeline_execution(user_id: str, project_id: str, execution_id: str):
     """
-    Get a specific pipeline execution by ID.
+    Get a specific pipeline execution by ID, with its ETA while it is queued
+    or running.
     """
     try:
         # Validate project exists
@@ -3293,12 +3716,192 @@ async def get_pipeline_execution(user_id: str, project_id: str, execution_id: st
         if not execution:
             raise HTTPException(status_code=404, detail="Pipeline execution not found")
 
+        execution["eta"] = await pipeline_jobs.estimate_eta(execution)
         return PipelineExecution(**execution)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting pipeline execution: {e}")
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{user_id}/{project_id}/pipeline/executions/{execution_id}/stream")
+async def stream_pipeline_execution(user_id: str, project_id: str, execution_id: str):
+    """
+    Stream the output of a pipeline execution as Server-Sent Events.
+
+    Live executions are served from memory (with a replay of the recent
+    lines); otherwise the stored logs are sent and, while the record is
+    still running, polled for new lines.
+    """
+    try:
+        # Validate project exists
+        project_collection = await get_projects_collection()
+        project = await project_collection.find_one({
+            "_id": ObjectId(project_id),
+            "user_id": user_id
+        })
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        executions_collection = await get_pipeline_executions_collection()
+        query = {"execution_id": execution_id, "user_id": user_id, "project_id": project_id}
+        execution = await executions_collection.find_one(query, {"status": 1})
+        if not execution:
+            raise HTTPException(status_code=404, detail="Pipeline execution not found")
+
+        async def events():
+            channel = log_stream.get_channel(execution_id)
+            if channel is not None:
+                async for event in channel.subscribe():
+                    yield log_stream.format_sse(event)
+                yield log_stream.format_sse({"status": channel.status}, event_type="end")
+                return
+
+            # Not running in this process: follow the stored logs
+            execution_logs_collection = await get_execution_logs_collection()
+            sent = 0
+            while True:
+                record = await executions_collection.find_one(query, {"status": 1})
+                if not record:
+                    break
+                lines = await log_stream.read_log_lines(execution_logs_collection, execution_id, sent, 1000)
+                for line in lines:
+                    sent += 1
+                    yield log_stream.format_sse({"seq": sent, "stream": "stdout", "line": line})
+                if len(lines) < 1000:
+                    if record.get("status") not in ("queued", "running"):
+                        yield log_stream.format_sse({"status": record.get("status")}, event_type="end")
+                        break
+                    await asyncio.sleep(1)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error streaming pipeline execution: {e}")
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _find_execution_for_logs(user_id: str, project_id: str, execution_id: str):
+    project_collection = await get_projects_collection()
+    project = await project_collection.find_one({
+        "_id": ObjectId(project_id),
+        "user_id": user_id
+    })
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    executions_collection = await get_pipeline_executions_collection()
+    execution = await executions_collection.find_one(
+        {"execution_id": execution_id, "user_id": user_id, "project_id": project_id},
+        {"status": 1, "logs": 1}
+    )
+    if not execution:
+        raise HTTPException(status_code=404, detail="Pipeline execution not found")
+    return execution
+
+@router.get("/{user_id}/{project_id}/pipeline/executions/{execution_id}/logs")
+async def get_pipeline_execution_logs(user_id: str, project_id: str, execution_id: str, offset: int = 0, limit: int = 1000):
+    """
+    Get `limit` lines of the output of a pipeline execution, starting at
+    line `offset`.
+    """
+    try:
+        if offset < 0 or limit < 1 or limit > MAX_LOG_PAGE_LINES:
+            raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {MAX_LOG_PAGE_LINES}")
+
+        execution = await _find_execution_for_logs(user_id, project_id, execution_id)
+        execution_logs_collection = await get_execution_logs_collection()
+        total_lines = await log_stream.count_log_lines(execution_logs_collection, execution_id)
+        if total_lines:
+            lines = await log_stream.read_log_lines(execution_logs_collection, execution_id, offset, limit)
+        else:
+            # Executions recorded before the logs were chunked
+            legacy_logs = execution.get("logs", [])
+            total_lines = len(legacy_logs)
+            lines = legacy_logs[offset:offset + limit]
+
+        return {
+            "execution_id": execution_id,
+            "status": execution.get("status"),
+            "offset": offset,
+            "limit": limit,
+            "total_lines": total_lines,
+            "lines": lines
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting pipeline execution logs: {e}")
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{user_id}/{project_id}/pipeline/executions/{execution_id}/logs/tail")
+async def tail_pipeline_execution_logs(user_id: str, project_id: str, execution_id: str, lines: int = 100):
+    """
+    Get the last `lines` lines of the output of a pipeline execution.
+    """
+    try:
+        if lines < 1 or lines > MAX_LOG_PAGE_LINES:
+            raise HTTPException(status_code=400, detail=f"lines must be between 1 and {MAX_LOG_PAGE_LINES}")
+
+        execution = await _find_execution_for_logs(user_id, project_id, execution_id)
+        execution_logs_collection = await get_execution_logs_collection()
+        offset, total_lines, tail = await log_stream.tail_log_lines(execution_logs_collection, execution_id, lines)
+        if not total_lines:
+            legacy_logs = execution.get("logs", [])
+            total_lines = len(legacy_logs)
+            offset = max(total_lines - lines, 0)
+            tail = legacy_logs[offset:]
+
+        return {
+            "execution_id": execution_id,
+            "status": execution.get("status"),
+            "offset": offset,
+            "total_lines": total_lines,
+            "lines": tail
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting pipeline execution logs: {e}")
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/{user_id}/{project_id}/pipeline/executions/{execution_id}/cancel")
+async def cancel_pipeline_execution(user_id: str, project_id: str, execution_id: str):
+    """
+    Cancel a queued or running pipeline execution.
+
+    Running executions have the process group of their commands killed and
+    DVC's locks cleared before the record is marked cancelled, so the status
+    is "cancelling" until the worker has done so.
+    """
+    try:
+        # Validate project exists
+        project_collection = await get_projects_collection()
+        project = await project_collection.find_one({
+            "_id": ObjectId(project_id),
+            "user_id": user_id
+        })
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        status = await pipeline_jobs.cancel_execution(user_id, project_id, execution_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Pipeline execution not found")
+        if status not in ("cancelled", "cancelling"):
+            raise HTTPException(status_code=409, detail=f"Pipeline execution already {status}")
+
+        return {"execution_id": execution_id, "status": status}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error cancelling pipeline execution: {e}")
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{user_id}/{project_id}/pipeline/executions/latest")
 async def get_latest_pipeline_execution(user_id: str, project_id: str):
     """
@@ -3998,7 +4601,10 @@ async def create_model_evaluation(user_id: str, project_id: str, request: Create
         evaluation_id = str(result.inserted_id)
         
         # Run evaluation in background using DVC
-        asyncio.create_task(run_dvc_model_evaluation(user_id, project_id, evaluation_id, request.model_path))
+        task = asyncio.create_task(run_dvc_model_evaluation(user_id, project_id, evaluation_id, request.model_path))
+        key = _task_key("eval", user_id, project_id, evaluation_id)
+        _background_tasks[key] = task
+        task.add_done_callback(lambda _: _background_tasks.pop(key, None))
         
         # Return the created evaluation
         evaluation_data = evaluation_data.copy()
@@ -4051,6 +4657,57 @@ async def get_model_evaluation(user_id: str, project_id: str, evaluation_id: str
         print("Traceback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to get model evaluation: {str(e)}")
 
+@router.post("/{user_id}/{project_id}/evaluations/{evaluation_id}/cancel")
+async def cancel_model_evaluation(user_id: str, project_id: str, evaluation_id: str):
+    """
+    Cancel a running model evaluation, killing the process group of its
+    `dvc repro` and clearing DVC's locks.
+    """
+    try:
+        # Verify project exists and belongs to user
+        project_collection = await get_projects_collection()
+        project = await project_collection.find_one({
+            "_id": ObjectId(project_id),
+            "user_id": user_id
+        })
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        evaluations_collection = await get_model_evaluations_collection()
+        evaluation = await evaluations_collection.find_one({
+            "_id": ObjectId(evaluation_id),
+            "user_id": user_id,
+            "project_id": project_id
+        })
+        if not evaluation:
+            raise HTTPException(status_code=404, detail="Model evaluation not found")
+        if evaluation.get("status") != "running":
+            raise HTTPException(status_code=409, detail=f"Model evaluation already {evaluation.get('status')}")
+
+        # Only runs of this user's project are found under its key
+        task = _background_tasks.get(_task_key("eval", user_id, project_id, evaluation_id))
+        if task is not None and not task.done():
+            # run_dvc_model_evaluation records the cancellation and clears
+            # the locks of its project
+            task.cancel()
+            await asyncio.wait({task})
+        else:
+            # Left running by a server that stopped
+            project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+            await asyncio.to_thread(dvc_handler.clear_stale_dvc_locks, project_path)
+            await evaluations_collection.update_one(
+                {"_id": ObjectId(evaluation_id)},
+                {"$set": {"status": "cancelled", "updated_at": datetime.now().isoformat()}}
+            )
+
+        return {"evaluation_id": evaluation_id, "status": "cancelled"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Error in cancel_model_evaluation:", str(e))
+        print("Traceback:", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to cancel model evaluation: {str(e)}")
+
 async def run_dvc_model_evaluation(user_id: str, project_id: str, evaluation_id: str, model_path: str):
     """
     Run model evaluation using DVC pipeline evaluation stage.
@@ -4091,7 +4748,22 @@ async def run_dvc_model_evaluation(user_id: str, project_id: str, evaluation_id:
                     }
                 }
             )
-            
+
+    except asyncio.CancelledError:
+        # The commands were killed on the way out of repro
+        project_path = os.path.join(dvc_handler.REPO_ROOT, user_id, project_id)
+        await asyncio.to_thread(dvc_handler.clear_stale_dvc_locks, project_path)
+        evaluations_collection = await get_model_evaluations_collection()
+        await evaluations_collection.update_one(
+            {"_id": ObjectId(evaluation_id)},
+            {
+                "$set": {
+                    "status": "cancelled",
+                    "error_message": "Cancelled by user",
+                    "updated_at": datetime.now().isoformat()
+                }
+            }
+        )
     except Exception as e:
         print(f"Error in run_dvc_model_evaluation: {str(e)}")
         evaluations_collection = await get_model_evaluations_collection()
@@ -4124,8 +4796,7 @@ async def get_model_paths_from_dvc(user_id: str, project_id: str) -> Dict[str, A
                 "error": "dvc.yaml not found"
             }
         
-        with open(dvc_yaml_path, 'r') as f:
-            dvc_config = yaml.safe_load(f)
+        dvc_config = pipeline_index.get_index(project_path).config
         
         models = []
         evaluation_stage = None
@@ -4171,6 +4842,21 @@ async def get_model_paths_from_dvc(user_id: str, project_id: str) -> Dict[str, A
         }
 
 # Helper function to run DVC evaluation stage
+def _read_evaluation_metrics(project_path: str, metrics_path: str) -> Dict[str, Any]:
+    """
+    Read metrics from the metrics file of an evaluation.
+    """
+    metrics = {}
+    if metrics_path:
+        metrics_file = os.path.join(project_path, metrics_path)
+        if os.path.exists(metrics_file):
+            try:
+                with open(metrics_file, 'r') as f:
+                    metrics = json.load(f)
+            except Exception as e:
+                metrics = {"error": f"Failed to read metrics: {str(e)}"}
+    return metrics
+
 async def run_dvc_evaluation(user_id: str, project_id: str, model_path: str) -> Dict[str, Any]:
     """
     Run the evaluation stage from dvc.yaml for a specific model.
@@ -4201,24 +4887,33 @@ async def run_dvc_evaluation(user_id: str, project_id: str, model_path: str) ->
         # Run DVC repro for the evaluation stage
         from app.dvc_handler import repro
         
-        result = await repro(
-            user_id=user_id,
-            project_id=project_id,
-            target=dvc_config["evaluation_stage"]["name"],
-            pipeline=False,
-            force=True
-        )
-        
-        # Read metrics from the metrics file
-        metrics = {}
-        if dvc_config["metrics_path"]:
-            metrics_file = os.path.join(project_path, dvc_config["metrics_path"])
-            if os.path.exists(metrics_file):
-                try:
-                    with open(metrics_file, 'r') as f:
-                        metrics = json.load(f)
-                except Exception as e:
-                    metrics = {"error": f"Failed to read metrics: {str(e)}"}
+        in_checkout = False
+        if worktree_pool.is_enabled():
+            # In a checkout of its own, so evaluations of a project run side by side
+            try:
+                async with worktree_pool.lease(project_path) as checkout:
+                    result = await repro(
+                        user_id=user_id,
+                        project_id=project_id,
+                        target=dvc_config["evaluation_stage"]["name"],
+                        pipeline=False,
+                        force=True,
+                        cwd=checkout,
+                        git_commit=False
+                    )
+                    metrics = _read_evaluation_metrics(checkout, dvc_config["metrics_path"])
+                in_checkout = True
+            except worktree_pool.WorkspaceNotCopied as e:
+                print(f"{e}; evaluating in the project")
+        if not in_checkout:
+            result = await repro(
+                user_id=user_id,
+                project_id=project_id,
+                target=dvc_config["evaluation_stage"]["name"],
+                pipeline=False,
+                force=True
+            )
+            metrics = _read_evaluation_metrics(project_path, dvc_config["metrics_path"])
         
         return {
             "success": True,
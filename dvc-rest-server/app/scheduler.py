@@ -0,0 +1,467 @@
+import os
+import time
+import shlex
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from app.execution_stats import percentile
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of commands running at the same time across all projects
+MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", str(os.cpu_count() or 4)))
+
+# Priority classes, served in this order: interactive requests (dry runs,
+# single experiments) go before batch work such as sweeps
+PRIORITY_CLASSES = ("interactive", "normal", "batch")
+DEFAULT_PRIORITY = "normal"
+# Slots one user may hold at the same time (0 for no quota)
+USER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_USER_MAX_CONCURRENCY", "0"))
+# Shortest-expected-job-first with aging: every second a queued job waits
+# takes this many seconds off its expected duration when jobs are ordered,
+# so long jobs are not postponed forever
+SJF_AGING = float(os.getenv("SCHEDULER_SJF_AGING", "1"))
+# Expected duration (seconds) of jobs without any history
+UNKNOWN_DURATION = float(os.getenv("SCHEDULER_UNKNOWN_DURATION", "300"))
+# Number of recent waits per priority class kept for stats()
+WAIT_SAMPLES = 1000
+# Longest wait (seconds) of a read for a project held by a command such as
+# `dvc repro`, before it gives up with ProjectBusy (0 to wait forever)
+READ_LOCK_TIMEOUT = float(os.getenv("SCHEDULER_READ_LOCK_TIMEOUT", "30"))
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    """Parse SCHEDULER_USER_WEIGHTS, e.g. "alice=2,bob=0.5"."""
+    weights = {}
+    for item in value.split(","):
+        user, _, weight = item.partition("=")
+        if user.strip() and weight.strip():
+            try:
+                weights[user.strip()] = max(float(weight), 0.01)
+            except ValueError:
+                logger.warning(f"Ignoring invalid scheduler weight '{item}'")
+    return weights
+
+# Share of the slots of each user relative to the others (default 1)
+USER_WEIGHTS = _parse_weights(os.getenv("SCHEDULER_USER_WEIGHTS", ""))
+
+# git subcommands that never take .git/index.lock or move refs
+_GIT_READ_COMMANDS = {
+    "status", "log", "diff", "show", "rev-parse", "rev-list", "ls-files", "show-ref",
+    "for-each-ref",
+    "ls-tree", "cat-file", "describe", "shortlog", "blame",
+}
+# git subcommands that only read when called without positional arguments
+_GIT_LIST_COMMANDS = {"branch", "remote", "tag"}
+
+# dvc subcommands that do not take the DVC repo lock. `dvc status`,
+# `dvc diff` and `dvc exp list` look read-only but hold the repo lock, so
+# they are scheduled as exclusive.
+_DVC_READ_COMMANDS = {
+    ("metrics", "show"), ("metrics", "diff"),
+    ("params", "show"), ("params", "diff"),
+    ("plots", "show"), ("plots", "diff"),
+    ("exp", "show"), ("experiments", "show"),
+    ("remote", "list"), ("stage", "list"), ("data", "status"),
+    ("dag",), ("version",), ("doctor",), ("root",), ("list",), ("ls",),
+}
+
+def is_read_only(command: str) -> bool:
+    """
+    Check whether a command can run concurrently with other reads of the
+    same project. Anything not known to be a read is treated as a mutation.
+    """
+    if any(c in command for c in "|&;<>`$"):
+        return False
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return False
+    if not words:
+        return False
+
+    program = os.path.basename(words[0])
+    args = [w for w in words[1:] if not w.startswith("-")]
+    flags = [w for w in words[1:] if w.startswith("-")]
+
+    if program == "git":
+        if not args:
+            return False
+        if args[0] in _GIT_READ_COMMANDS:
+            return True
+        if args[0] == "config":
+            return any(f in ("--get", "--list", "-l", "--get-all") for f in flags)
+        if args[0] in _GIT_LIST_COMMANDS:
+            return len(args) == 1 and not any(f in ("-d", "-D", "-m", "-M", "-f") for f in flags)
+        return False
+
+    if program == "dvc":
+        return tuple(args[:2]) in _DVC_READ_COMMANDS or tuple(args[:1]) in _DVC_READ_COMMANDS
+
+    return False
+
+class ProjectBusy(Exception):
+    """Raised when a read waited READ_LOCK_TIMEOUT seconds for its project."""
+
+class ProjectLock:
+    """
+    Readers-writer lock for one project directory.
+
+    Writers are preferred: once a writer is waiting no new readers are let
+    in, so a steady stream of status polls cannot starve a `dvc repro`.
+    """
+
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire_read(self, timeout: float = None):
+        async with self._cond:
+            # The reader is only counted once the wait succeeded, so a
+            # timeout never leaves it registered
+            await asyncio.wait_for(
+                self._cond.wait_for(lambda: not self._writer and self._waiting_writers == 0), timeout
+            )
+            self._readers += 1
+
+    async def release_read(self):
+        async with self._cond:
+            self._readers -= 1
+            self._cond.notify_all()
+
+    async def acquire_write(self):
+        async with self._cond:
+            self._waiting_writers += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    async def release_write(self):
+        async with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "readers": self._readers,
+            "writer": int(self._writer),
+            "waiting_writers": self._waiting_writers,
+        }
+
+def user_weight(user: str) -> float:
+    return USER_WEIGHTS.get(user, 1.0)
+
+def priority_rank(priority: str = None) -> int:
+    try:
+        return PRIORITY_CLASSES.index(priority or DEFAULT_PRIORITY)
+    except ValueError:
+        return PRIORITY_CLASSES.index(DEFAULT_PRIORITY)
+
+def sjf_score(job: Dict[str, Any], now: datetime = None) -> float:
+    """
+    Ordering score of a queued job for shortest-expected-job-first: its
+    expected duration minus SJF_AGING times how long it has waited.
+    """
+    expected = job.get("expected_duration")
+    if expected is None:
+        expected = UNKNOWN_DURATION
+    waited = 0.0
+    if job.get("queued_at"):
+        waited = max(0.0, ((now or datetime.now()) - datetime.fromisoformat(job["queued_at"])).total_seconds())
+    return expected - SJF_AGING * waited
+
+def pick_next(candidates: List[Dict[str, Any]], running: Dict[str, int], quota: int = None,
+              now: datetime = None) -> Optional[Dict[str, Any]]:
+    """
+    Choose the queued job to start next: the highest priority class first,
+    then the user with the smallest share of what is running (running jobs
+    divided by the user's weight), then the job expected to be shortest
+    once aged (see sjf_score).
+
+    Args:
+        candidates (list): Queued jobs with "user_id", "priority",
+            "queued_at" and "expected_duration", oldest first.
+        running (dict): Number of running jobs per user.
+        quota (int): Jobs one user may run at once (default
+            USER_MAX_CONCURRENCY, 0 for no quota).
+    """
+    quota = USER_MAX_CONCURRENCY if quota is None else quota
+    now = now or datetime.now()
+    best, best_key = None, None
+    for position, job in enumerate(candidates):
+        user = job.get("user_id")
+        if quota and running.get(user, 0) >= quota:
+            continue
+        key = (
+            priority_rank(job.get("priority")),
+            running.get(user, 0) / user_weight(user),
+            sjf_score(job, now),
+            position,
+        )
+        if best_key is None or key < best_key:
+            best, best_key = job, key
+    return best
+
+class FairSemaphore:
+    """
+    The MAX_CONCURRENCY global command slots, handed out by weighted fair
+    queuing instead of first come, first served.
+
+    Waiters are served by priority class first. Within a class the user with
+    the smallest virtual time goes next, and each slot granted advances the
+    user's virtual time by 1 / weight. Users with commands waiting therefore
+    get slots in proportion to their weights, however many commands each of
+    them queued. A user who was idle starts again at the current virtual
+    time, so idle periods cannot be saved up. No user holds more than
+    USER_MAX_CONCURRENCY slots.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.in_use = 0
+        self._running: Dict[str, int] = {}
+        # priority class -> user -> waiters as (future, enqueued at)
+        self._waiters: Dict[str, Dict[str, Deque[Tuple[asyncio.Future, float]]]] = {
+            priority: {} for priority in PRIORITY_CLASSES
+        }
+        self._vtime: Dict[str, float] = {}
+        self._clock = 0.0
+        self._waits: Dict[str, Deque[float]] = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_CLASSES}
+        self._granted: Dict[str, int] = {priority: 0 for priority in PRIORITY_CLASSES}
+
+    async def acquire(self, user: str, priority: str = DEFAULT_PRIORITY):
+        if priority not in self._waiters:
+            priority = DEFAULT_PRIORITY
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, time.monotonic())
+        self._waiters[priority].setdefault(user, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the waiter was cancelled
+                self.release(user)
+            else:
+                queue = self._waiters[priority].get(user)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[priority][user]
+            raise
+
+    def release(self, user: str):
+        self.in_use -= 1
+        self._running[user] -= 1
+        if not self._running[user]:
+            del self._running[user]
+        self._dispatch()
+
+    def _next_user(self, priority: str) -> Optional[str]:
+        users = [
+            user for user in self._waiters[priority]
+            if not (USER_MAX_CONCURRENCY and self._running.get(user, 0) >= USER_MAX_CONCURRENCY)
+        ]
+        if not users:
+            return None
+        return min(users, key=lambda user: (
+            max(self._vtime.get(user, 0.0), self._clock),
+            self._waiters[priority][user][0][1],
+        ))
+
+    def _dispatch(self):
+        while self.in_use < self.slots:
+            for priority in PRIORITY_CLASSES:
+                user = self._next_user(priority)
+                if user is not None:
+                    break
+            else:
+                return
+            queue = self._waiters[priority][user]
+            future, enqueued_at = queue.popleft()
+            if not queue:
+                del self._waiters[priority][user]
+            if future.done():
+                continue
+
+            start = max(self._vtime.get(user, 0.0), self._clock)
+            self._clock = start
+            self._vtime[user] = start + 1 / user_weight(user)
+            self.in_use += 1
+            self._running[user] = self._running.get(user, 0) + 1
+            self._waits[priority].append(time.monotonic() - enqueued_at)
+            self._granted[priority] += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        classes = {}
+        for priority in PRIORITY_CLASSES:
+            waiting = [now - enqueued_at for queue in self._waiters[priority].values() for _, enqueued_at in queue]
+            waits = sorted(self._waits[priority])
+            classes[priority] = {
+                "queued": len(waiting),
+                "longest_wait": round(max(waiting), 3) if waiting else None,
+                "granted": self._granted[priority],
+                # Over the last WAIT_SAMPLES grants
+                "p50_wait": round(percentile(waits, 50), 3) if waits else None,
+                "p95_wait": round(percentile(waits, 95), 3) if waits else None,
+                "max_wait": round(waits[-1], 3) if waits else None,
+            }
+        users = {}
+        for user, count in self._running.items():
+            users.setdefault(user, {"running": 0, "queued": 0})["running"] = count
+        for queues in self._waiters.values():
+            for user, queue in queues.items():
+                users.setdefault(user, {"running": 0, "queued": 0})["queued"] += len(queue)
+        return {
+            "slots": self.slots,
+            "in_use": self.in_use,
+            "queued": sum(c["queued"] for c in classes.values()),
+            "classes": classes,
+            "users": users,
+        }
+
+_locks: Dict[str, ProjectLock] = {}
+_semaphore: Optional[FairSemaphore] = None
+_loop = None
+
+# Locks held by the current task, so nested sections do not deadlock.
+# Tasks created inside a section inherit it and are treated as part of it.
+_held: ContextVar[Optional[Dict[str, str]]] = ContextVar("scheduler_held_locks", default=None)
+# Priority class of the commands the current task runs
+_priority: ContextVar[str] = ContextVar("scheduler_priority", default=DEFAULT_PRIORITY)
+
+def _bind_loop():
+    """Asyncio primitives belong to one event loop: reset them on a new one."""
+    global _semaphore, _loop
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:
+        _loop = loop
+        _locks.clear()
+        _semaphore = FairSemaphore(MAX_CONCURRENCY)
+
+def project_key(cwd: str = None) -> str:
+    """
+    Map a working directory to the project it belongs to
+    (REPO_ROOT/user_id/project_id). Paths outside REPO_ROOT are their own key.
+    Pooled checkouts of a project (app.worktree_pool) are keys of their own,
+    so commands in them do not wait for the project.
+    """
+    # Imported here because dvc_handler depends on this module
+    from app.dvc_handler import REPO_ROOT
+    from app.worktree_pool import WORKTREES_DIR
+
+    path = os.path.abspath(cwd or os.getcwd())
+    root = os.path.abspath(REPO_ROOT)
+    rel = os.path.relpath(path, root)
+    if rel == "." or rel.startswith(os.pardir):
+        return path
+    parts = rel.split(os.sep)
+    worktrees = WORKTREES_DIR.split(os.sep)
+    if len(parts) > 2 + len(worktrees) and parts[2:2 + len(worktrees)] == worktrees:
+        return os.path.join(root, *parts[:3 + len(worktrees)])
+    return os.path.join(root, *parts[:2])
+
+def user_of(key: str) -> str:
+    """User a project key belongs to; paths outside REPO_ROOT are their own user."""
+    from app.dvc_handler import REPO_ROOT
+
+    rel = os.path.relpath(key, os.path.abspath(REPO_ROOT))
+    if rel == "." or rel.startswith(os.pardir):
+        return key
+    return rel.split(os.sep)[0]
+
+@contextmanager
+def priority(name: str = None):
+    """
+    Run the commands started inside the block (and by the tasks it creates)
+    in priority class `name`.
+
+    Raises:
+        ValueError: If `name` is not one of PRIORITY_CLASSES.
+    """
+    name = name or DEFAULT_PRIORITY
+    if name not in PRIORITY_CLASSES:
+        raise ValueError(f"Invalid priority '{name}', expected one of {', '.join(PRIORITY_CLASSES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+@asynccontextmanager
+async def project_lock(cwd: str = None, exclusive: bool = True):
+    """
+    Hold the lock of the project containing `cwd`.
+
+    Use an exclusive section around command sequences that must not be
+    interleaved with other work on the same project (e.g. `git add` followed
+    by `git commit`). Sections are reentrant for the task that holds them.
+
+    Raises:
+        ProjectBusy: If a shared section could not be entered within
+            READ_LOCK_TIMEOUT seconds, e.g. during a long `dvc repro`.
+    """
+    _bind_loop()
+    key = project_key(cwd)
+    held = _held.get() or {}
+    mode = held.get(key)
+
+    if mode == "write" or (mode == "read" and not exclusive):
+        yield
+        return
+    if mode == "read":
+        raise RuntimeError(f"Cannot upgrade the shared lock on {key} to an exclusive lock")
+
+    lock = _locks.setdefault(key, ProjectLock())
+    if exclusive:
+        await lock.acquire_write()
+    else:
+        try:
+            await lock.acquire_read(READ_LOCK_TIMEOUT or None)
+        except asyncio.TimeoutError:
+            raise ProjectBusy(f"Project {key} is busy with another command, try again later") from None
+    token = _held.set({**held, key: "write" if exclusive else "read"})
+    try:
+        yield
+    finally:
+        _held.reset(token)
+        if exclusive:
+            await lock.release_write()
+        else:
+            await lock.release_read()
+
+@asynccontextmanager
+async def command_slot(command: str, cwd: str = None):
+    """
+    Schedule one command: take the project lock in the mode the command
+    needs, then one of the MAX_CONCURRENCY global slots, shared fairly
+    between users (see FairSemaphore).
+    """
+    async with project_lock(cwd, exclusive=not is_read_only(command)):
+        user = user_of(project_key(cwd))
+        await _semaphore.acquire(user, _priority.get())
+        try:
+            yield
+        finally:
+            _semaphore.release(user)
+
+def stats() -> Dict[str, object]:
+    """
+    Current lock state per project, and the use, queue depth and wait times
+    of the global slots.
+    """
+    return {
+        "max_concurrency": MAX_CONCURRENCY,
+        "available_slots": MAX_CONCURRENCY - _semaphore.in_use if _semaphore is not None else MAX_CONCURRENCY,
+        "slots": _semaphore.stats() if _semaphore is not None else None,
+        "projects": {key: lock.stats() for key, lock in _locks.items()},
+    }
@@ -0,0 +1,285 @@
+"""
+Shell used to run the commands of DVC stages while recording what each
+one cost.
+
+DVC runs stage commands as `$SHELL -c <cmd>` and sets DVC_STAGE. Pointing
+SHELL at this wrapper (through `stage_env`) makes every stage command run
+under the real shell in a child process that is reaped with `os.wait4`.
+The wall-clock time, exit status, CPU times and peak RSS of the stage
+(including the processes it waited for) are appended as one JSON line to
+the file named by DVC_STAGE_STATS_FILE.
+
+When DVC_STAGE_LIMITS is set (see app.resource_limits), the resource
+limits and cgroup it names are applied here before the command starts. A
+stage killed for going over its CPU time or its cgroup's memory is
+reported as such.
+
+Started as `<shell_path()> --limits <json> -- <argv...>`, the wrapper only
+applies the limits and execs `argv`. The server starts its own commands
+that way instead of setting limits between fork and exec in its own,
+multi-threaded process.
+
+Only the standard library is used: the wrapper starts once per stage
+command and must stay cheap.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import resource
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List
+
+STATS_FILE_ENV = "DVC_STAGE_STATS_FILE"
+REAL_SHELL_ENV = "DVC_STAGE_REAL_SHELL"
+LIMITS_ENV = "DVC_STAGE_LIMITS"
+
+_RLIMITS = {
+    "cpu_seconds": resource.RLIMIT_CPU,
+    "memory_mb": resource.RLIMIT_AS,
+    "open_files": resource.RLIMIT_NOFILE,
+}
+
+# Flags DVC passes to shells it knows so they skip the user's rc files
+_SHELL_OPTIONS = {"zsh": ["--no-rcs"], "bash": ["--noprofile", "--norc"]}
+
+_shim_path = None
+
+def shell_path() -> str:
+    """
+    Path of an executable that runs this module with the server's Python.
+
+    SHELL has to name a single executable, so a small sh script is written
+    once per process.
+    """
+    global _shim_path
+    if _shim_path is None or not os.path.exists(_shim_path):
+        fd, path = tempfile.mkstemp(prefix="dvc-stage-shell-")
+        with os.fdopen(fd, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" "$@"\n')
+        os.chmod(path, 0o755)
+        _shim_path = path
+    return _shim_path
+
+def stage_env(stats_file: str = None, base: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Environment that makes DVC (or `run_command`) run stage commands through
+    this wrapper, recording per-stage statistics into `stats_file` if given.
+    """
+    env = dict(os.environ if base is None else base)
+    real_shell = env.get(REAL_SHELL_ENV) or env.get("SHELL") or "/bin/sh"
+    if os.path.basename(real_shell).startswith("dvc-stage-shell-"):
+        real_shell = "/bin/sh"
+    env[REAL_SHELL_ENV] = real_shell
+    env["SHELL"] = shell_path()
+    if stats_file:
+        env[STATS_FILE_ENV] = stats_file
+    return env
+
+def limited_argv(argv: List[str], limits: Dict[str, Any]) -> List[str]:
+    """
+    Command line running `argv` under `limits` through this wrapper.
+    """
+    return [shell_path(), "--limits", json.dumps(limits), "--", *argv]
+
+def apply_limits(limits: Dict[str, Any]):
+    """
+    Apply resource limits to the current process (and so to the processes it
+    starts afterwards); used right before exec.
+
+    Args:
+        limits (dict): "cpu_seconds", "memory_mb" and "open_files" rlimits
+            and the "cgroup" directory to join, all optional.
+    """
+    for name, which in _RLIMITS.items():
+        value = limits.get(name)
+        if not value:
+            continue
+        if name == "memory_mb":
+            value = value * 1024 * 1024
+        soft, hard = value, value
+        if name == "cpu_seconds":
+            # SIGXCPU at the soft limit, SIGKILL if it is ignored
+            hard = value + 5
+        current_hard = resource.getrlimit(which)[1]
+        if current_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, current_hard), min(hard, current_hard)
+        try:
+            resource.setrlimit(which, (soft, hard))
+        except (ValueError, OSError):
+            pass
+    if limits.get("cgroup"):
+        try:
+            with open(os.path.join(limits["cgroup"], "cgroup.procs"), "w") as f:
+                f.write(str(os.getpid()))
+        except OSError:
+            pass
+
+def current_cgroup() -> str:
+    """cgroup v2 directory of the current process, or None."""
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return os.path.join("/sys/fs/cgroup", line[3:].strip().lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+def oom_kills(cgroup: str) -> int:
+    """Number of processes the OOM killer took in a cgroup (v2)."""
+    if not cgroup:
+        return 0
+    try:
+        with open(os.path.join(cgroup, "memory.events"), "r") as f:
+            for line in f:
+                key, _, value = line.partition(" ")
+                if key == "oom_kill":
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def breached_limit(exit_code: int, cpu_time: float = 0, cgroup: str = None, oom_before: int = 0) -> str:
+    """
+    Name of the limit a command exceeded, judging by how it ended and by the
+    limits it ran under, or None.
+    """
+    if exit_code == -signal.SIGXCPU:
+        return "cpu_seconds"
+    if exit_code == -signal.SIGKILL:
+        cpu_limit = resource.getrlimit(resource.RLIMIT_CPU)[0]
+        if cpu_limit != resource.RLIM_INFINITY and cpu_time >= cpu_limit:
+            return "cpu_seconds"
+        if oom_kills(cgroup) > oom_before:
+            return "cgroup_memory"
+    return None
+
+def read_stage_stats(stats_file: str) -> List[Dict[str, Any]]:
+    """Records written by the wrapper, in the order the commands finished."""
+    records = []
+    try:
+        with open(stats_file, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+def summarize_stage_stats(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Combine the records of the commands of each stage into one entry per
+    stage, in the order the stages started.
+    """
+    stages: Dict[str, Dict[str, Any]] = {}
+    for record in sorted(records, key=lambda r: r["start_time"]):
+        name = record.get("stage") or record.get("command")
+        stage = stages.get(name)
+        if stage is None:
+            stages[name] = {**record, "name": name, "commands": 1}
+            stages[name].pop("stage", None)
+            stages[name].pop("command", None)
+            continue
+        stage["commands"] += 1
+        stage["end_time"] = max(stage["end_time"], record["end_time"])
+        stage["duration"] = round(stage["end_time"] - stage["start_time"], 3)
+        stage["exit_code"] = record["exit_code"] or stage["exit_code"]
+        stage["user_cpu"] = round(stage["user_cpu"] + record["user_cpu"], 3)
+        stage["system_cpu"] = round(stage["system_cpu"] + record["system_cpu"], 3)
+        stage["max_rss_mb"] = max(stage["max_rss_mb"], record["max_rss_mb"])
+        if record.get("limit"):
+            stage["limit"] = record["limit"]
+
+    for stage in stages.values():
+        stage["status"] = "completed" if stage["exit_code"] == 0 else "failed"
+        stage["start_time"] = datetime.fromtimestamp(stage["start_time"]).isoformat()
+        stage["end_time"] = datetime.fromtimestamp(stage["end_time"]).isoformat()
+    return list(stages.values())
+
+def main(argv: List[str]) -> int:
+    if argv[:1] == ["--limits"] and argv[2:3] == ["--"]:
+        try:
+            apply_limits(json.loads(argv[1]))
+        except ValueError:
+            pass
+        try:
+            os.execvp(argv[3], argv[3:])
+        except OSError as e:
+            print(f"{argv[3]}: {e.strerror}", file=sys.stderr)
+        return 127
+
+    real_shell = os.environ.get(REAL_SHELL_ENV) or "/bin/sh"
+    options = _SHELL_OPTIONS.get(os.path.basename(real_shell).lower(), [])
+    command = argv[-1] if argv else ""
+    try:
+        limits = json.loads(os.environ.get(LIMITS_ENV) or "{}")
+    except ValueError:
+        limits = {}
+    if limits:
+        # The wrapper takes the limits too, so the command inherits them
+        apply_limits(limits)
+    cgroup = current_cgroup()
+    oom_before = oom_kills(cgroup)
+
+    start_time = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execv(real_shell, [real_shell, *options, *argv])
+        finally:
+            os._exit(127)
+
+    # Hand termination requests over to the stage command. SIGINT is sent
+    # to the whole process group (Ctrl+C, cancelled executions), so the
+    # command already got it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for sig in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, lambda signum, frame: os.kill(pid, signum))
+
+    while True:
+        try:
+            _, status, usage = os.wait4(pid, 0)
+            break
+        except InterruptedError:
+            continue
+    end_time = time.time()
+    exit_code = os.waitstatus_to_exitcode(status)
+
+    stats_file = os.environ.get(STATS_FILE_ENV)
+    if stats_file:
+        record = {
+            "stage": os.environ.get("DVC_STAGE"),
+            "command": command,
+            "start_time": start_time,
+            "end_time": end_time,
+            "duration": round(end_time - start_time, 3),
+            "exit_code": exit_code,
+            "user_cpu": round(usage.ru_utime, 3),
+            "system_cpu": round(usage.ru_stime, 3),
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        }
+        limit = breached_limit(exit_code, usage.ru_utime + usage.ru_stime, cgroup, oom_before)
+        if limit:
+            record["limit"] = limit
+        try:
+            # One short O_APPEND write per record, so parallel stages do
+            # not interleave
+            fd = os.open(stats_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(record) + "\n").encode())
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    # Killed by a signal: exit like a shell would
+    return exit_code if exit_code >= 0 else 128 - exit_code
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
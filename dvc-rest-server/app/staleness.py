@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import asyncio
+import logging
+import configparser
+from typing import Any, Dict, List, Optional
+import yaml
+from app import scheduler
+from app import pipeline_index
+
+logger = logging.getLogger(__name__)
+
+# Hash cache of each project, next to DVC's own state in .dvc/tmp
+HASH_CACHE_FILE = os.path.join(".dvc", "tmp", "server-md5.db")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class StalenessUnsupported(Exception):
+    """Raised when a project uses features the native check does not model."""
+
+class HashCache:
+    """
+    Persistent (path, mtime, size, inode) -> md5 cache, so files that did
+    not change since the last check are never read again.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, inode INTEGER, md5 TEXT)"
+        )
+        self.hashed = 0
+        self.cached = 0
+
+    def md5(self, path: str, st: os.stat_result = None) -> str:
+        st = st or os.stat(path)
+        row = self.conn.execute(
+            "SELECT md5 FROM hashes WHERE path = ? AND mtime_ns = ? AND size = ? AND inode = ?",
+            (path, st.st_mtime_ns, st.st_size, st.st_ino),
+        ).fetchone()
+        if row:
+            self.cached += 1
+            return row[0]
+
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        md5 = digest.hexdigest()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hashes (path, mtime_ns, size, inode, md5) VALUES (?, ?, ?, ?, ?)",
+            (path, st.st_mtime_ns, st.st_size, st.st_ino, md5),
+        )
+        self.hashed += 1
+        return md5
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def cache_dir(project_path: str) -> str:
+    """Cache directory from .dvc/config and .dvc/config.local (default .dvc/cache)."""
+    directory = os.path.join(project_path, ".dvc", "cache")
+    for name in ("config", "config.local"):
+        config_path = os.path.join(project_path, ".dvc", name)
+        if not os.path.exists(config_path):
+            continue
+        parser = configparser.ConfigParser()
+        try:
+            parser.read(config_path)
+        except configparser.Error as e:
+            raise StalenessUnsupported(f"Cannot parse {config_path}: {e}")
+        if parser.has_option("cache", "dir"):
+            # Relative cache dirs are relative to the .dvc directory
+            directory = os.path.normpath(os.path.join(project_path, ".dvc", parser.get("cache", "dir")))
+    return directory
+
+def cache_object(cache_dir: str, md5: str) -> str:
+    return os.path.join(cache_dir, "files", "md5", md5[:2], md5[2:])
+
+class _Checker:
+    """Compares the workspace against the hashes recorded by DVC."""
+
+    def __init__(self, project_path: str, hashes: HashCache):
+        self.project_path = project_path
+        self.hashes = hashes
+        self.cache_dir = cache_dir(project_path)
+        self._states: Dict[str, Optional[str]] = {}
+
+    def _dir_state(self, path: str, entry: Dict[str, Any]) -> Optional[str]:
+        manifest_path = cache_object(self.cache_dir, entry["md5"])
+        if not os.path.exists(manifest_path):
+            # Without the manifest the directory hash cannot be compared
+            raise StalenessUnsupported(f"Directory manifest of {entry['path']} is not in the cache")
+        with open(manifest_path, "r") as f:
+            expected = {item["relpath"]: item["md5"] for item in json.load(f)}
+
+        actual = {}
+        for root, dirs, files in os.walk(path):
+            for filename in files:
+                file_path = os.path.join(root, filename)
+                relpath = os.path.relpath(file_path, path).replace(os.sep, "/")
+                if relpath not in expected:
+                    return "modified"
+                actual[relpath] = self.hashes.md5(file_path)
+        return None if actual == expected else "modified"
+
+    def state(self, path: str, entry: Dict[str, Any]) -> Optional[str]:
+        """
+        State of a dep/out recorded as `entry` in dvc.lock or a .dvc file:
+        None when unchanged, else "deleted" or "modified".
+        """
+        if path in self._states:
+            return self._states[path]
+        if not os.path.lexists(path):
+            state = "deleted"
+        elif entry.get("hash") != "md5" or "md5" not in entry:
+            # DVC 2.x entries use md5-dos2unix hashes
+            raise StalenessUnsupported(f"{entry.get('path')} uses a legacy hash")
+        elif entry["md5"].endswith(".dir"):
+            state = self._dir_state(path, entry) if os.path.isdir(path) else "modified"
+        elif os.path.isdir(path):
+            state = "modified"
+        else:
+            st = os.stat(path)
+            if "size" in entry and st.st_size != entry["size"]:
+                state = "modified"
+            else:
+                state = None if self.hashes.md5(path, st) == entry["md5"] else "modified"
+        self._states[path] = state
+        return state
+
+    def not_in_cache(self, entry: Dict[str, Any]) -> bool:
+        md5 = entry.get("md5")
+        return bool(md5) and not os.path.exists(cache_object(self.cache_dir, md5))
+
+_MISSING = object()
+
+def _lookup(params: Dict[str, Any], key: str):
+    value = params
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def _uncached_outs(stage: Dict[str, Any]) -> set:
+    """Outputs declared with `cache: false` in a dvc.yaml stage."""
+    uncached = set()
+    for key in ("outs", "metrics", "plots"):
+        for entry in stage.get(key) or []:
+            if isinstance(entry, dict):
+                for path, options in entry.items():
+                    if isinstance(options, dict) and options.get("cache") is False:
+                        uncached.add(str(path))
+    return uncached
+
+def _stage_params(stage: Dict[str, Any]) -> Dict[str, Optional[List[str]]]:
+    """Params of a dvc.yaml stage as {file: [keys] or None for the whole file}."""
+    result: Dict[str, Optional[List[str]]] = {}
+    for entry in stage.get("params") or []:
+        if isinstance(entry, dict):
+            for params_file, keys in entry.items():
+                result[params_file] = list(keys) if keys else None
+        else:
+            result.setdefault("params.yaml", [])
+            result["params.yaml"].append(str(entry))
+    return result
+
+def _find_dvc_files(project_path: str, lock_outs: set) -> List[str]:
+    """
+    Find the .dvc files of the project without descending into .git, .dvc
+    or tracked data directories.
+    """
+    dvc_files = []
+    pending = [project_path]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in (".git", ".dvc") or f"{entry.name}.dvc" in names:
+                    continue
+                if os.path.relpath(entry.path, project_path) in lock_outs:
+                    continue
+                pending.append(entry.path)
+            elif entry.name.endswith(".dvc"):
+                dvc_files.append(entry.path)
+            elif entry.name == "dvc.yaml" and directory != project_path:
+                raise StalenessUnsupported(f"Nested pipeline in {directory}")
+    return sorted(dvc_files)
+
+def compute_staleness(project_path: str) -> Dict[str, Any]:
+    """
+    Find the stale stages of a project from dvc.yaml, dvc.lock and the
+    workspace, like `dvc status` / `dvc repro --dry` would.
+
+    Returns:
+        dict: {"stale": [{"stage": str, "reasons": [...]}],
+               "files": {path: "modified" | "deleted" | "new" | "not in cache"},
+               "outs": [paths of all tracked outputs],
+               "hashed": files hashed, "cached": hashes served from the cache}
+
+    Raises:
+        StalenessUnsupported: If the project needs DVC itself to be checked
+            (templated stages, legacy hashes, nested pipelines...).
+    """
+    project_path = os.path.realpath(project_path)
+    if not os.path.isdir(os.path.join(project_path, ".dvc")):
+        raise StalenessUnsupported(f"DVC is not initialized in {project_path}")
+    if os.path.exists(os.path.join(project_path, ".dvcignore")):
+        with open(os.path.join(project_path, ".dvcignore"), "r") as f:
+            if any(line.strip() and not line.startswith("#") for line in f):
+                raise StalenessUnsupported(".dvcignore rules are not supported")
+
+    index = pipeline_index.get_index(project_path)
+    if "${" in json.dumps(index.config, default=str):
+        raise StalenessUnsupported("Templated dvc.yaml")
+    lock_stages = index.lock.get("stages") or {}
+
+    lock_outs = set()
+    for name, entry in lock_stages.items():
+        wdir = str((index.stages.get(name) or {}).get("wdir", "."))
+        for out in entry.get("outs") or []:
+            lock_outs.add(os.path.normpath(os.path.join(wdir, out["path"])))
+
+    hashes = HashCache(os.path.join(project_path, HASH_CACHE_FILE))
+    checker = _Checker(project_path, hashes)
+    params_files: Dict[str, Dict[str, Any]] = {"params.yaml": index.params}
+    stale: Dict[str, List[Dict[str, Any]]] = {}
+    files: Dict[str, str] = {}
+    outs: List[str] = []
+
+    def _params_file(name: str) -> Dict[str, Any]:
+        if name not in params_files:
+            path = os.path.join(project_path, name)
+            with open(path, "r") as f:
+                params_files[name] = (json.load(f) if name.endswith(".json") else yaml.safe_load(f)) or {}
+        return params_files[name]
+
+    def _check_entries(stage_dir: str, entries, kind: str, reasons: List[Dict[str, Any]], uncached: set = frozenset()):
+        for entry in entries or []:
+            path = os.path.normpath(os.path.join(stage_dir, entry["path"]))
+            relpath = os.path.relpath(path, project_path)
+            if kind == "out":
+                outs.append(relpath)
+            state = checker.state(path, entry)
+            cached = kind == "out" and entry["path"] not in uncached and entry.get("cache", True)
+            if state is None and cached and checker.not_in_cache(entry):
+                state = "not in cache"
+            if state is not None:
+                files.setdefault(relpath, state)
+                reasons.append({"type": kind, "path": relpath, "change": state})
+
+    try:
+        for name in index.order:
+            stage = index.stages[name] or {}
+            if "foreach" in stage or "matrix" in stage:
+                raise StalenessUnsupported(f"Stage '{name}' is parametrized")
+            stage_dir = os.path.join(project_path, str(stage.get("wdir", ".")))
+            reasons: List[Dict[str, Any]] = []
+            locked = lock_stages.get(name)
+
+            if stage.get("frozen"):
+                continue
+            if locked is None:
+                reasons.append({"type": "lock", "change": "not in dvc.lock"})
+                for out in index.outs[name] + index.metrics[name] + index.plots[name]:
+                    outs.append(os.path.relpath(os.path.join(stage_dir, out), project_path))
+            else:
+                if stage.get("cmd") != locked.get("cmd"):
+                    reasons.append({"type": "cmd", "change": "modified"})
+
+                locked_deps = {entry["path"] for entry in locked.get("deps") or []}
+                for dep in index.deps[name]:
+                    if dep not in locked_deps:
+                        reasons.append({"type": "dep", "path": dep, "change": "new"})
+                _check_entries(stage_dir, locked.get("deps"), "dep", reasons)
+
+                locked_outs = {entry["path"] for entry in locked.get("outs") or []}
+                for out in index.outs[name] + index.metrics[name] + index.plots[name]:
+                    if out not in locked_outs:
+                        reasons.append({"type": "out", "path": out, "change": "new"})
+                _check_entries(stage_dir, locked.get("outs"), "out", reasons, _uncached_outs(stage))
+
+                locked_params = locked.get("params") or {}
+                for params_file, keys in _stage_params(stage).items():
+                    recorded = locked_params.get(params_file, {})
+                    current = _params_file(params_file)
+                    for key in keys if keys is not None else list(current):
+                        value = _lookup(current, key)
+                        if key not in recorded:
+                            change = "new"
+                        elif value is _MISSING:
+                            change = "deleted"
+                        elif value != recorded[key]:
+                            change = "modified"
+                        else:
+                            continue
+                        files.setdefault(params_file, "modified")
+                        reasons.append({"type": "param", "path": params_file, "key": key, "change": change})
+
+            if stage.get("always_changed"):
+                reasons.append({"type": "always_changed", "change": "always changed"})
+            for upstream in index.upstream[name]:
+                if upstream in stale:
+                    reasons.append({"type": "upstream", "stage": upstream, "change": "stale"})
+            if reasons:
+                stale[name] = reasons
+
+        # Data tracked with `dvc add`
+        for dvc_file in _find_dvc_files(project_path, lock_outs):
+            with open(dvc_file, "r") as f:
+                content = yaml.safe_load(f) or {}
+            if content.get("deps"):
+                # Imports are checked against their source by DVC
+                raise StalenessUnsupported(f"{dvc_file} is an import")
+            reasons = []
+            _check_entries(os.path.dirname(dvc_file), content.get("outs"), "out", reasons)
+            if reasons:
+                stale[os.path.relpath(dvc_file, project_path)] = reasons
+    finally:
+        hashes.close()
+
+    return {
+        "stale": [{"stage": name, "reasons": reasons} for name, reasons in stale.items()],
+        "files": files,
+        "outs": outs,
+        "hashed": hashes.hashed,
+        "cached": hashes.cached,
+    }
+
+async def get_staleness(project_path: str) -> Dict[str, Any]:
+    """
+    Run `compute_staleness` in a worker thread.
+
+    Only files are read, so commands that merely read the project can run
+    at the same time.
+    """
+    started = time.monotonic()
+    try:
+        async with scheduler.project_lock(project_path, exclusive=False):
+            result = await asyncio.to_thread(compute_staleness, project_path)
+    except StalenessUnsupported:
+        raise
+    except Exception as e:
+        # e.g. unreadable dvc.lock: let DVC report the problem
+        raise StalenessUnsupported(f"Native staleness check failed: {str(e)}") from e
+    logger.info(
+        f"Staleness of {project_path}: {len(result['stale'])} stale stage(s), "
+        f"{result['hashed']} file(s) hashed, {result['cached']} cached, "
+        f"{time.monotonic() - started:.2f}s"
+    )
+    return result
+
+def format_dry_run(staleness: Dict[str, Any]) -> str:
+    """Describe the stale stages the way `dvc repro --dry` lists them."""
+    if not staleness["stale"]:
+        return "Data and pipelines are up to date."
+    lines = []
+    for item in staleness["stale"]:
+        if item["stage"].endswith(".dvc"):
+            continue
+        changes = []
+        for reason in item["reasons"]:
+            subject = reason.get("path") or reason.get("stage")
+            if subject is None:
+                changes.append(reason["change"] if reason["type"] in ("lock", "always_changed") else f"{reason['type']} {reason['change']}")
+                continue
+            if reason.get("key"):
+                subject = f"{subject}:{reason['key']}"
+            changes.append(f"{reason['type']} {subject} {reason['change']}")
+        lines.append(f"Stage '{item['stage']}' would run: {', '.join(changes)}")
+    return "\n".join(lines) if lines else "Data and pipelines are up to date."
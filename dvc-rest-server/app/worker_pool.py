@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import shlex
+import signal
+import asyncio
+import logging
+from asyncio.subprocess import PIPE
+from typing import Dict, List, Optional, Tuple
+from app import process_runner
+from app import resource_limits
+from app import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Number of pre-warmed DVC workers (0 disables the pool)
+POOL_SIZE = int(os.getenv("DVC_WORKER_POOL_SIZE", "2"))
+# How long a command waits for a free worker before starting a plain process
+ACQUIRE_TIMEOUT = float(os.getenv("DVC_WORKER_ACQUIRE_TIMEOUT", "2"))
+# Upper bound for one result line (stdout + stderr of a command)
+MAX_RESULT_BYTES = 256 * 1024 * 1024
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Commands using any of these need a real shell (pipes, redirects, globs...)
+_SHELL_CHARS = set("|&;<>()$`\\*?[]{}~\n")
+
+class WorkerCrashed(Exception):
+    """Raised when a worker dies while executing a job."""
+
+    def __init__(self, message: str, started: bool = True):
+        super().__init__(message)
+        # Whether the worker received the job, which may have run partly
+        self.started = started
+
+def to_dvc_argv(command: str) -> Optional[List[str]]:
+    """
+    Return the DVC arguments of a plain `dvc ...` command.
+
+    Returns None for anything that is not a dvc command or that relies on
+    shell features, since those must keep running through the shell.
+    """
+    stripped = command.strip()
+    if not stripped.startswith("dvc "):
+        return None
+    # Quotes are handled by shlex, anything else is left to the shell
+    if any(c in _SHELL_CHARS for c in stripped):
+        return None
+    try:
+        argv = shlex.split(stripped)
+    except ValueError:
+        return None
+    return argv[1:]
+
+class _Worker:
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.jobs = 0
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+class DvcWorkerPool:
+    """
+    Pool of long-lived processes that run `dvc` commands in-process.
+
+    Each worker imports DVC once and is recycled by the worker itself after
+    DVC_WORKER_MAX_JOBS jobs or when its RSS grows above
+    DVC_WORKER_MAX_RSS_MB. Workers that die are replaced automatically.
+    """
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._idle: "asyncio.Queue[_Worker]" = asyncio.Queue()
+        self._workers: Dict[int, _Worker] = {}
+        self._spawning = set()
+        self._closed = False
+
+    async def start(self):
+        """
+        Start the workers in the background. Commands issued before a worker
+        is ready simply run as plain processes.
+        """
+        for _ in range(self.size):
+            self._respawn()
+
+    def _respawn(self):
+        if self._closed:
+            return
+        task = asyncio.create_task(self._spawn())
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    async def _spawn(self):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "app.dvc_worker",
+                cwd=SERVER_DIR,
+                stdin=PIPE,
+                stdout=PIPE,
+                limit=MAX_RESULT_BYTES,
+                # Own process group, so killing the worker also kills the
+                # stage commands of the job it runs
+                start_new_session=True,
+            )
+        except Exception as e:
+            logger.error(f"Failed to start DVC worker: {e}")
+            return
+
+        try:
+            hello = json.loads(await process.stdout.readline() or b"{}")
+        except ValueError:
+            hello = {}
+        if not hello.get("ready"):
+            logger.error(f"DVC worker {process.pid} failed to start")
+            await self._kill(process)
+            return
+
+        worker = _Worker(process)
+        if self._closed:
+            await self._shutdown_worker(worker)
+            return
+        self._workers[worker.pid] = worker
+        self._idle.put_nowait(worker)
+        logger.info(f"DVC worker {worker.pid} ready")
+
+    async def run(self, argv: List[str], cwd: str = None, env: Dict[str, str] = None) -> Optional[Tuple[int, str, str]]:
+        """
+        Run `dvc <argv>` on a pooled worker.
+
+        Returns:
+            tuple: (returncode, stdout, stderr), or None when no worker became
+            available within ACQUIRE_TIMEOUT.
+
+        Raises:
+            WorkerCrashed: If the worker died while running the command.
+        """
+        if self._closed:
+            return None
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+
+        job = {"argv": argv, "cwd": cwd, "env": env}
+        started = False
+        try:
+            if worker.process.returncode is not None:
+                # Died while idle, the job can go elsewhere
+                raise WorkerCrashed(f"DVC worker {worker.pid} exited before running `dvc {' '.join(argv)}`", started=False)
+            worker.process.stdin.write(json.dumps(job).encode() + b"\n")
+            await worker.process.stdin.drain()
+            started = True
+            line = await worker.process.stdout.readline()
+            if not line:
+                raise WorkerCrashed(f"DVC worker {worker.pid} exited while running `dvc {' '.join(argv)}`")
+            result = json.loads(line)
+        except (asyncio.CancelledError, Exception) as e:
+            # The worker is in an unknown state: replace it
+            self._workers.pop(worker.pid, None)
+            if isinstance(e, asyncio.CancelledError):
+                # Interrupt the job so DVC releases its locks; with its job
+                # pipe closed the worker exits right after
+                worker.process.stdin.close()
+                await process_runner.terminate_process_group(worker.process)
+            else:
+                await self._kill(worker.process)
+            self._respawn()
+            if isinstance(e, (asyncio.CancelledError, WorkerCrashed)):
+                raise
+            raise WorkerCrashed(f"DVC worker {worker.pid} failed: {e}", started=started) from e
+
+        worker.jobs += 1
+        if result.get("recycle"):
+            logger.info(
+                f"Recycling DVC worker {worker.pid} after {worker.jobs} jobs "
+                f"({result.get('rss_mb')} MB RSS)"
+            )
+            self._workers.pop(worker.pid, None)
+            asyncio.create_task(self._shutdown_worker(worker))
+            self._respawn()
+        else:
+            self._idle.put_nowait(worker)
+
+        return result["returncode"], result["stdout"], result["stderr"]
+
+    async def _shutdown_worker(self, worker: _Worker, timeout: float = 5):
+        """Close the job pipe so the worker exits, killing it if it hangs."""
+        try:
+            worker.process.stdin.close()
+            await asyncio.wait_for(worker.process.wait(), timeout)
+        except (asyncio.TimeoutError, Exception):
+            await self._kill(worker.process)
+
+    async def _kill(self, process: asyncio.subprocess.Process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        await process.wait()
+
+    async def stop(self):
+        """
+        Stop every worker. Called on server shutdown.
+        """
+        self._closed = True
+        for task in list(self._spawning):
+            task.cancel()
+        workers = list(self._workers.values())
+        self._workers.clear()
+        await asyncio.gather(*(self._shutdown_worker(w) for w in workers), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "alive": len(self._workers),
+            "idle": self._idle.qsize(),
+        }
+
+_pool: Optional[DvcWorkerPool] = None
+
+async def start_pool():
+    """
+    Start the shared worker pool (no-op when DVC_WORKER_POOL_SIZE is 0).
+    """
+    global _pool
+    if POOL_SIZE <= 0 or _pool is not None:
+        return
+    _pool = DvcWorkerPool(POOL_SIZE)
+    await _pool.start()
+
+async def stop_pool():
+    """
+    Stop the shared worker pool.
+    """
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.stop()
+
+async def run_command(command: str, cwd: str = None, env: Dict[str, str] = None) -> Tuple[int, str, str]:
+    """
+    Run a shell command, using a pre-warmed DVC worker when possible.
+
+    Plain `dvc ...` commands are sent to the pool; everything else, and any
+    command no worker could be acquired for in time, runs as a plain process
+    through `process_runner.run_command`. A command whose worker crashed is
+    only run again if it never reached the worker or only reads: running a
+    repro, push or queued experiment twice is worse than reporting the
+    failure.
+
+    Returns:
+        tuple: (returncode, stdout, stderr)
+    """
+    argv = to_dvc_argv(command)
+    if _pool is not None and argv is not None:
+        try:
+            result = await _pool.run(argv, cwd=cwd, env=resource_limits.pooled_env(env, cwd))
+            if result is not None:
+                return result
+        except WorkerCrashed as e:
+            if e.started and not scheduler.is_read_only(command):
+                logger.error(f"{e}; not running `{command}` again")
+                return 1, "", f"{e}. The command may have been partly executed and was not retried."
+            logger.warning(f"{e}; running `{command}` in a new process")
+
+    return await process_runner.run_command(command, cwd=cwd, env=env)
@@ -0,0 +1,261 @@
+"""
+Pool of extra checkouts per project, so that jobs which must not touch the
+project's own checkout (evaluations, `dvc exp run --temp`) run side by side
+instead of one after another.
+
+Checkouts live in `<project>/.dvc/tmp/worktrees/<n>` (ignored by git and
+DVC) and are created the first time a project needs one. They are
+`git clone --shared` copies rather than `git worktree`s: they share the
+project's git objects and DVC cache (`cache.dir` points at the project's
+cache), but have refs of their own. `dvc exp run` updates refs/exps/stash
+and refs/exps/exec/*, so experiments in worktrees of one repository would
+fight over them.
+
+A leased checkout is at the project's current commit, with the changed and
+untracked files of the project's workspace copied over (so uncommitted
+params, code and dvc.lock are used as in the project) and the outputs of
+that dvc.lock checked out from the shared cache. It is reset when returned.
+"""
+import os
+import re
+import shlex
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List
+from app import scheduler
+from app import worker_pool
+from app import process_runner
+
+logger = logging.getLogger(__name__)
+
+# Checkouts kept per project (0 disables the pool)
+POOL_SIZE = int(os.getenv("PROJECT_WORKTREES", "2"))
+
+WORKTREES_DIR = os.path.join(".dvc", "tmp", "worktrees")
+
+# Experiment refs (refs/exps/<baseline sha>/<name>), not DVC's working refs
+EXPERIMENT_REF = re.compile(r"^refs/exps/[0-9a-f]{2}/[0-9a-f]{38}/[^/]+$")
+
+class WorkspaceNotCopied(Exception):
+    """Raised when a checkout cannot be brought to the project's workspace state."""
+
+def is_enabled() -> bool:
+    return POOL_SIZE > 0
+
+async def _run(command: str, cwd: str, key: str = None) -> str:
+    """
+    Run a command for a checkout. Commands are scheduled on the checkout
+    (`key`), never on the project itself, so they do not wait for a long
+    `dvc repro` holding the project.
+    """
+    async with scheduler.command_slot(command, key or cwd):
+        returncode, stdout, stderr = await worker_pool.run_command(command, cwd=cwd)
+    if returncode != 0:
+        raise Exception(f"Command '{command}' failed with return code {returncode}: {stderr or stdout}")
+    return stdout
+
+async def _project_head(project_path: str) -> str:
+    # Read without the project lock: a running repro holds it for minutes
+    returncode, stdout, stderr = await process_runner.run_command("git rev-parse HEAD", cwd=project_path)
+    if returncode != 0:
+        raise Exception(f"Could not read the commit of {project_path}: {stderr}")
+    return stdout.strip()
+
+async def _dvc_cache_dir(project_path: str) -> str:
+    returncode, stdout, stderr = await worker_pool.run_command("dvc cache dir", cwd=project_path)
+    if returncode != 0 or not stdout.strip():
+        return os.path.join(project_path, ".dvc", "cache")
+    return os.path.abspath(os.path.join(project_path, stdout.strip().splitlines()[-1]))
+
+async def _create(project_path: str, path: str):
+    """Clone the project into `path` and point it at the project's DVC cache."""
+    if os.path.isdir(os.path.join(path, ".git")):
+        # Left by an earlier server process
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    await _run(
+        f"git clone --quiet --shared --no-checkout {shlex.quote(project_path)} {shlex.quote(path)}",
+        cwd=os.path.dirname(path), key=path,
+    )
+    local_config = os.path.join(project_path, ".dvc", "config.local")
+    os.makedirs(os.path.join(path, ".dvc"), exist_ok=True)
+    if os.path.exists(local_config):
+        # Remotes and credentials set up for the project
+        shutil.copyfile(local_config, os.path.join(path, ".dvc", "config.local"))
+    cache_dir = await _dvc_cache_dir(project_path)
+    await _run(f"git checkout --quiet --detach {await _project_head(project_path)}", cwd=path)
+    await _run(f"dvc cache dir --local {shlex.quote(cache_dir)}", cwd=path)
+
+async def _reset(project_path: str, path: str):
+    """
+    Bring a checkout to the project's current commit: tracked files, the
+    outputs in dvc.lock, and no experiment refs or untracked files left.
+    """
+    head = await _project_head(project_path)
+    await _run(f"git checkout --quiet --detach --force {head}", cwd=path)
+    await _run("git clean --quiet -fd", cwd=path)
+    for ref in await _experiment_refs(path):
+        await _run(f"git update-ref -d {shlex.quote(ref)}", cwd=path)
+    await _run("dvc checkout --quiet --force", cwd=path)
+
+async def _workspace_changes(project_path: str) -> List[str]:
+    """Files of the project's workspace that differ from its commit, or are untracked."""
+    changes = []
+    # Read without the project lock, and without refreshing its index
+    for command in (
+        "git --no-optional-locks diff HEAD --name-only --no-renames -z",
+        "git --no-optional-locks ls-files --others --exclude-standard -z",
+    ):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=project_path)
+        if returncode != 0:
+            raise Exception(f"Could not read the workspace changes of {project_path}: {stderr}")
+        changes += [relpath for relpath in stdout.split("\0") if relpath]
+    return changes
+
+async def _copy_workspace(project_path: str, path: str):
+    """
+    Make a checkout match the project's workspace: copy the files changed
+    since the commit and the untracked ones, delete the deleted ones, and
+    check out the outputs of the workspace's dvc.lock and .dvc files.
+
+    Raises:
+        WorkspaceNotCopied: If those outputs are not in the cache.
+    """
+    changes = await _workspace_changes(project_path)
+    for relpath in changes:
+        source = os.path.join(project_path, relpath)
+        target = os.path.join(path, relpath)
+        if os.path.lexists(source):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target) and not os.path.isdir(target):
+                os.remove(target)
+            shutil.copy2(source, target, follow_symlinks=False)
+        elif os.path.lexists(target):
+            os.remove(target)
+    if any(os.path.basename(relpath) == "dvc.lock" or relpath.endswith(".dvc") for relpath in changes):
+        try:
+            await _run("dvc checkout --quiet --force", cwd=path)
+        except Exception as e:
+            raise WorkspaceNotCopied(f"The outputs of the workspace of {project_path} are not all in the cache: {e}")
+
+async def _experiment_refs(path: str) -> List[str]:
+    command = "git for-each-ref --format='%(refname)' refs/exps"
+    # The whole listing is needed, not the bounded output of _run
+    async with scheduler.command_slot(command, path):
+        returncode, stdout, stderr = await process_runner.capture_command(command, cwd=path)
+    if returncode != 0:
+        raise Exception(f"Command '{command}' failed with return code {returncode}: {stderr}")
+    return [ref for ref in stdout.split() if EXPERIMENT_REF.match(ref)]
+
+async def publish_experiments(path: str, project_path: str) -> List[str]:
+    """
+    Push the experiments created in a checkout to the project, where
+    `dvc exp show` and `dvc exp apply` find them.
+
+    Returns:
+        list: The experiment refs pushed.
+    """
+    refs = await _experiment_refs(path)
+    if refs:
+        refspecs = " ".join(shlex.quote(f"{ref}:{ref}") for ref in refs)
+        await _run(f"git push --quiet --force {shlex.quote(project_path)} {refspecs}", cwd=path)
+    return refs
+
+class WorktreePool:
+    """
+    Checkouts of one project. They are created on demand, up to `size`,
+    and reused afterwards; a checkout that cannot be reset is deleted and
+    created again the next time.
+    """
+
+    def __init__(self, project_path: str, size: int = POOL_SIZE):
+        self.project_path = project_path
+        self.size = size
+        self._idle: "asyncio.Queue[str]" = asyncio.Queue()
+        self._free_slots = list(range(size))
+        self._leased = set()
+
+    def _path(self, slot: int) -> str:
+        return os.path.join(self.project_path, WORKTREES_DIR, str(slot))
+
+    async def acquire(self) -> str:
+        if self._idle.empty() and self._free_slots:
+            path = self._path(self._free_slots.pop(0))
+            try:
+                await _create(self.project_path, path)
+                await _reset(self.project_path, path)
+            except BaseException:
+                self._free_slots.append(int(os.path.basename(path)))
+                raise
+        else:
+            path = await self._idle.get()
+            if not os.path.isdir(path):
+                # The project was deleted or cleaned in the meantime
+                await _create(self.project_path, path)
+                await _reset(self.project_path, path)
+        self._leased.add(path)
+        return path
+
+    async def release(self, path: str):
+        self._leased.discard(path)
+        try:
+            await _reset(self.project_path, path)
+        except Exception as e:
+            logger.error(f"Could not reset {path}, deleting it: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            self._free_slots.append(int(os.path.basename(path)))
+            return
+        self._idle.put_nowait(path)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "created": self.size - len(self._free_slots),
+            "idle": self._idle.qsize(),
+            "leased": len(self._leased),
+        }
+
+_pools: Dict[str, WorktreePool] = {}
+_loop = None
+
+def get_pool(project_path: str) -> WorktreePool:
+    global _loop
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:
+        _loop = loop
+        _pools.clear()
+    key = os.path.abspath(project_path)
+    if key not in _pools:
+        _pools[key] = WorktreePool(key)
+    return _pools[key]
+
+@asynccontextmanager
+async def lease(project_path: str):
+    """
+    Lease a checkout of the project, in the state of the project's
+    workspace, for the duration of the block, waiting while all of the
+    project's checkouts are leased.
+
+    Raises:
+        WorkspaceNotCopied: If the checkout cannot match the workspace;
+            callers run the job in the project instead.
+    """
+    pool = get_pool(project_path)
+    path = await pool.acquire()
+    try:
+        await _copy_workspace(project_path, path)
+        yield path
+    finally:
+        # Reset even when the job was cancelled
+        await asyncio.shield(pool.release(path))
+
+def leased_checkouts(project_path: str) -> List[str]:
+    """Checkouts of the project that are leased right now."""
+    pool = _pools.get(os.path.abspath(project_path))
+    return sorted(pool._leased) if pool is not None else []
+
+def stats() -> Dict[str, Dict[str, int]]:
+    return {key: pool.stats() for key, pool in _pools.items()}
@@ -1,7 +1,8 @@
 import asyncio
-from fastapi import FastAPI
-from app.routes import router
+from fastapi import FastAPI, HTTPException
+from app.routes import router, project_busy_handler
 from app.init_db import init_db, close_db
+from app import dvc_engine, worker_pool, pipeline_jobs, adaptive_sweep, dvc_handler
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
@@ -10,9 +11,18 @@ import uvicorn
 async def lifespan(app: FastAPI):
     # Startup: Initialize database connection
     await init_db()
+    # Pre-warm the DVC worker processes used for write commands
+    await worker_pool.start_pool()
+    # Start the pipeline execution queue workers
+    await pipeline_jobs.start_workers()
+    # Resume the adaptive sweeps whose driver stopped with the last server
+    adaptive_sweep.resume_sweeps(dvc_handler.REPO_ROOT)
     yield
-    # Shutdown: Close database connection
+    # Shutdown: Stop the queue, then close database connection, the DVC workers and the open DVC repos
+    await pipeline_jobs.stop_workers()
     await close_db()
+    await worker_pool.stop_pool()
+    dvc_engine.close_all()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -25,6 +35,9 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Answer reads that timed out on a busy project with 503
+app.add_exception_handler(HTTPException, project_busy_handler)
+
 # Include the router
 app.include_router(router)
 
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Test script for the experiment index.
+Checks ref parsing and filter translation; no DVC project or MongoDB needed.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import exp_index
+
+BASELINE = "3f2a" + "0" * 36
+REFS = "\n".join([
+    f"refs/exps/3f/{BASELINE[2:]}/lr-1 {'a' * 40} 1704103200 {BASELINE}",
+    f"refs/exps/3f/{BASELINE[2:]}/lr-2 {'b' * 40} 1704103500 {BASELINE}",
+    f"refs/exps/celery/stash {'c' * 40} 1704103600 {BASELINE}",
+    f"refs/exps/exec/EXEC_HEAD {'d' * 40} 1704103600 {BASELINE}",
+])
+
+def test_parse_refs():
+    print("\nTest 1: Experiment refs...")
+    refs = exp_index._parse_refs(REFS)
+    print(f"  {sorted(refs)}")
+    assert sorted(experiment["name"] for experiment in refs.values()) == ["lr-1", "lr-2"], "DVC's own refs were indexed"
+    experiment = refs[f"refs/exps/3f/{BASELINE[2:]}/lr-1"]
+    assert experiment["rev"] == "a" * 40 and experiment["baseline"] == BASELINE and experiment["parent"] == BASELINE
+    assert experiment["created_at"].startswith("2024-01-01")
+    assert exp_index._nest({"train.lr": 0.1, "train.optimizer": "adam", "seed": 1}) == {
+        "train": {"lr": 0.1, "optimizer": "adam"}, "seed": 1,
+    }
+    print("✅ Experiments parsed from their refs")
+
+def test_build_query():
+    print("\nTest 2: Filters...")
+    query = exp_index.build_query("u", "p", ["metrics.acc>=0.9", "params.train.optimizer==adam", "name~lr-", "params.train.lr!=0.1"])
+    print(f"  {query}")
+    assert query["user_id"] == "u" and query["project_id"] == "p"
+    conditions = query["$and"]
+    assert conditions[0] == {"metrics.acc": {"$gte": 0.9}}
+    assert conditions[1] == {"params.train.optimizer": {"$in": ["adam"]}}
+    assert conditions[2] == {"name": {"$regex": "lr\\-"}}
+    assert conditions[3] == {"params.train.lr": {"$exists": True, "$nin": [0.1, "0.1"]}}
+    assert "$and" not in exp_index.build_query("u", "p")
+    for bad in ["acc>0.9", "user_id==u", "metrics.acc"]:
+        try:
+            exp_index.build_query("u", "p", [bad])
+        except ValueError as e:
+            print(f"  {bad}: {e}")
+            continue
+        raise AssertionError(f"filter {bad} was accepted")
+    print("✅ Filters translated, bad filters rejected")
+
+def main():
+    print("🚀 Testing the experiment index")
+    print("=" * 50)
+    test_parse_refs()
+    test_build_query()
+    print("\n🎉 Experiment index tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script for experiment sweeps.
+Checks how grid, random and list specs expand into runs; no DVC project needed.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import exp_sweep
+from app import adaptive_sweep
+
+def test_grid():
+    print("\nTest 1: Grid sweep...")
+    runs = exp_sweep.expand_sweep(
+        grid={"train.lr": [0.01, 0.1], "train.activation": ["relu", "tanh"]},
+        set_param={"train.epochs": 5},
+    )
+    print(f"  Runs: {runs}")
+    assert len(runs) == 4
+    assert runs[0] == {"train.epochs": 5, "train.lr": 0.01, "train.activation": "relu"}
+    assert runs[-1] == {"train.epochs": 5, "train.lr": 0.1, "train.activation": "tanh"}
+    print("✅ Every combination generated")
+
+def test_random():
+    print("\nTest 2: Random sweep...")
+    spec = {
+        "train.lr": {"min": 1e-4, "max": 1e-1, "log": True},
+        "train.batch_size": {"min": 16, "max": 128, "int": True},
+        "train.optimizer": ["adam", "sgd"],
+    }
+    runs = exp_sweep.expand_sweep(random_spec=spec, samples=20, seed=7)
+    assert runs == exp_sweep.expand_sweep(random_spec=spec, samples=20, seed=7), "seeded sweeps differ"
+    for run in runs:
+        assert 1e-4 <= run["train.lr"] <= 1e-1
+        assert isinstance(run["train.batch_size"], int) and 16 <= run["train.batch_size"] <= 128
+        assert run["train.optimizer"] in ("adam", "sgd")
+    print(f"  First run: {runs[0]}")
+    print("✅ Samples within their ranges and reproducible")
+
+def test_invalid_specs():
+    print("\nTest 3: Invalid specs...")
+    invalid = [
+        {},
+        {"grid": {"a": [1]}, "runs": [{"a": 1}]},
+        {"grid": {"a": []}},
+        {"grid": {"a": list(range(100)), "b": list(range(100))}},
+        {"random_spec": {"a": {"min": 1, "max": 2}}},
+        {"random_spec": {"a": {"min": 0, "max": 1, "log": True}}, "samples": 3},
+        {"runs": []},
+    ]
+    for spec in invalid:
+        try:
+            exp_sweep.expand_sweep(**spec)
+        except ValueError as e:
+            print(f"  {list(spec)}: {e}")
+            continue
+        raise AssertionError(f"{spec} was accepted")
+    assert exp_sweep._override("train.act", "a,b") == "'train.act=\"a,b\"'"
+    print("✅ Invalid specs rejected")
+
+def test_successive_halving():
+    """Runs behind the best 1/reduction_factor at a rung are stopped"""
+    print("\nTest 4: Successive halving...")
+    rule = adaptive_sweep.SuccessiveHalving(min_steps=2, max_steps=20, reduction_factor=2, mode="max")
+    assert rule.rungs == [2, 4, 8, 16]
+
+    def history(final, steps):
+        # dvclive steps count from 0; the metric grows towards `final`
+        return [(step, final * (step + 1) / 20) for step in range(steps)]
+
+    assert rule.update("a", history(0.9, 1)) is None, "judged before the first rung"
+    assert rule.update("a", history(0.9, 3)) is None, "the first run at a rung is kept"
+    assert rule.update("b", history(0.5, 3)) == 2, "worse than the only other run at the rung"
+    assert rule.update("c", history(0.95, 5)) is None
+    assert rule.results("c") == {"2": 0.095, "4": 0.19}
+    # d passed two rungs between reads; it is judged from the first one on
+    assert rule.update("d", history(0.7, 6)) == 2
+    lower = adaptive_sweep.SuccessiveHalving(min_steps=1, max_steps=3, mode="min")
+    assert lower.update("x", [(0, 0.3)]) is None and lower.update("y", [(0, 0.5)]) == 1
+    print(f"  Rungs: {rule.recorded}")
+    print("✅ Trailing runs stopped at the right rungs")
+
+def main():
+    print("🚀 Testing experiment sweeps")
+    print("=" * 50)
+    test_grid()
+    test_random()
+    test_invalid_specs()
+    test_successive_halving()
+    print("\n🎉 Sweep tests passed!")
+
+if __name__ == "__main__":
+    main()
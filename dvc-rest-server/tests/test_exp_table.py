@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for the experiment table.
+Queries a hand-made table shaped like `dvc exp show`; no DVC project needed.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from app import exp_table
+
+COLUMNS = ["Experiment", "rev", "typ", "Created", "parent", "State", "Executor", "acc", "train.lr", "train.optimizer"]
+ROWS = [
+    [None, "workspace", "baseline", None, None, None, None, 0.81, 0.01, "adam"],
+    [None, "main", "baseline", "2024-01-01T10:00:00", None, None, None, 0.81, 0.01, "adam"],
+    ["lr-1", "1234567", "branch_commit", "2024-01-01T11:00:00", None, "Success", None, 0.85, 0.1, "adam"],
+    ["lr-2", "a1b2c3d", "branch_commit", "2024-01-01T11:05:00", None, "Success", None, 0.92, 0.05, "sgd"],
+    ["lr-3", "e4f5a6b", "branch_base", "2024-01-01T11:10:00", None, "Running", "workspace", None, 0.5, "sgd"],
+]
+GROUPS = {"metrics": ["acc"], "params": ["train.lr", "train.optimizer"], "deps": []}
+
+def table():
+    return pd.DataFrame(ROWS, columns=COLUMNS).infer_objects()
+
+def test_select_sort_page():
+    print("\nTest 1: Columns, sorting and pages...")
+    result = exp_table.query_table(table(), GROUPS, columns=["acc"], sort_by="acc", sort_order="desc", limit=2)
+    print(f"  {result['columns']}: {result['rows']}")
+    assert result["columns"] == ["Experiment", "rev", "acc"]
+    assert result["groups"] == {"metrics": ["acc"], "params": [], "deps": []}
+    assert result["total"] == 5 and [row[1] for row in result["rows"]] == ["a1b2c3d", "1234567"]
+    last = exp_table.query_table(table(), GROUPS, columns=["acc"], sort_by="acc", sort_order="desc", offset=4)
+    assert last["rows"] == [["lr-3", "e4f5a6b", None]], "empty cells are not last, or NaN leaked"
+    print("✅ Pages sorted with empty cells last")
+
+def test_filters():
+    print("\nTest 2: Filters...")
+    def revs(*filters):
+        return [row[1] for row in exp_table.query_table(table(), GROUPS, filters=list(filters))["rows"]]
+    assert revs("acc>0.84") == ["1234567", "a1b2c3d"]
+    assert revs("train.optimizer==sgd", "State!=Running") == ["a1b2c3d"]
+    assert revs("Experiment~lr-") == ["1234567", "a1b2c3d", "e4f5a6b"]
+    assert revs("train.lr <= 0.05") == ["workspace", "main", "a1b2c3d"]
+    for bad in ["acc", "loss>1", "acc>high", "State>a"]:
+        try:
+            revs(bad)
+        except ValueError as e:
+            print(f"  {bad}: {e}")
+            continue
+        raise AssertionError(f"filter {bad} was accepted")
+    print("✅ Rows filtered, bad filters rejected")
+
+def main():
+    print("🚀 Testing the experiment table")
+    print("=" * 50)
+    test_select_sort_page()
+    test_filters()
+    print("\n🎉 Experiment table tests passed!")
+
+if __name__ == "__main__":
+    main()
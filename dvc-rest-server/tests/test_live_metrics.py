@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for live experiment metrics.
+Writes DVCLive-style files into a temporary workspace; no DVC project needed.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import live_metrics
+
+def test_series_compaction():
+    print("\nTest 1: Compact series...")
+    series = live_metrics.MetricSeries(max_points=10)
+    for step in range(101):
+        series.add(step, step / 100)
+    points = series.snapshot()
+    print(f"  {len(points)} points kept: {[step for step, _ in points]}")
+    assert len(points) <= 11
+    assert points[0] == (0, 0.0) and points[-1] == (100, 1.0), "first or last point lost"
+    steps = [step for step, _ in points[:-1]]
+    assert len({b - a for a, b in zip(steps, steps[1:])}) == 1, "points are not evenly spread"
+    print("✅ Series thinned out evenly, last point kept")
+
+def test_tail():
+    print("\nTest 2: Tailing a step file...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "acc.tsv")
+        tail = live_metrics.TsvTail(path, "acc")
+        assert tail.read() == (False, []), "missing file"
+        with open(path, "w") as f:
+            f.write("step\tacc\n0\t0.5\n1\t0.6")
+        assert tail.read() == (False, [(0, 0.5)]), "incomplete line returned"
+        with open(path, "a") as f:
+            f.write("5\n2\t0.7\n")
+        assert tail.read() == (False, [(1, 0.65), (2, 0.7)])
+        assert tail.read() == (False, [])
+        # A new run in the workspace rewrites the file
+        os.remove(path)
+        with open(path, "w") as f:
+            f.write("step\tacc\n0\t0.1\n")
+        assert tail.read() == (True, [(0, 0.1)]), "restart not detected"
+    print("✅ Only new, complete lines read")
+
+def test_watcher():
+    print("\nTest 3: Watching a workspace...")
+
+    async def run():
+        with tempfile.TemporaryDirectory() as project:
+            plots = os.path.join(project, "dvclive", "plots", "metrics", "train")
+            os.makedirs(plots)
+            with open(os.path.join(plots, "loss.tsv"), "w") as f:
+                f.write("step\tloss\n0\t1.0\n1\t0.8\n")
+            with open(os.path.join(project, "dvclive", "metrics.json"), "w") as f:
+                json.dump({"train": {"loss": 0.8}, "step": 1}, f)
+
+            watcher = live_metrics.MetricsWatcher(project)
+            events = watcher.subscribe()
+            snapshot = await events.__anext__()
+            run = snapshot["runs"][live_metrics.WORKSPACE_RUN]
+            print(f"  Snapshot: {run['metrics']}")
+            assert run["metrics"] == {"train/loss": [[0, 1.0], [1, 0.8]]}
+            assert run["summary"]["step"] == 1
+
+            with open(os.path.join(plots, "loss.tsv"), "a") as f:
+                f.write("2\t0.7\n")
+            event = await asyncio.wait_for(events.__anext__(), 5)
+            print(f"  Update: {event}")
+            assert event["run"] == live_metrics.WORKSPACE_RUN
+            assert event["points"] == {"train/loss": [[2, 0.7]]}
+            await events.aclose()
+            assert not watcher.subscribers
+
+        try:
+            live_metrics.get_watcher("/tmp/project", "../other")
+        except ValueError as e:
+            print(f"  ../other: {e}")
+        else:
+            raise AssertionError("metrics_dir outside of the workspace accepted")
+
+    live_metrics.POLL_INTERVAL = 0.1
+    asyncio.run(run())
+    print("✅ New points pushed to subscribers")
+
+def main():
+    print("🚀 Testing live experiment metrics")
+    print("=" * 50)
+    test_series_compaction()
+    test_tail()
+    test_watcher()
+    print("\n🎉 Live metrics tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Test script for the fair-share command scheduler.
+Checks the order in which queued work is started; no DVC or MongoDB needed.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import scheduler
+
+def test_pick_next():
+    """Priority class first, then the user with the smallest running share"""
+    print("\nTest 1: Choosing the next queued job...")
+    queued = [
+        {"user_id": "alice", "priority": "batch", "queued_at": "2024-01-01T12:00:01"},
+        {"user_id": "alice", "priority": "normal", "queued_at": "2024-01-01T12:00:02"},
+        {"user_id": "bob", "priority": "normal", "queued_at": "2024-01-01T12:00:03"},
+        {"user_id": "carol", "priority": "interactive", "queued_at": "2024-01-01T12:00:04"},
+    ]
+    assert scheduler.pick_next(queued, {}, 0)["user_id"] == "carol"
+    assert scheduler.pick_next(queued[:3], {"alice": 1}, 0)["user_id"] == "bob"
+    assert scheduler.pick_next(queued[:3], {}, 0)["user_id"] == "alice"
+    # alice is at the quota: only bob's job may start
+    assert scheduler.pick_next(queued[:3], {"alice": 1}, 1)["user_id"] == "bob"
+    assert scheduler.pick_next(queued[:2], {"alice": 1}, 1) is None
+    print("✅ Jobs chosen in the expected order")
+
+def test_shortest_job_first():
+    """Shorter expected jobs go first, until a long one has waited long enough"""
+    print("\nTest 2: Shortest expected job first, with aging...")
+    now = datetime(2024, 1, 1, 12, 10)
+    long_job = {"user_id": "alice", "queued_at": "2024-01-01T12:00:00", "expected_duration": 7200}
+    short_job = {"user_id": "bob", "queued_at": "2024-01-01T12:09:00", "expected_duration": 60}
+    assert scheduler.pick_next([long_job, short_job], {}, 0, now=now) is short_job
+    # After two hours in the queue the long job is no longer overtaken
+    later = datetime(2024, 1, 1, 14, 10)
+    fresh_job = {**short_job, "queued_at": "2024-01-01T14:09:00"}
+    assert scheduler.pick_next([long_job, fresh_job], {}, 0, now=later) is long_job
+    # Jobs without history count as UNKNOWN_DURATION
+    unknown_job = {"user_id": "carol", "queued_at": "2024-01-01T12:09:00"}
+    assert scheduler.pick_next([long_job, unknown_job], {}, 0, now=now) is unknown_job
+    print("✅ Short jobs first, long jobs not starved")
+
+async def _grant_order(semaphore, jobs):
+    order = []
+
+    async def job(user, priority):
+        await semaphore.acquire(user, priority)
+        order.append(user)
+        await asyncio.sleep(0.01)
+        semaphore.release(user)
+
+    tasks = [asyncio.create_task(job(user, priority)) for user, priority in jobs]
+    await asyncio.gather(*tasks)
+    return order
+
+async def _check_fair_semaphore():
+    # One slot held by a blocker so every job queues before the first grant
+    semaphore = scheduler.FairSemaphore(1)
+    await semaphore.acquire("blocker")
+    jobs = [("alice", "normal")] * 6 + [("bob", "normal")] * 2 + [("carol", "interactive")]
+    pending = asyncio.create_task(_grant_order(semaphore, jobs))
+    await asyncio.sleep(0.05)
+    print(f"  Queued: {semaphore.stats()['queued']}")
+    semaphore.release("blocker")
+    order = await pending
+    print(f"  Order: {order}")
+    assert order[0] == "carol"
+    # bob is not left behind alice's backlog
+    assert order.index("bob") <= 2 and order[1:5].count("bob") == 2
+    print("✅ Interactive first, then slots shared between users")
+
+    print("\nTest 4: Per-user quota and cancelled waiters...")
+    scheduler.USER_MAX_CONCURRENCY = 1
+    try:
+        semaphore = scheduler.FairSemaphore(2)
+        await semaphore.acquire("alice")
+        waiting = asyncio.create_task(semaphore.acquire("alice"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done(), "alice got a second slot despite the quota"
+        await semaphore.acquire("bob")
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert semaphore.stats()["queued"] == 0
+        semaphore.release("alice")
+        semaphore.release("bob")
+        assert semaphore.in_use == 0
+    finally:
+        scheduler.USER_MAX_CONCURRENCY = 0
+    stats = semaphore.stats()
+    print(f"  Stats: {stats['classes']['normal']}")
+    print("✅ Quota respected and cancelled waiters removed")
+
+def test_fair_semaphore():
+    print("\nTest 3: Sharing command slots between users...")
+    asyncio.run(_check_fair_semaphore())
+
+def test_read_timeout():
+    print("\nTest 5: Reads of a busy project give up...")
+
+    async def repro(held, done):
+        async with scheduler.project_lock("/tmp/busy-project"):
+            held.set()
+            await done.wait()
+
+    async def read():
+        async with scheduler.project_lock("/tmp/busy-project", exclusive=False):
+            pass
+
+    async def run():
+        timeout = scheduler.READ_LOCK_TIMEOUT
+        scheduler.READ_LOCK_TIMEOUT = 0.1
+        held, done = asyncio.Event(), asyncio.Event()
+        writer = asyncio.create_task(repro(held, done))
+        try:
+            await held.wait()
+            try:
+                await read()
+            except scheduler.ProjectBusy as e:
+                print(f"  {e}")
+            else:
+                raise AssertionError("read entered a project held by a writer")
+            done.set()
+            await writer
+            # The timed out reader was not left registered
+            assert scheduler.stats()["projects"]["/tmp/busy-project"]["readers"] == 0
+            await read()
+        finally:
+            scheduler.READ_LOCK_TIMEOUT = timeout
+
+    asyncio.run(run())
+    print("✅ Reads time out with ProjectBusy instead of hanging")
+
+def main():
+    print("🚀 Testing the fair-share scheduler")
+    print("=" * 50)
+    test_pick_next()
+    test_shortest_job_first()
+    test_fair_semaphore()
+    test_read_timeout()
+    print("\n🎉 Scheduler tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test script for the pre-warmed DVC worker pool.
+Creates a throwaway DVC project and runs commands through the pool.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import worker_pool
+
+def test_command_routing():
+    """Only plain dvc commands go to the workers"""
+    print("\nTest 1: Command routing...")
+    assert worker_pool.to_dvc_argv("dvc repro train") == ["repro", "train"]
+    assert worker_pool.to_dvc_argv('dvc exp run -m "first run"') == ["exp", "run", "-m", "first run"]
+    assert worker_pool.to_dvc_argv("dvc add data/*.csv") is None
+    assert worker_pool.to_dvc_argv("dvc stage add -n s python s.py > out.txt") is None
+    assert worker_pool.to_dvc_argv("git commit -m 'msg'") is None
+    print("✅ Commands routed correctly")
+
+async def _check_pool(project_path: str):
+    await worker_pool.start_pool()
+    # Wait for the workers to import DVC
+    for _ in range(60):
+        if worker_pool._pool.stats()["idle"] == worker_pool._pool.size:
+            break
+        await asyncio.sleep(0.5)
+    print(f"  Pool: {worker_pool._pool.stats()}")
+
+    try:
+        start = time.time()
+        returncode, stdout, stderr = await worker_pool.run_command("dvc status", cwd=project_path)
+        print(f"  dvc status took {time.time() - start:.2f}s")
+        assert returncode == 0, stderr
+
+        returncode, stdout, stderr = await worker_pool.run_command("dvc not-a-command", cwd=project_path)
+        assert returncode != 0
+        assert "invalid choice" in stderr
+        print("✅ Pooled commands return output and exit codes")
+
+        print("\nTest 3: Falling back when a worker crashes...")
+        worker = next(iter(worker_pool._pool._workers.values()))
+        worker.process.kill()
+        await asyncio.sleep(0.2)
+        results = await asyncio.gather(*[
+            worker_pool.run_command("dvc status", cwd=project_path)
+            for _ in range(worker_pool._pool.size)
+        ])
+        assert all(result[0] == 0 for result in results)
+        print("✅ Commands still succeed after a worker crash")
+    finally:
+        await worker_pool.stop_pool()
+
+def test_pool():
+    print("\nTest 2: Running commands on the pool...")
+    with tempfile.TemporaryDirectory() as project_path:
+        os.system(f"cd {project_path} && dvc init --no-scm -q")
+        asyncio.run(_check_pool(project_path))
+
+def main():
+    print("🚀 Testing DVC Worker Pool")
+    print("=" * 50)
+
+    test_command_routing()
+    test_pool()
+
+    print("\n🎉 Worker pool tests completed!")
+
+if __name__ == "__main__":
+    main()
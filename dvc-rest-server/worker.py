@@ -0,0 +1,51 @@
+"""
+Standalone pipeline worker.
+
+Claims queued pipeline executions from MongoDB and runs them in the project
+workspaces under REPO_ROOT. Start as many as the machine has room for:
+
+    python worker.py --concurrency 2
+
+Set PIPELINE_QUEUE_WORKERS=0 on the API server to leave every execution to
+the standalone workers.
+"""
+import os
+import signal
+import asyncio
+import argparse
+import logging
+from app.init_db import init_db, close_db
+from app import dvc_engine, worker_pool, pipeline_jobs
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("pipeline_worker")
+
+async def run_worker(concurrency: int):
+    await init_db()
+    await worker_pool.start_pool()
+    await pipeline_jobs.start_workers(concurrency)
+    logger.info(f"Pipeline worker {os.getpid()} started with {concurrency} slot(s)")
+
+    # Stop on SIGTERM/SIGINT; running executions are re-queued
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info(f"Pipeline worker {os.getpid()} stopping")
+    await pipeline_jobs.stop_workers()
+    await worker_pool.stop_pool()
+    await close_db()
+    dvc_engine.close_all()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued DVC pipeline executions")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("PIPELINE_WORKER_CONCURRENCY", "1")),
+        help="Number of executions this process runs at the same time",
+    )
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.concurrency))